@@ -11,5 +11,8 @@ setup(
     url="https://github.com/SoftwareDefinedBuildings/bw2python",
     packages=["bw2python"],
     package_dir={'bw2python': 'src'},
-    install_requires = ['msgpack-python']
+    install_requires = ['msgpack-python'],
+    extras_require = {
+        'numpy': ['numpy'],
+    }
 )
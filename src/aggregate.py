@@ -0,0 +1,133 @@
+import threading
+import time
+import traceback
+
+import numpy as np
+
+import ponames
+from bwtypes import PayloadTypeFilter, dottedToNum, inflateBody
+from numeric import DOUBLE_DTYPE
+
+# The aggregates of one window: parallel arrays with one entry per URI that
+# received values during [start, end)
+class WindowAggregates(object):
+    def __init__(self, start, end, uris, count, mean, min_, max_):
+        self.start = start
+        self.end = end
+        self.uris = uris
+        self.count = count
+        self.mean = mean
+        self.min = min_
+        self.max = max_
+
+    def __len__(self):
+        return len(self.uris)
+
+# Downsamples numeric subscription streams. Payload bodies of po_type are
+# appended, undecoded, to a per-URI buffer as frames arrive. When a window of
+# window seconds closes, every buffer is decoded with np.frombuffer and the
+# count, mean, min and max of each URI are computed in one vectorized pass,
+# and handler is called once with a WindowAggregates. Windows are aligned to
+# multiples of window in wall clock time, and windows in which nothing
+# arrived are skipped.
+#
+#   aggregator = WindowAggregator(storeAggregates, 60.0)
+#   bw_client.subscribeAggregated("building/+/temp", aggregator)
+class WindowAggregator(object):
+    def __init__(self, handler, window, po_type=ponames.PODFDouble, dtype=DOUBLE_DTYPE):
+        if window <= 0:
+            raise ValueError("Window must be positive")
+        self.handler = handler
+        self.window = window
+        self.po_filter = PayloadTypeFilter(po_type)
+        self.dtype = np.dtype(dtype)
+        self.lock = threading.Lock()
+        self.buffers = {}
+        self.window_start = self._windowStart(time.time())
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _windowStart(self, timestamp):
+        return (timestamp // self.window) * self.window
+
+    # Takes a raw "rslt" frame, as a Client frame handler
+    def addFrame(self, frame):
+        if frame.getFirstValue("finished") == "true":
+            return
+        uri = frame.getFirstValue("uri")
+        if len(frame.raw_payload_objects) > 0:
+            for type_str, body in frame.raw_payload_objects:
+                if self.po_filter.matches(type_str):
+                    self._append(uri, inflateBody(body))
+        else:
+            self._appendPayloadObjects(uri, frame.payload_objects)
+
+    # Takes a BosswaveResult, as a subscription result handler
+    def addResult(self, result):
+        if result.payload_objects is not None:
+            self._appendPayloadObjects(result.uri, result.payload_objects)
+
+    def _appendPayloadObjects(self, uri, payload_objects):
+        for po in payload_objects:
+            type_num = po.type_num
+            if type_num is None:
+                type_num = dottedToNum(po.type_dotted)
+            if self.po_filter.matchesTypeNum(type_num):
+                self._append(uri, po.content)
+
+    def _append(self, uri, body):
+        extra = len(body) % self.dtype.itemsize
+        if extra != 0:
+            body = body[:len(body)-extra]
+        with self.lock:
+            buf = self.buffers.get(uri)
+            if buf is None:
+                buf = bytearray()
+                self.buffers[uri] = buf
+            buf += body
+
+    def _closeWindow(self, end):
+        with self.lock:
+            buffers = self.buffers
+            self.buffers = {}
+            start = self.window_start
+            self.window_start = end
+
+        uris = []
+        arrays = []
+        for uri, buf in buffers.iteritems():
+            if len(buf) > 0:
+                uris.append(uri)
+                arrays.append(np.frombuffer(buffer(buf), dtype=self.dtype))
+        if len(uris) == 0:
+            return
+
+        count = np.array([len(values) for values in arrays])
+        values = np.concatenate(arrays).astype(np.float64)
+        offsets = np.cumsum(count) - count
+        total = np.add.reduceat(values, offsets)
+        aggregates = WindowAggregates(start, end, uris, count, total / count,
+                                      np.minimum.reduceat(values, offsets),
+                                      np.maximum.reduceat(values, offsets))
+        self.handler(aggregates)
+
+    def _run(self):
+        while True:
+            end = self.window_start + self.window
+            if self.stopped.wait(max(end - time.time(), 0)):
+                return
+            # A failing handler loses only its own window
+            try:
+                self._closeWindow(end)
+            except Exception:
+                traceback.print_exc()
+
+    # Stops closing windows. The open window is passed to the handler, cut
+    # short, if flush is set.
+    def close(self, flush=True):
+        self.stopped.set()
+        self.thread.join()
+        if flush:
+            self._closeWindow(time.time())
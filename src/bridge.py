@@ -0,0 +1,107 @@
+import collections
+import socket
+
+from bwtypes import Frame, UNACKED_SEQ_NUM, frameHeader
+from client import DEFAULT_ERROR_SAMPLE_SIZE
+
+# Relayed payload sections longer than this are sent straight from the
+# received frame's bytes rather than being joined with the new items first
+STREAM_THRESHOLD = 65536
+
+# A publish frame whose payload object items are a slice of the bytes of a
+# received frame, from offset to its "end" line
+class _RelayFrame(Frame):
+    def __init__(self, command, source, offset):
+        Frame.__init__(self, command, UNACKED_SEQ_NUM)
+        self.source = source
+        self.offset = offset
+
+    def _headSegments(self):
+        # Drops the "end" line, which the source slice ends with
+        return self._bodySegments()[:-1]
+
+    def serializeBody(self):
+        return "".join(self._headSegments()) + self.source[self.offset:]
+
+    def isStreamed(self):
+        return len(self.source) - self.offset > STREAM_THRESHOLD
+
+    def writeToSocket(self, sock):
+        if not self.isStreamed():
+            sock.sendall(self.serialize())
+            return
+        head = "".join(self._headSegments())
+        body_length = len(head) + len(self.source) - self.offset
+        sock.sendall(frameHeader(self.command, body_length, self.seq_num) + head)
+        sock.sendall(buffer(self.source, self.offset))
+
+# Republishes messages received by one client through another, typically
+# connected to a different agent, without decoding them. Each result is
+# relayed as the bytes of its payload objects, exactly as received, behind a
+# new URI and access chain. URIs under source_prefix are moved under
+# dest_prefix. Relayed messages are published unacknowledged, so failures
+# are counted in dest_client.unacked_stats. Messages that could not be
+# written to dest_client at all are counted in dropped, and never affect
+# source_client's connection.
+#
+#   bridge = Bridge(site_client, cloud_client, "site.ns/sensors/*",
+#                   source_prefix="site.ns/", dest_prefix="cloud.ns/site/",
+#                   dest_access_chain=cloud_chain)
+class Bridge(object):
+    def __init__(self, source_client, dest_client, uri, source_prefix=None, dest_prefix=None,
+                 primary_access_chain=None, dest_access_chain=None, auto_chain=False,
+                 persist=False):
+        if (source_prefix is None) != (dest_prefix is None):
+            raise ValueError("source_prefix and dest_prefix must be given together")
+        self.source_client = source_client
+        self.dest_client = dest_client
+        self.source_prefix = source_prefix
+        self.dest_prefix = dest_prefix
+        self.dest_access_chain = dest_access_chain
+        self.auto_chain = auto_chain
+        self.command = "pers" if persist else "publ"
+        self.relayed = 0
+        self.dropped = 0
+        self.recent_errors = collections.deque(maxlen=DEFAULT_ERROR_SAMPLE_SIZE)
+        self.handle = source_client.subscribeRaw(uri, self._relay,
+                                                 primary_access_chain=primary_access_chain,
+                                                 auto_chain=auto_chain)
+
+    def _destUri(self, uri):
+        if self.source_prefix is not None and uri.startswith(self.source_prefix):
+            return self.dest_prefix + uri[len(self.source_prefix):]
+        return uri
+
+    # Runs on the source client's listener thread
+    def _relay(self, frame):
+        if frame.getFirstValue("finished") == "true":
+            return
+        uri = frame.getFirstValue("uri")
+        if uri is None:
+            return
+
+        if frame.raw_po_offset is not None:
+            relay_frame = _RelayFrame(self.command, frame.raw, frame.raw_po_offset)
+        else:
+            # Payload objects were not contiguous; copy their raw bodies
+            relay_frame = Frame(self.command, UNACKED_SEQ_NUM)
+            relay_frame.raw_payload_objects = frame.raw_payload_objects
+        relay_frame.addKVPair("uri", self._destUri(uri))
+        if self.dest_access_chain is not None:
+            relay_frame.addKVPair("primary_access_chain", self.dest_access_chain)
+        auto_chain = self.auto_chain
+        if self.dest_client.default_auto_chain is not None:
+            auto_chain = self.dest_client.default_auto_chain
+        if auto_chain:
+            relay_frame.addKVPair("autochain", "true")
+
+        try:
+            self.dest_client._writeFrame(relay_frame)
+        except socket.error as e:
+            self.dropped += 1
+            self.recent_errors.append(str(e))
+            return
+        self.relayed += 1
+
+    def close(self):
+        self.source_client.unsubscribe(self.handle)
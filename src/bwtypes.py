@@ -1,5 +1,10 @@
+import array
 import contextlib
+import mmap
+import os
 import random
+import tempfile
+import zlib
 
 def _validate_payload_type_num(type_num):
     return 0 <= type_num
@@ -8,8 +13,13 @@ def _validate_payload_type_dotted(type_dotted):
     return len(type_dotted) == 4 and all([0 <= x < 255 for x in type_dotted])
 
 def _validate_payload_type_both(type_dotted, type_num):
-    octet_val = (type_dotted[0] << 24) + (type_dotted[1] << 16) + (type_dotted[2] << 8) + type_dotted[3]
-    return octet_val == type_num
+    return dottedToNum(type_dotted) == type_num
+
+def dottedToNum(type_dotted):
+    return (type_dotted[0] << 24) + (type_dotted[1] << 16) + (type_dotted[2] << 8) + type_dotted[3]
+
+def numToDotted(type_num):
+    return ((type_num >> 24) & 0xFF, (type_num >> 16) & 0xFF, (type_num >> 8) & 0xFF, type_num & 0xFF)
 
 class RoutingObject(object):
     def __init__(self, number, content):
@@ -39,7 +49,130 @@ class PayloadObject(object):
 
         self.content = content
 
+    # The body as sent on the wire, which may differ from content
+    def wireContent(self):
+        return self.content
+
+    # The body decoded by the codec registered for the payload's type (see
+    # pocodecs.py). Decoding happens on first access and is cached until the
+    # content changes.
+    @property
+    def value(self):
+        import pocodecs
+        content = self.content
+        decoded = getattr(self, "_decoded", None)
+        if decoded is None or decoded[0] is not content:
+            decoded = (content, pocodecs.decodePayload(self))
+            self._decoded = decoded
+        return decoded[1]
+
+    # Creates a payload object of the given type (a dotted tuple or a number)
+    # holding value, encoded with the type's registered codec
+    @classmethod
+    def encode(cls, po_type, value):
+        import pocodecs
+        return pocodecs.encodePayload(po_type, value)
+
+COMPRESSED_MAGIC = "\x00BW2Z\x01"
+
+# Returns a received payload body as it was published, inflated if the
+# sender compressed it
+def inflateBody(body):
+    if body.startswith(COMPRESSED_MAGIC):
+        return zlib.decompress(buffer(body, len(COMPRESSED_MAGIC)))
+    return body
+
+# A payload object whose body was compressed by the sender (see
+# compression.py). The wire form is COMPRESSED_MAGIC followed by a zlib
+# stream. Received payloads with this prefix become CompressedPayloadObjects
+# automatically, and are only inflated when .content is first read.
+class CompressedPayloadObject(PayloadObject):
+    def __init__(self, type_dotted, type_num, compressed):
+        PayloadObject.__init__(self, type_dotted, type_num, None)
+        self.compressed = compressed
+
+    @property
+    def content(self):
+        if self._content is None:
+            self._content = zlib.decompress(buffer(self.compressed, len(COMPRESSED_MAGIC)))
+        return self._content
+
+    @content.setter
+    def content(self, content):
+        self._content = content
+
+    def wireContent(self):
+        return self.compressed
+
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+# A payload object whose body is a region of a file. On publish, the body is
+# streamed from the file to the socket instead of being held in memory. The
+# parser also produces these for received bodies above its spill threshold.
+# Reading .content loads the body into memory.
+class FilePayloadObject(PayloadObject):
+    def __init__(self, type_dotted, type_num, source, offset=0, length=None):
+        PayloadObject.__init__(self, type_dotted, type_num, None)
+        if isinstance(source, basestring):
+            self.file = open(source, "rb")
+        else:
+            self.file = source
+        if length is None:
+            length = os.fstat(self.file.fileno()).st_size - offset
+        self.offset = offset
+        self.length = length
+
+    @property
+    def content(self):
+        if self._content is None:
+            if self.length == 0:
+                self._content = ""
+            else:
+                mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    self._content = mm[self.offset:self.offset+self.length]
+                finally:
+                    mm.close()
+        return self._content
+
+    @content.setter
+    def content(self, content):
+        self._content = content
+
+    def chunks(self, chunk_size=STREAM_CHUNK_SIZE):
+        mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            position = self.offset
+            end = self.offset + self.length
+            while position < end:
+                yield mm[position:min(position + chunk_size, end)]
+                position += chunk_size
+        finally:
+            mm.close()
+
+    def writeToSocket(self, sock):
+        if self.length == 0:
+            return
+        sendfile = getattr(os, "sendfile", None)
+        if sendfile is not None and hasattr(sock, "fileno"):
+            position = self.offset
+            end = self.offset + self.length
+            while position < end:
+                position += sendfile(sock.fileno(), self.file.fileno(), position,
+                                     end - position)
+        else:
+            for chunk in self.chunks():
+                sock.sendall(chunk)
+
+    def close(self):
+        self.file.close()
+
 FRAME_HEADER_LEN = 27
+# Sequence number of requests sent without tracking their responses
+UNACKED_SEQ_NUM = 0
+
+def frameHeader(command, body_length, seq_num):
+    return "{0} {1:010d} {2:010d}\n".format(command, body_length, seq_num)
 
 class Frame(object):
     def __init__(self, command, seq_num):
@@ -47,7 +180,35 @@ class Frame(object):
         self.seq_num = seq_num
         self.kv_pairs = []
         self.routing_objects = []
-        self.payload_objects = []
+        self._payload_objects = []
+        # Payload objects received as (type string, body) pairs that have not
+        # yet been turned into PayloadObject instances
+        self.raw_payload_objects = []
+        self.raw = None
+        # Offset in raw of the first payload object item, when all payload
+        # objects follow the other items, as the agent sends them
+        self.raw_po_offset = None
+
+    @staticmethod
+    def _makePayloadObject(type_str, body):
+        po_type = _lookupPayloadType(type_str)
+        if body.startswith(COMPRESSED_MAGIC):
+            return CompressedPayloadObject(po_type[0], po_type[1], body)
+        return PayloadObject(po_type[0], po_type[1], body)
+
+    # Payload objects are only constructed when they are first accessed
+    @property
+    def payload_objects(self):
+        if len(self.raw_payload_objects) > 0:
+            for type_str, body in self.raw_payload_objects:
+                self._payload_objects.append(Frame._makePayloadObject(type_str, body))
+            self.raw_payload_objects = []
+        return self._payload_objects
+
+    @payload_objects.setter
+    def payload_objects(self, pos):
+        self.raw_payload_objects = []
+        self._payload_objects = pos
 
     def addKVPair(self, key, value):
         self.kv_pairs.append((key, value))
@@ -64,6 +225,16 @@ class Frame(object):
     def addPayloadObjects(self, pos):
         self.payload_objects += pos
 
+    # Once any payload object has been constructed, as spilled ones are by the
+    # parser, the rest are constructed too, so that they all stay in order in
+    # one list. raw_payload_objects is therefore only non-empty when it holds
+    # every payload object of the frame.
+    def addRawPayloadObject(self, type_str, body):
+        if len(self._payload_objects) > 0:
+            self._payload_objects.append(Frame._makePayloadObject(type_str, body))
+        else:
+            self.raw_payload_objects.append((type_str, body))
+
     def getFirstValue(self, key):
         matchingValues = [y for x,y in self.kv_pairs if x == key]
         if len(matchingValues) > 0:
@@ -71,17 +242,22 @@ class Frame(object):
         else:
             return None
 
-    def writeToSocket(self, sock):
-        body = "{0} 0000000000 {1:010d}\n".format(self.command, self.seq_num)
+    # Returns the frame's body as a list of strings. If stream is set, the
+    # bodies of FilePayloadObjects are left in the list as the objects
+    # themselves so that they can be streamed from their files.
+    def _bodySegments(self, stream=False):
+        items = []
         for (key, value) in self.kv_pairs:
-            body += "kv {0} {1}\n".format(key, len(value))
-            body += value + "\n"
+            items.append("kv {0} {1}\n".format(key, len(value)))
+            items.append(value)
+            items.append("\n")
 
         for ro in self.routing_objects:
-            body += "ro {0} {1}\n".format(ro.number, len(ro.content))
-            body += ro.content + "\n"
+            items.append("ro {0} {1}\n".format(ro.number, len(ro.content)))
+            items.append(ro.content)
+            items.append("\n")
 
-        for po in self.payload_objects:
+        for po in self._payload_objects:
             type_str = ""
             if po.type_dotted is not None:
                 type_str += "{0}.{1}.{2}.{3}".format(*po.type_dotted)
@@ -89,102 +265,396 @@ class Frame(object):
             if po.type_num is not None:
                 type_str += str(po.type_num)
 
-            body += "po {0} {1}\n".format(type_str, len(po.content))
-            body += po.content + "\n"
+            if stream and isinstance(po, FilePayloadObject):
+                items.append("po {0} {1}\n".format(type_str, po.length))
+                items.append(po)
+            else:
+                body = po.wireContent()
+                items.append("po {0} {1}\n".format(type_str, len(body)))
+                items.append(body)
+            items.append("\n")
 
-        body += "end\n"
-        sock.sendall(body)
+        for type_str, body in self.raw_payload_objects:
+            items.append("po {0} {1}\n".format(type_str, len(body)))
+            items.append(body)
+            items.append("\n")
 
-    @classmethod
-    def readFromSocket(cls, socket):
-        frame_header = socket.recv(FRAME_HEADER_LEN)
-        header_items = frame_header.split(' ')
-        if len(header_items) != 3:
-            raise ValueError("Frame header must contain 3 fields")
-
-        command = header_items[0]
-        frame_length = int(header_items[1])
-        if frame_length < 0:
-            raise ValueError("Negative frame length")
-        seq_no = int(header_items[2])
-        frame = cls(command, seq_no)
-
-        needed_bytes = frame_length
-        buff = ""
-        while needed_bytes > 0:
-            just_received = socket.recv(needed_bytes)
-            needed_bytes -= len(just_received)
-            buff += just_received
-
-        next_line_break = buff.find('\n')
-        if next_line_break == -1:
-            raise ValueError("Invalid Frame: No newline found")
-        current_line = buff[:next_line_break]
-        buff = buff[next_line_break+1:]
-
-        while current_line != 'end':
-            fields = current_line.split(' ')
-            if len(fields) != 3:
-                raise ValueError("Invalid item header: " + current_line)
-
-            if fields[0] == "kv":
-                key = fields[1]
-                value_len = int(fields[2])
-                value = buff[:value_len]
-                frame.addKVPair(key, value)
-
-                # Need +1 to strip trailing \n
-                buff = buff[value_len+1:]
-
-            elif fields[0] == "ro":
-                ro_num = int(fields[1])
-                body_len = int(fields[2])
-                body = buff[:body_len]
-                ro = RoutingObject(ro_num, body)
-                frame.addRoutingObject(ro)
-
-                # Need +1 to strip trailing \n
-                buff = buff[body_len+1:]
-
-            elif fields[0] == "po":
-                body_len = int(fields[2])
-                body = buff[:body_len]
-                # Need +1 to strip trailing \n
-                buff = buff[body_len+1:]
-
-                po_type = fields[1]
-                if ':' not in po_type:
-                    raise ValueError("Inavlid payload object type: " + po_type)
-                if po_type.startswith(':'):
-                    po_type_num = int(po_type[1:])
-                    po_type_dotted = None
-                elif po_type.endswith(':'):
-                    po_type_dotted = tuple([int(x) for x in po_type[:-1].split('.')])
-                    po_type_num = None
-                else:
-                    type_tokens = po_type.split(':')
-                    if len(type_tokens) != 2:
-                        raise ValueError("Invalid payload object type: " + po_type)
-                    po_type_dotted = tuple([int(x) for x in type_tokens[0].split('.')])
-                    po_type_num = int(type_tokens[1])
+        items.append("end\n")
+        return items
 
-                po = PayloadObject(po_type_dotted, po_type_num, body)
-                frame.addPayloadObject(po)
+    def serializeBody(self):
+        return "".join(self._bodySegments())
 
-            else:
-                raise ValueError("Invalid item header: " + current_line)
+    def serialize(self):
+        body = self.serializeBody()
+        return frameHeader(self.command, len(body), self.seq_num) + body
 
-            next_line_break = buff.find('\n')
-            if next_line_break == -1:
-                raise ValueError("Invalid Frame: No newline found")
-            current_line = buff[:next_line_break]
-            buff = buff[next_line_break+1:]
+    def isStreamed(self):
+        return any([isinstance(po, FilePayloadObject) for po in self._payload_objects])
 
-        return frame
+    def writeToSocket(self, sock):
+        if not self.isStreamed():
+            sock.sendall(self.serialize())
+            return
+
+        # Stream file-backed payload bodies rather than building the frame
+        # in memory. Consecutive strings are coalesced into one send.
+        segments = self._bodySegments(stream=True)
+        body_length = sum([s.length if isinstance(s, FilePayloadObject) else len(s)
+                           for s in segments])
+        pending = [frameHeader(self.command, body_length, self.seq_num)]
+        for segment in segments:
+            if isinstance(segment, FilePayloadObject):
+                sock.sendall("".join(pending))
+                pending = []
+                segment.writeToSocket(sock)
+            else:
+                pending.append(segment)
+        sock.sendall("".join(pending))
+
+    @staticmethod
+    def _recvExactly(sock, num_bytes):
+        chunks = []
+        while num_bytes > 0:
+            just_received = sock.recv(num_bytes)
+            if len(just_received) == 0:
+                raise EOFError("Connection closed while reading frame")
+            num_bytes -= len(just_received)
+            chunks.append(just_received)
+        return "".join(chunks)
+
+    # Reads exactly one frame from a blocking socket, consuming no bytes
+    # beyond the end of that frame
+    @classmethod
+    def readFromSocket(cls, socket):
+        frame_header = Frame._recvExactly(socket, FRAME_HEADER_LEN)
+        frame_length = _parseFrameHeader(frame_header)[1]
+        parser = FrameParser(frame_class=cls)
+        frames = parser.feed(frame_header + Frame._recvExactly(socket, frame_length))
+        if len(frames) == 0:
+            raise ValueError("Invalid Frame: Incomplete frame body")
+        return frames[0]
 
     @staticmethod
     def generateSequenceNumber():
-        return random.randint(0, 2**32 - 1)
+        # UNACKED_SEQ_NUM is reserved for requests whose responses are ignored
+        return random.randint(1, 2**32 - 1)
+
+def _parseFrameHeader(frame_header):
+    header_items = frame_header.split(' ')
+    if len(header_items) != 3:
+        raise ValueError("Frame header must contain 3 fields")
+
+    command = header_items[0]
+    frame_length = int(header_items[1])
+    if frame_length < 0:
+        raise ValueError("Negative frame length")
+    seq_no = int(header_items[2])
+    return command, frame_length, seq_no
+
+def _parsePayloadType(po_type):
+    if ':' not in po_type:
+        raise ValueError("Inavlid payload object type: " + po_type)
+    if po_type.startswith(':'):
+        po_type_num = int(po_type[1:])
+        po_type_dotted = None
+    elif po_type.endswith(':'):
+        po_type_dotted = tuple([int(x) for x in po_type[:-1].split('.')])
+        po_type_num = None
+    else:
+        type_tokens = po_type.split(':')
+        if len(type_tokens) != 2:
+            raise ValueError("Invalid payload object type: " + po_type)
+        po_type_dotted = tuple([int(x) for x in type_tokens[0].split('.')])
+        po_type_num = int(type_tokens[1])
+    return po_type_dotted, po_type_num
+
+PO_TYPE_CACHE_SIZE = 256
+_po_type_cache = {}
+
+def _lookupPayloadType(type_str):
+    po_type = _po_type_cache.get(type_str)
+    if po_type is None:
+        po_type = _parsePayloadType(type_str)
+        if len(_po_type_cache) < PO_TYPE_CACHE_SIZE:
+            _po_type_cache[type_str] = po_type
+    return po_type
+
+# Matches payload object types against a set of dotted types, type numbers
+# or masks such as "1.0.2.0/32" (a dotted form followed by the number of
+# leading bits that must agree).
+class PayloadTypeFilter(object):
+    def __init__(self, spec):
+        if isinstance(spec, (tuple, int, long, basestring)):
+            spec = [spec]
+        self.prefixes = []
+        for type_spec in spec:
+            if isinstance(type_spec, tuple):
+                if not _validate_payload_type_dotted(type_spec):
+                    raise ValueError("Invalid dotted payload object type")
+                self.prefixes.append((dottedToNum(type_spec), 32))
+            elif isinstance(type_spec, basestring):
+                tokens = type_spec.split('/')
+                if len(tokens) != 2:
+                    raise ValueError("Invalid payload object mask: " + type_spec)
+                type_dotted = tuple([int(x) for x in tokens[0].split('.')])
+                mask = int(tokens[1])
+                if not _validate_payload_type_dotted(type_dotted) or not 0 <= mask <= 32:
+                    raise ValueError("Invalid payload object mask: " + type_spec)
+                self.prefixes.append((dottedToNum(type_dotted), mask))
+            else:
+                if not _validate_payload_type_num(type_spec):
+                    raise ValueError("Invalid payload object type number")
+                self.prefixes.append((type_spec, 32))
+        # Maps type strings, as they appear in item headers, to match results
+        self.cache = {}
+
+    def matchesTypeNum(self, type_num):
+        for prefix, mask in self.prefixes:
+            shift = 32 - mask
+            if (type_num >> shift) == (prefix >> shift):
+                return True
+        return False
+
+    def matches(self, type_str):
+        matched = self.cache.get(type_str)
+        if matched is None:
+            type_dotted, type_num = _lookupPayloadType(type_str)
+            if type_num is None:
+                type_num = dottedToNum(type_dotted)
+            matched = self.matchesTypeNum(type_num)
+            if len(self.cache) < PO_TYPE_CACHE_SIZE:
+                self.cache[type_str] = matched
+        return matched
+
+_PARSE_HEADER = 0
+_PARSE_ITEM_HEADER = 1
+_PARSE_ITEM_BODY = 2
+_PARSE_SKIP_ITEM_BODY = 3
+_PARSE_SPILL_ITEM_BODY = 4
+
+# Incremental, sans-IO frame parser. Bytes are supplied in chunks of any size
+# through feed(), which returns the frames completed by that chunk. Parse state
+# is kept across calls, so a frame or item may be split at any byte boundary.
+class FrameParser(object):
+    def __init__(self, frame_class=Frame, retain_raw=False, spill_threshold=None):
+        self.frame_class = frame_class
+        # Payload bodies longer than spill_threshold are written to temporary
+        # files as they arrive and delivered as FilePayloadObjects. Spilling
+        # is disabled while raw frames are retained. Compressed bodies are
+        # inflated into the file.
+        self.spill_threshold = spill_threshold
+        self.spill_file = None
+        # Start of the body being spilled, until it is long enough to tell
+        # whether it was compressed
+        self.spill_head = None
+        self.spill_inflater = None
+        # If set, each parsed frame's raw bytes are kept in its "raw" attribute
+        self.retain_raw = retain_raw
+        # Sequence numbers whose "rslt" frames keep their raw bytes even if
+        # retain_raw is not set
+        self.raw_seq_nums = set()
+        self.frame_raw = False
+        self.raw_chunks = []
+        self.raw_length = 0
+        self.po_offset = None
+        self.state = _PARSE_HEADER
+        self.frame = None
+        self.item_fields = None
+        self.item_len = 0
+        # Unparsed input is kept as a list of chunks so that large item bodies
+        # are only joined once, when all of their bytes have arrived
+        self.chunks = []
+        self.buffered = 0
+        self.needed = FRAME_HEADER_LEN
+        # Maps sequence numbers to PayloadTypeFilters. Payload objects of
+        # "rslt" frames with a filter are skipped unless they match, and a
+        # frame left with no matching payload object is dropped entirely.
+        self.po_filters = {}
+        self.po_filter = None
+        self.po_matched = False
+
+    def feed(self, data):
+        if len(data) == 0:
+            return []
+        self.chunks.append(data)
+        self.buffered += len(data)
+        if self.buffered < self.needed:
+            return []
+
+        if len(self.chunks) == 1:
+            buff = self.chunks[0]
+        else:
+            buff = "".join(self.chunks)
+        buff_len = len(buff)
+        offset = 0
+        frame_start = 0
+        frames = []
+
+        while True:
+            if self.state == _PARSE_HEADER:
+                if buff_len - offset < FRAME_HEADER_LEN:
+                    self.needed = FRAME_HEADER_LEN
+                    break
+                command, _, seq_no = _parseFrameHeader(buff[offset:offset+FRAME_HEADER_LEN])
+                self.frame = self.frame_class(command, seq_no)
+                if command == "rslt":
+                    self.po_filter = self.po_filters.get(seq_no)
+                    self.po_matched = False
+                else:
+                    self.po_filter = None
+                self.frame_raw = self.retain_raw or \
+                        (command == "rslt" and seq_no in self.raw_seq_nums)
+                self.po_offset = None
+                frame_start = offset
+                offset += FRAME_HEADER_LEN
+                self.state = _PARSE_ITEM_HEADER
+
+            elif self.state == _PARSE_ITEM_HEADER:
+                next_line_break = buff.find('\n', offset)
+                if next_line_break == -1:
+                    # Any additional input may complete the line
+                    self.needed = buff_len - offset + 1
+                    break
+                item_start = offset
+                current_line = buff[offset:next_line_break]
+                offset = next_line_break + 1
+
+                if current_line == "end":
+                    if self.po_filter is not None and not self.po_matched and \
+                            self.frame.getFirstValue("finished") != "true":
+                        self.frame = None
+                        self.raw_chunks = []
+                        self.raw_length = 0
+                        self.state = _PARSE_HEADER
+                        continue
+                    if self.frame_raw:
+                        if self.po_offset is None:
+                            self.po_offset = self.raw_length + item_start - frame_start
+                        if self.po_offset >= 0:
+                            self.frame.raw_po_offset = self.po_offset
+                        self.raw_chunks.append(buff[frame_start:offset])
+                        self.frame.raw = "".join(self.raw_chunks)
+                        self.raw_chunks = []
+                        self.raw_length = 0
+                    frames.append(self.frame)
+                    self.frame = None
+                    self.state = _PARSE_HEADER
+                    continue
+
+                fields = current_line.split(' ')
+                if len(fields) != 3 or fields[0] not in ("kv", "ro", "po"):
+                    raise ValueError("Invalid item header: " + current_line)
+                if self.frame_raw:
+                    if fields[0] == "po":
+                        if self.po_offset is None:
+                            self.po_offset = self.raw_length + item_start - frame_start
+                    elif self.po_offset is not None:
+                        # Other items follow a payload object
+                        self.po_offset = -1
+                self.item_fields = fields
+                self.item_len = int(fields[2])
+                if self.item_len < 0:
+                    raise ValueError("Invalid item header: " + current_line)
+                self.state = _PARSE_ITEM_BODY
+                if fields[0] == "po" and self.po_filter is not None:
+                    if self.po_filter.matches(fields[1]):
+                        self.po_matched = True
+                    else:
+                        # Need +1 for the trailing \n
+                        self.item_len += 1
+                        self.state = _PARSE_SKIP_ITEM_BODY
+                if self.state == _PARSE_ITEM_BODY and fields[0] == "po" and \
+                        self.spill_threshold is not None and not self.frame_raw and \
+                        self.item_len > self.spill_threshold:
+                    _lookupPayloadType(fields[1])
+                    self.spill_file = tempfile.TemporaryFile()
+                    self.spill_head = ""
+                    self.item_len += 1
+                    self.state = _PARSE_SPILL_ITEM_BODY
+
+            elif self.state == _PARSE_SPILL_ITEM_BODY:
+                # Write the body to the spill file as it arrives; item_len
+                # still includes the trailing \n
+                available = buff_len - offset
+                take = min(available, self.item_len - 1)
+                if take > 0:
+                    self._spill(buff[offset:offset+take])
+                    offset += take
+                    self.item_len -= take
+                    available -= take
+                if available == 0:
+                    self.needed = 1
+                    break
+                offset += 1
+                if self.spill_head is not None:
+                    self.spill_file.write(self.spill_head)
+                elif self.spill_inflater is not None:
+                    self.spill_file.write(self.spill_inflater.flush())
+                self.spill_file.flush()
+                po_type = _lookupPayloadType(self.item_fields[1])
+                po = FilePayloadObject(po_type[0], po_type[1], self.spill_file, 0,
+                                       self.spill_file.tell())
+                self.frame.addPayloadObject(po)
+                self.spill_file = None
+                self.spill_head = None
+                self.spill_inflater = None
+                self.state = _PARSE_ITEM_HEADER
+
+            elif self.state == _PARSE_SKIP_ITEM_BODY:
+                # Discard the body without slicing it out of the buffer
+                available = buff_len - offset
+                if available < self.item_len:
+                    self.item_len -= available
+                    offset = buff_len
+                    self.needed = 1
+                    break
+                offset += self.item_len
+                self.state = _PARSE_ITEM_HEADER
+
+            else:
+                # Need +1 for the trailing \n
+                if buff_len - offset < self.item_len + 1:
+                    self.needed = self.item_len + 1
+                    break
+                body = buff[offset:offset+self.item_len]
+                offset += self.item_len + 1
+                self._addItem(self.item_fields, body)
+                self.state = _PARSE_ITEM_HEADER
+
+        if self.frame_raw and self.frame is not None:
+            self.raw_chunks.append(buff[frame_start:offset])
+            self.raw_length += offset - frame_start
+        if offset == buff_len:
+            self.chunks = []
+        else:
+            self.chunks = [buff[offset:]]
+        self.buffered = buff_len - offset
+        return frames
+
+    def _spill(self, data):
+        if self.spill_head is not None:
+            self.spill_head += data
+            if len(self.spill_head) < len(COMPRESSED_MAGIC):
+                return
+            data = self.spill_head
+            self.spill_head = None
+            if data.startswith(COMPRESSED_MAGIC):
+                self.spill_inflater = zlib.decompressobj()
+                data = data[len(COMPRESSED_MAGIC):]
+        if self.spill_inflater is not None:
+            data = self.spill_inflater.decompress(data)
+        self.spill_file.write(data)
+
+    def _addItem(self, fields, body):
+        if fields[0] == "kv":
+            self.frame.addKVPair(fields[1], body)
+        elif fields[0] == "ro":
+            self.frame.addRoutingObject(RoutingObject(int(fields[1]), body))
+        else:
+            # Validate the type now, but defer constructing the PayloadObject
+            _lookupPayloadType(fields[1])
+            self.frame.addRawPayloadObject(fields[1], body)
 
 class BosswaveResponse(object):
     def __init__(self, status, reason, kv_pairs, routing_objects, payload_objects):
@@ -202,12 +672,15 @@ class BosswaveResponse(object):
             return None
 
 class BosswaveResult(object):
-    def __init__(self, from_, uri, kv_pairs, routing_objects, payload_objects):
+    def __init__(self, from_, uri, kv_pairs, routing_objects, payload_objects,
+                 timestamp=None):
         self.from_ = from_
         self.uri = uri
         self.kv_pairs = kv_pairs
         self.routing_objects = routing_objects
         self.payload_objects = payload_objects
+        # Time at which the result was received by the client
+        self.timestamp = timestamp
 
     def getFirstValue(self, key):
         matchingValues = [y for x,y in self.kv_pairs if x == key]
@@ -215,3 +688,61 @@ class BosswaveResult(object):
             return matchingValues[0]
         else:
             return None
+
+# Query results stored column by column rather than as one BosswaveResult per
+# message. Message-level columns (uris, froms and one column per requested kv
+# key) have one entry per message. Payload objects are described by parallel
+# arrays holding the index of their message, their type number and the offset
+# and length of their body within the single contiguous payload buffer.
+class ColumnarResult(object):
+    def __init__(self, kv_keys=None):
+        self.uris = []
+        self.froms = []
+        self.kv_columns = {}
+        if kv_keys is not None:
+            for key in kv_keys:
+                self.kv_columns[key] = []
+        self.po_messages = array.array('L')
+        self.po_types = array.array('L')
+        self.po_offsets = array.array('L')
+        self.po_lengths = array.array('L')
+        self.payload = bytearray()
+
+    def __len__(self):
+        return len(self.uris)
+
+    def appendFrame(self, frame):
+        message_index = len(self.uris)
+        uri = None
+        from_ = None
+        kv_values = {}
+        for key, value in frame.kv_pairs:
+            if key == "uri":
+                uri = value
+            elif key == "from":
+                from_ = value
+            if key in self.kv_columns and key not in kv_values:
+                kv_values[key] = value
+        self.uris.append(uri)
+        self.froms.append(from_)
+        for key, column in self.kv_columns.iteritems():
+            column.append(kv_values.get(key))
+
+        if len(frame.raw_payload_objects) > 0:
+            payload_types = [(_lookupPayloadType(type_str), inflateBody(body))
+                             for type_str, body in frame.raw_payload_objects]
+        else:
+            payload_types = [((po.type_dotted, po.type_num), po.content)
+                             for po in frame.payload_objects]
+        for (type_dotted, type_num), body in payload_types:
+            if type_num is None:
+                type_num = dottedToNum(type_dotted)
+            self.po_messages.append(message_index)
+            self.po_types.append(type_num)
+            self.po_offsets.append(len(self.payload))
+            self.po_lengths.append(len(body))
+            self.payload += body
+
+    def getPayload(self, po_index):
+        offset = self.po_offsets[po_index]
+        return str(self.payload[offset:offset+self.po_lengths[po_index]])
@@ -0,0 +1,130 @@
+import mmap
+import struct
+import sys
+import threading
+import time
+
+from bwtypes import FrameParser
+
+# Capture files start with CAPTURE_MAGIC and are followed by a sequence of
+# records. Each record is a fixed-size header (receive/send timestamp as a
+# double, direction, length of the frame) followed by the frame's raw bytes.
+CAPTURE_MAGIC = "BW2CAP\x00\x01"
+RECORD_HEADER = struct.Struct("<dBI")
+
+INBOUND = 0
+OUTBOUND = 1
+
+class FrameCapture(object):
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, "ab")
+        if self.file.tell() == 0:
+            self.file.write(CAPTURE_MAGIC)
+
+    def record(self, direction, data, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.write(RECORD_HEADER.pack(timestamp, direction, len(data)))
+            self.file.write(data)
+
+    def flush(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+class CaptureReader(object):
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[:len(CAPTURE_MAGIC)] != CAPTURE_MAGIC:
+            self.mm.close()
+            raise ValueError("Not a Bosswave capture file: " + path)
+
+    # Yields (timestamp, direction, raw frame) tuples. A record truncated by
+    # a crash of the capturing process ends the iteration.
+    def records(self, direction=None):
+        mm = self.mm
+        offset = len(CAPTURE_MAGIC)
+        end = len(mm)
+        while offset + RECORD_HEADER.size <= end:
+            timestamp, record_direction, length = \
+                    RECORD_HEADER.unpack_from(mm, offset)
+            offset += RECORD_HEADER.size
+            if offset + length > end:
+                break
+            if direction is None or direction == record_direction:
+                yield timestamp, record_direction, mm[offset:offset+length]
+            offset += length
+
+    def close(self):
+        self.mm.close()
+
+def _pace(records, speed):
+    # Yields records no faster than their original spacing divided by speed.
+    # A speed of None replays as fast as possible.
+    first_timestamp = None
+    for record in records:
+        if speed is not None:
+            if first_timestamp is None:
+                first_timestamp = record[0]
+                start = time.time()
+            delay = (record[0] - first_timestamp) / speed - (time.time() - start)
+            if delay > 0:
+                time.sleep(delay)
+        yield record
+
+# Feeds the frames of a capture through a FrameParser and passes each one to
+# frame_handler, e.g. a Client's _dispatchFrame method. Returns the number of
+# frames replayed.
+def replayCapture(path, frame_handler, speed=1.0, direction=INBOUND):
+    reader = CaptureReader(path)
+    parser = FrameParser()
+    count = 0
+    try:
+        for _, _, data in _pace(reader.records(direction), speed):
+            for frame in parser.feed(data):
+                frame_handler(frame)
+                count += 1
+    finally:
+        reader.close()
+    return count
+
+# Writes the raw frames of a capture to a socket, e.g. the agent end of a
+# LoopbackTransport, so that a Client receives them as if from an agent.
+def replayCaptureToSocket(path, sock, speed=1.0, direction=INBOUND):
+    reader = CaptureReader(path)
+    count = 0
+    try:
+        for _, _, data in _pace(reader.records(direction), speed):
+            sock.sendall(data)
+            count += 1
+    finally:
+        reader.close()
+    return count
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print "Usage: {} <capture_file>".format(sys.argv[0])
+        sys.exit(1)
+
+    frame_count = [0]
+    def countFrame(frame):
+        frame_count[0] += 1
+
+    start = time.time()
+    replayCapture(sys.argv[1], countFrame, speed=None)
+    elapsed = time.time() - start
+    print "Parsed {} inbound frames in {:.3f}s ({:.0f} frames/s)".format(
+            frame_count[0], elapsed, frame_count[0] / max(elapsed, 1e-9))
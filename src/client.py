@@ -5,108 +5,270 @@ import base64
 import socket
 import sys
 import threading
+import time
+import traceback
 import Queue
+import collections
 
 from bwtypes import *
+from transport import *
+from capture import FrameCapture, INBOUND, OUTBOUND
+from conflation import ConflatingQueue
+from dedup import DedupCache
+import ponames
 
 ENTITY_PO_NUM = (0, 0, 0, 50)
+RECV_BUFFER_SIZE = 65536
+DEFAULT_PROVISION_WINDOW = 64
+DEFAULT_QUERY_CONCURRENCY = 16
+DEFAULT_ERROR_SAMPLE_SIZE = 16
+DEFAULT_HEARTBEAT_INTERVAL = 5.0
+DEFAULT_HEARTBEAT_TIMEOUT = 2.0
+DEFAULT_RTT_SAMPLE_SIZE = 64
+# Weight of each new round trip time in HeartbeatStats.smoothed_rtt
+RTT_SMOOTHING = 0.125
+# Reason given to requests whose connection was lost before their response
+CONNECTION_LOST = "Connection to agent lost"
+# Alias looked up by ping(). Whether it resolves does not matter.
+PING_ALIAS = "bw2python.ping"
+
+# Key files hold a routing object prefixed with its one-byte type, as read by
+# Client.setEntityFromFile
+def _writeKeyFile(path, ro_num, content):
+    with open(path, 'wb') as f:
+        f.write(chr(ro_num))
+        f.write(content)
+
+def writeEntityFile(path, raw_entity):
+    _writeKeyFile(path, ponames.PONumROEntityWKey, raw_entity)
+
+def writeDotFile(path, raw_dot, is_permission=False):
+    if is_permission:
+        _writeKeyFile(path, ponames.PONumROPermissionDOT, raw_dot)
+    else:
+        _writeKeyFile(path, ponames.PONumROAccessDOT, raw_dot)
+
+# Counts publications sent with publishUnacked. Agent responses to them are
+# only tallied, and the reasons for the most recent failures are kept.
+class UnackedStats(object):
+    def __init__(self, error_sample_size=DEFAULT_ERROR_SAMPLE_SIZE):
+        self.sent = 0
+        self.acknowledged = 0
+        self.failed = 0
+        self.recent_errors = collections.deque(maxlen=error_sample_size)
+
+# Round trip times of the probes sent by Client.startHeartbeat, and the number
+# of stalls they detected
+class HeartbeatStats(object):
+    def __init__(self, rtt_sample_size=DEFAULT_RTT_SAMPLE_SIZE):
+        self.probes = 0
+        self.stalls = 0
+        self.last_rtt = None
+        self.smoothed_rtt = None
+        self.recent_rtts = collections.deque(maxlen=rtt_sample_size)
+
+    def record(self, rtt):
+        self.probes += 1
+        self.last_rtt = rtt
+        if self.smoothed_rtt is None:
+            self.smoothed_rtt = rtt
+        else:
+            self.smoothed_rtt += RTT_SMOOTHING * (rtt - self.smoothed_rtt)
+        self.recent_rtts.append(rtt)
 
 class Client(object):
     # This is run in a separate thread to listen for incoming frames
-    def _readFrame(self):
-        while True:
-            frame = Frame.readFromSocket(self.socket)
-            finished = frame.getFirstValue("finished")
-
-            seq_num = frame.seq_num
-            if frame.command == "resp":
-                with self.response_handlers_lock:
-                    handler = self.response_handlers.pop(seq_num, None)
-                if handler is not None:
-                    status = frame.getFirstValue("status")
-                    reason = frame.getFirstValue("reason")
-                    response = BosswaveResponse(status, reason, frame.kv_pairs,
-                                                frame.routing_objects,
-                                                frame.payload_objects)
-
-
-                # If the operation failed, we need to clean up result handlers
-                if status != "okay" or finished == "true":
-                    with self.result_handlers_lock:
-                        self.result_handlers.pop(seq_num, None)
-                    with self.list_result_handlers_lock:
-                        self.list_result_handlers.pop(seq_num, None)
+    def _readFrame(self, sock, parser):
+        try:
+            while True:
+                data = sock.recv(RECV_BUFFER_SIZE)
+                if len(data) == 0:
+                    # Agent closed the connection
+                    break
+                self._handleData(parser, data)
+        except (socket.error, ValueError):
+            pass
+        except Exception:
+            # A failing frame handler ends the connection, as on a reactor
+            traceback.print_exc()
+        self._connectionLost(sock)
+
+    # Parses data received from the agent and dispatches the frames it
+    # completes, on the listener thread or the reactor's
+    def _handleData(self, parser, data):
+        for frame in parser.feed(data):
+            capture = self.capture
+            if capture is not None:
+                capture.record(INBOUND, frame.raw or frame.serialize())
+            self._dispatchFrame(frame)
+
+    # Fails every request still waiting for a response, so that callers
+    # blocked on one are released. Requests already answered that still
+    # expect results, subscriptions included, have their handlers dropped;
+    # their error handlers, if given, are called with CONNECTION_LOST.
+    # Subscriptions are not restored by reconnect().
+    def _connectionLost(self, sock):
+        with self.connection_lock:
+            if sock is not self.socket:
+                return
+            self.connected = False
+        try:
+            sock.close()
+        except socket.error:
+            pass
 
-                handler(response)
+        with self.response_handlers_lock:
+            handlers = self.response_handlers
+            self.response_handlers = {}
+        with self.result_handlers_lock:
+            self.result_handlers = {}
+        with self.list_result_handlers_lock:
+            self.list_result_handlers = {}
+        with self.frame_handlers_lock:
+            self.frame_handlers = {}
+        with self.error_handlers_lock:
+            error_handlers = self.error_handlers
+            self.error_handlers = {}
+        self.dedup_caches = {}
+        for handler in handlers.values():
+            handler(BosswaveResponse("error", CONNECTION_LOST, [], [], []))
+
+        # Requests failed through their response above are not told twice.
+        # Error handlers run on the callback thread, like result handlers.
+        for seq_num, error_handler in error_handlers.items():
+            if seq_num not in handlers:
+                self.msgq.put((error_handler, CONNECTION_LOST))
+
+    def _dispatchFrame(self, frame):
+        finished = frame.getFirstValue("finished")
+
+        seq_num = frame.seq_num
+        if frame.command == "resp":
+            if seq_num == UNACKED_SEQ_NUM:
+                # Only the listener thread updates these counts
+                if frame.getFirstValue("status") == "okay":
+                    self.unacked_stats.acknowledged += 1
+                else:
+                    self.unacked_stats.failed += 1
+                    self.unacked_stats.recent_errors.append(frame.getFirstValue("reason"))
+                return
+
+            with self.response_handlers_lock:
+                handler = self.response_handlers.pop(seq_num, None)
+            status = frame.getFirstValue("status")
 
-            elif frame.command == "rslt":
+            # If the operation failed, we need to clean up result handlers
+            if status != "okay" or finished == "true":
                 with self.result_handlers_lock:
-                    message_handler = self.result_handlers.get(seq_num)
-                    if message_handler is not None and finished == "true":
-                        del self.result_handlers[seq_num]
+                    self.result_handlers.pop(seq_num, None)
                 with self.list_result_handlers_lock:
-                    list_result_handler = self.list_result_handlers.get(seq_num)
-                    if list_result_handler is not None and finished == "true":
-                        del self.list_result_handlers[seq_num]
-
-                if message_handler is not None:
-                    from_ = frame.getFirstValue("from")
-                    uri = frame.getFirstValue("uri")
-
-                    unpack = frame.getFirstValue("unpack")
-                    if unpack is not None and unpack.lower() == "false":
-                        result = BosswaveResult(from_, uri, frame.kv_pairs, None, None)
-                    else:
-                        result = BosswaveResult(from_, uri, frame.kv_pairs,
-                                                frame.routing_objects,
-                                                frame.payload_objects)
-                    # Place message handler and result in message queue.
-                    # This allows callbacks to do bosswave actions (i.e. publish/subscribe)
-                    # because they now take place from another thread.
-                    self.msgq.put((message_handler, result))
-                elif list_result_handler is not None:
-                    child = frame.getFirstValue("child")
-                    if child is not None:
-                        list_result_handler(child)
-                    if finished == "true":
-                        list_result_handler(None)
+                    self.list_result_handlers.pop(seq_num, None)
+                with self.frame_handlers_lock:
+                    self.frame_handlers.pop(seq_num, None)
+                with self.error_handlers_lock:
+                    self.error_handlers.pop(seq_num, None)
+                self.parser.po_filters.pop(seq_num, None)
+                self.parser.raw_seq_nums.discard(seq_num)
+                self.dedup_caches.pop(seq_num, None)
+
+            if handler is not None:
+                reason = frame.getFirstValue("reason")
+                response = BosswaveResponse(status, reason, frame.kv_pairs,
+                                            frame.routing_objects,
+                                            frame.payload_objects)
+                handler(response)
+
+        elif frame.command == "rslt":
+            if finished == "true":
+                with self.error_handlers_lock:
+                    self.error_handlers.pop(seq_num, None)
+            # Frame handlers consume raw frames directly on this thread
+            with self.frame_handlers_lock:
+                frame_handler = self.frame_handlers.get(seq_num)
+                if frame_handler is not None and finished == "true":
+                    del self.frame_handlers[seq_num]
+            if frame_handler is not None:
+                frame_handler(frame)
+                return
+
+            with self.result_handlers_lock:
+                message_handler = self.result_handlers.get(seq_num)
+                if message_handler is not None and finished == "true":
+                    del self.result_handlers[seq_num]
+            with self.list_result_handlers_lock:
+                list_result_handler = self.list_result_handlers.get(seq_num)
+                if list_result_handler is not None and finished == "true":
+                    del self.list_result_handlers[seq_num]
+
+            if message_handler is not None:
+                dedup = self.dedup_caches.get(seq_num)
+                if dedup is not None and finished != "true" and dedup.isDuplicate(frame):
+                    return
+                from_ = frame.getFirstValue("from")
+                uri = frame.getFirstValue("uri")
+
+                unpack = frame.getFirstValue("unpack")
+                if unpack is not None and unpack.lower() == "false":
+                    result = BosswaveResult(from_, uri, frame.kv_pairs, None, None,
+                                            time.time())
+                else:
+                    result = BosswaveResult(from_, uri, frame.kv_pairs,
+                                            frame.routing_objects,
+                                            frame.payload_objects, time.time())
+                # Place message handler and result in message queue.
+                # This allows callbacks to do bosswave actions (i.e. publish/subscribe)
+                # because they now take place from another thread.
+                self.msgq.put((message_handler, result))
+            elif list_result_handler is not None:
+                child = frame.getFirstValue("child")
+                if child is not None:
+                    list_result_handler(child)
+                if finished == "true":
+                    list_result_handler(None)
 
 
     # thread for executing callbacks
     def _msgq_handler(self):
         while True:
             handler, item = self.msgq.get()
-            handler(item)
+            try:
+                handler(item)
+            except Exception:
+                traceback.print_exc()
             self.msgq.task_done()
 
-    def __init__(self, host_name=None, port=None):
-        default_host = "localhost"
-        default_port = 28589
-        if host_name is None and port is None:
-            default_agent = os.getenv('BW2_AGENT')
-            if default_agent is not None:
-                tokens = default_agent.split(':')
-                if len(tokens) != 2:
-                    raise RuntimeError("Invalid BW2_AGENT env var: " + default_agent)
-                default_host = tokens[0]
-                try:
-                    default_port = int(tokens[1])
-                except ValueError as e:
-                    raise RuntimeError("BW2_AGENT env var " + default_agent + " contains invalid port", e)
-        if host_name is None:
-            host_name = default_host
-        if port is None:
-            port = default_port
-
-        self.host_name = host_name
-        self.port = port
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    # With a reactor (see reactor.py), the connection is read by the
+    # reactor's thread and callbacks run on its workers, so the client
+    # starts no threads of its own
+    def __init__(self, host_name=None, port=None, transport=None, spill_threshold=None,
+                 reactor=None):
+        if transport is None:
+            transport = Client._defaultTransport(host_name, port)
+        self.transport = transport
+        self.socket = transport.connect()
+        self.socket_lock = threading.Lock()
+        self.connection_lock = threading.Lock()
+        self.connected = True
+        self.spill_threshold = spill_threshold
+        self.entity_key = None
+        self.capture = None
+        self.compression = None
+        self.unacked_stats = UnackedStats()
+        self.heartbeat_stats = HeartbeatStats()
+        self.heartbeat_stopped = None
+        self.conflation = None
+        self.dedup = None
+        self.dedup_caches = {}
 
         # setup message queue for handling callbacks
-        self.msgq = Queue.Queue()
-        msgq_worker = threading.Thread(target=self._msgq_handler)
-        msgq_worker.daemon = True
-        msgq_worker.start()
+        self.reactor = reactor
+        if reactor is not None:
+            self.msgq = reactor.callbackQueue()
+        else:
+            self.msgq = Queue.Queue()
+            msgq_worker = threading.Thread(target=self._msgq_handler)
+            msgq_worker.daemon = True
+            msgq_worker.start()
 
         self.response_handlers = {}
         self.response_handlers_lock = threading.Lock()
@@ -114,12 +276,15 @@ class Client(object):
         self.result_handlers_lock = threading.Lock()
         self.list_result_handlers_lock = threading.Lock()
         self.list_result_handlers = {}
+        self.frame_handlers_lock = threading.Lock()
+        self.frame_handlers = {}
+        self.error_handlers_lock = threading.Lock()
+        self.error_handlers = {}
 
         self.synchronous_results = {}
         self.synchronous_results_lock = threading.Lock()
         self.synchronous_cond_vars = {}
 
-        self.socket.connect((self.host_name, self.port))
         frame = Frame.readFromSocket(self.socket)
         if frame.command != "helo":
             self.close()
@@ -127,13 +292,202 @@ class Client(object):
 
         self.default_auto_chain = None
 
-        self.listener_thread = threading.Thread(target=self._readFrame)
+        self.parser = FrameParser(spill_threshold=spill_threshold)
+        self._startListener()
+
+    def _startListener(self):
+        if self.reactor is not None:
+            self.reactor.register(self, self.socket, self.parser)
+            return
+        self.listener_thread = threading.Thread(target=self._readFrame,
+                                                args=(self.socket, self.parser))
         self.listener_thread.daemon = True
         self.listener_thread.start()
 
 
+    @staticmethod
+    def _defaultTransport(host_name, port):
+        if host_name is None and port is None:
+            default_agent = os.getenv('BW2_AGENT')
+            if default_agent is not None:
+                try:
+                    return transportFromAddress(default_agent)
+                except ValueError as e:
+                    raise RuntimeError("Invalid BW2_AGENT env var: " + default_agent, e)
+        if host_name is None:
+            host_name = DEFAULT_HOST
+        if port is None:
+            port = DEFAULT_PORT
+        return TCPTransport(host_name, port)
+
+    # The agent's host and port, for clients connected over TCP; None for
+    # other transports
+    @property
+    def host_name(self):
+        return getattr(self.transport, "host_name", None)
+
+    @property
+    def port(self):
+        return getattr(self.transport, "port", None)
+
     def close(self):
-        self.socket.close()
+        self.stopHeartbeat()
+        with self.connection_lock:
+            self.connected = False
+            sock = self.socket
+        if self.reactor is not None:
+            self.reactor.unregister(sock)
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        sock.close()
+
+    # Treats the connection as lost, failing every request waiting on it,
+    # for callers that found it broken themselves. reconnect() opens a new one.
+    def dropConnection(self):
+        self._connectionLost(self.socket)
+
+    # Opens a new connection to the agent after the previous one was lost,
+    # and sets the entity again if one was set. Subscriptions made on the old
+    # connection are not restored.
+    def reconnect(self):
+        with self.connection_lock:
+            if self.connected:
+                return
+            sock = self.transport.connect()
+            try:
+                frame = Frame.readFromSocket(sock)
+            except (socket.error, ValueError) as e:
+                sock.close()
+                raise RuntimeError("Failed to reconnect to agent: " + str(e))
+            if frame.command != "helo":
+                sock.close()
+                raise RuntimeError("Received invalid Bosswave ACK")
+            parser = FrameParser(spill_threshold=self.spill_threshold)
+            parser.retain_raw = self.capture is not None
+            with self.socket_lock:
+                self.socket = sock
+            self.parser = parser
+            self.connected = True
+            self._startListener()
+            # A conflating queue closes when its socket fails
+            conflation = self.conflation
+            if conflation is not None and conflation.closed:
+                self.conflation = ConflatingQueue(self)
+        if self.entity_key is not None:
+            self.setEntity(self.entity_key)
+
+
+    def _writeFrame(self, frame):
+        conflation = self.conflation
+        if conflation is not None and (frame.command == "publ" or frame.command == "pers"):
+            if conflation.put(frame):
+                return
+        self._sendFrame(frame)
+
+    def _sendFrame(self, frame):
+        compression = self.compression
+        if compression is not None and (frame.command == "publ" or frame.command == "pers"):
+            frame.payload_objects = compression.compress(frame.getFirstValue("uri"),
+                                                         frame.payload_objects)
+        streamed = frame.isStreamed()
+        if not streamed:
+            data = frame.serialize()
+        with self.socket_lock:
+            capture = self.capture
+            if streamed:
+                if capture is not None:
+                    capture.record(OUTBOUND, frame.serialize())
+                frame.writeToSocket(self.socket)
+            else:
+                if capture is not None:
+                    capture.record(OUTBOUND, data)
+                self.socket.sendall(data)
+            if frame.seq_num == UNACKED_SEQ_NUM:
+                self.unacked_stats.sent += 1
+
+
+    # Makes the response to one request also go to the handler of another,
+    # whose frame was superseded and will never be sent
+    def _mergeResponseHandlers(self, old_seq_num, new_seq_num):
+        with self.response_handlers_lock:
+            old_handler = self.response_handlers.pop(old_seq_num, None)
+            if old_handler is None:
+                return
+            new_handler = self.response_handlers.get(new_seq_num)
+            if new_handler is None:
+                self.response_handlers[new_seq_num] = old_handler
+            else:
+                def mergedHandler(response):
+                    old_handler(response)
+                    new_handler(response)
+                self.response_handlers[new_seq_num] = mergedHandler
+
+    # Queues publications so that, while one is waiting to be sent, a newer
+    # publication to the same URI replaces it (see conflation.py). Superseded
+    # publications are counted in self.conflation.superseded and
+    # self.conflation.superseded_by_uri.
+    def enableConflation(self):
+        if self.conflation is None:
+            self.conflation = ConflatingQueue(self)
+
+    # Sends any queued publications and returns to writing them directly
+    def disableConflation(self):
+        conflation = self.conflation
+        self.conflation = None
+        if conflation is not None:
+            conflation.close()
+
+
+    # Sends an arbitrary request frame. Its response is passed to
+    # response_handler; if frame_handler is given, it receives the request's
+    # raw "rslt" frames on the listener thread.
+    def asyncRequest(self, frame, response_handler, frame_handler=None):
+        with self.response_handlers_lock:
+            self.response_handlers[frame.seq_num] = response_handler
+        if frame_handler is not None:
+            with self.frame_handlers_lock:
+                self.frame_handlers[frame.seq_num] = frame_handler
+        self._writeFrame(frame)
+
+    # Forgets all handlers of a request, so that any later response or
+    # results for it are dropped
+    def _cancelRequest(self, seq_num):
+        with self.response_handlers_lock:
+            self.response_handlers.pop(seq_num, None)
+        with self.result_handlers_lock:
+            self.result_handlers.pop(seq_num, None)
+        with self.list_result_handlers_lock:
+            self.list_result_handlers.pop(seq_num, None)
+        with self.frame_handlers_lock:
+            self.frame_handlers.pop(seq_num, None)
+        with self.error_handlers_lock:
+            self.error_handlers.pop(seq_num, None)
+        self.parser.po_filters.pop(seq_num, None)
+        self.parser.raw_seq_nums.discard(seq_num)
+        self.dedup_caches.pop(seq_num, None)
+
+
+    # Records all inbound and outbound frames to a capture file, see capture.py
+    def startCapture(self, path):
+        capture = FrameCapture(path)
+        self.parser.retain_raw = True
+        self.capture = capture
+        return capture
+
+    def stopCapture(self):
+        capture = self.capture
+        self.capture = None
+        self.parser.retain_raw = False
+        if capture is not None:
+            capture.close()
+
+
+    # Compresses published payloads according to a CompressionPolicy, see
+    # compression.py. Pass None to disable compression.
+    def setCompression(self, policy):
+        self.compression = policy
 
 
     def overrideAutoChainTo(self, auto_chain):
@@ -153,11 +507,13 @@ class Client(object):
 
         def wrappedResponseHandler(response):
             self.vk = response.getFirstValue("vk")
+            if response.status == "okay":
+                self.entity_key = key
             response_handler(response)
 
         with self.response_handlers_lock:
             self.response_handlers[seq_num] = wrappedResponseHandler
-        frame.writeToSocket(self.socket)
+        self._writeFrame(frame)
 
     def setEntity(self, key):
         seq_num = Frame.generateSequenceNumber()
@@ -175,7 +531,7 @@ class Client(object):
         with self.synchronous_results_lock:
             self.synchronous_cond_vars[seq_num] = \
                     threading.Condition(self.synchronous_results_lock)
-        frame.writeToSocket(self.socket)
+        self._writeFrame(frame)
 
         with self.synchronous_results_lock:
             while seq_num not in self.synchronous_results:
@@ -184,11 +540,10 @@ class Client(object):
             del self.synchronous_cond_vars[seq_num]
 
         if response.status != "okay":
-            with self.result_handlers_lock:
-                del self.result_handlers[seq_num]
-            raise RuntimeError("Failed to set entity: " + result.reason)
+            raise RuntimeError("Failed to set entity: " + response.reason)
         else:
             self.vk = response.getFirstValue("vk")
+            self.entity_key = key
             return self.vk
 
     def asyncSetEntityFromFile(self, key_file_name, response_handler):
@@ -217,7 +572,7 @@ class Client(object):
         if primary_access_chain is not None:
             frame.addKVPair("primary_access_chain", primary_access_chain)
         if expiry is not None:
-            expiry_time = datetime.utcfromtimestamp(expiry)
+            expiry_time = datetime.datetime.utcfromtimestamp(expiry)
             frame.addKVPair("expiry", Client._utcToRfc3339(expiry_time))
         if expiry_delta is not None:
             frame.addKVPair("expirydelta", "{0}ms".format(expiry_delta))
@@ -242,7 +597,8 @@ class Client(object):
 
     def asyncSubscribe(self, uri, response_handler, result_handler, primary_access_chain=None,
                        expiry=None, expiry_delta=None, elaborate_pac=None, unpack=True,
-                       auto_chain=False, routing_objects=None):
+                       auto_chain=False, routing_objects=None, po_filter=None, dedup=None,
+                       error_handler=None):
         if self.default_auto_chain is not None:
             auto_chain = self.default_auto_chain
         frame = Client._createSubscribeFrame(uri, primary_access_chain, expiry,
@@ -253,11 +609,15 @@ class Client(object):
             self.response_handlers[frame.seq_num] = response_handler
         with self.result_handlers_lock:
             self.result_handlers[frame.seq_num] = result_handler
-        frame.writeToSocket(self.socket)
+        self._setPayloadFilter(frame.seq_num, po_filter)
+        self._setDedup(frame.seq_num, dedup)
+        self._setErrorHandler(frame.seq_num, error_handler)
+        self._writeFrame(frame)
 
     def subscribe(self, uri, result_handler, primary_access_chain=None, expiry=None,
                   expiry_delta=None, elaborate_pac=None, unpack=True,
-                  auto_chain=False, routing_objects=None):
+                  auto_chain=False, routing_objects=None, po_filter=None, dedup=None,
+                  error_handler=None):
         if self.default_auto_chain is not None:
             auto_chain = self.default_auto_chain
         frame = Client._createSubscribeFrame(uri, primary_access_chain, expiry,
@@ -273,10 +633,13 @@ class Client(object):
             self.response_handlers[frame.seq_num] = responseHandler
         with self.result_handlers_lock:
             self.result_handlers[frame.seq_num] = result_handler
+        self._setPayloadFilter(frame.seq_num, po_filter)
+        self._setDedup(frame.seq_num, dedup)
+        self._setErrorHandler(frame.seq_num, error_handler)
         with self.synchronous_results_lock:
             self.synchronous_cond_vars[frame.seq_num] = \
                     threading.Condition(self.synchronous_results_lock)
-        frame.writeToSocket(self.socket)
+        self._writeFrame(frame)
 
         with self.synchronous_results_lock:
             while frame.seq_num not in self.synchronous_results:
@@ -290,6 +653,77 @@ class Client(object):
         # return handle for unsubscribing
         return result.getFirstValue('handle')
 
+    # Restricts the results of a subscription to payload objects matching
+    # po_filter (see PayloadTypeFilter). Non-matching payload objects are
+    # skipped by the parser and results with none left are never dispatched.
+    def _setPayloadFilter(self, seq_num, po_filter):
+        if po_filter is None:
+            return
+        if not isinstance(po_filter, PayloadTypeFilter):
+            po_filter = PayloadTypeFilter(po_filter)
+        self.parser.po_filters[seq_num] = po_filter
+
+    # Subscribes with results fed to aggregator, a WindowAggregator (see
+    # aggregate.py), straight from their frames on the listener thread. No
+    # BosswaveResult or PayloadObject is constructed per message, and payload
+    # objects of other types are skipped by the parser.
+    def subscribeAggregated(self, uri, aggregator, primary_access_chain=None, expiry=None,
+                            expiry_delta=None, elaborate_pac=None, auto_chain=False,
+                            routing_objects=None):
+        if self.default_auto_chain is not None:
+            auto_chain = self.default_auto_chain
+        frame = Client._createSubscribeFrame(uri, primary_access_chain, expiry,
+                                             expiry_delta, elaborate_pac, True,
+                                             auto_chain, routing_objects)
+        with self.frame_handlers_lock:
+            self.frame_handlers[frame.seq_num] = aggregator.addFrame
+        self._setPayloadFilter(frame.seq_num, aggregator.po_filter)
+
+        response = self._requestMany([frame])[0]
+        if response.status != "okay":
+            raise RuntimeError("Failed to subscribe: " + response.reason)
+        return response.getFirstValue('handle')
+
+    # Subscribes with frame_handler called with each "rslt" frame, undecoded,
+    # on the listener thread. Each frame's raw attribute holds its bytes as
+    # received, and its raw_po_offset where its payload object items start.
+    def subscribeRaw(self, uri, frame_handler, primary_access_chain=None, expiry=None,
+                     expiry_delta=None, elaborate_pac=None, auto_chain=False,
+                     routing_objects=None):
+        if self.default_auto_chain is not None:
+            auto_chain = self.default_auto_chain
+        frame = Client._createSubscribeFrame(uri, primary_access_chain, expiry,
+                                             expiry_delta, elaborate_pac, True,
+                                             auto_chain, routing_objects)
+        with self.frame_handlers_lock:
+            self.frame_handlers[frame.seq_num] = frame_handler
+        self.parser.raw_seq_nums.add(frame.seq_num)
+
+        response = self._requestMany([frame])[0]
+        if response.status != "okay":
+            raise RuntimeError("Failed to subscribe: " + response.reason)
+        return response.getFirstValue('handle')
+
+    # Drops results of a subscription that dedup, a DedupCache, has already
+    # seen, before they are queued for the result handler. Subscriptions
+    # without their own cache use the client's, if set with setDedup.
+    def _setDedup(self, seq_num, dedup):
+        if dedup is None:
+            dedup = self.dedup
+        if dedup is not None:
+            self.dedup_caches[seq_num] = dedup
+
+    def setDedup(self, dedup):
+        self.dedup = dedup
+
+    # Has error_handler called with the reason, CONNECTION_LOST, if the
+    # connection is lost while a request that was answered still expects
+    # results. Without one, such requests end silently.
+    def _setErrorHandler(self, seq_num, error_handler):
+        if error_handler is not None:
+            with self.error_handlers_lock:
+                self.error_handlers[seq_num] = error_handler
+
     @staticmethod
     def _createUnsubscribeFrame(handle):
         seq_num = Frame.generateSequenceNumber()
@@ -309,7 +743,7 @@ class Client(object):
         with self.synchronous_results_lock:
             self.synchronous_cond_vars[frame.seq_num] = \
                     threading.Condition(self.synchronous_results_lock)
-        frame.writeToSocket(self.socket)
+        self._writeFrame(frame)
 
         with self.synchronous_results_lock:
             while frame.seq_num not in self.synchronous_results:
@@ -320,6 +754,73 @@ class Client(object):
         if result.status != "okay":
             raise RuntimeError("Failed to unsubscribe: " + result.reason)
 
+    # Sends all frames back to back, then waits for their responses, which are
+    # returned in the same order
+    def _requestMany(self, frames):
+        responses = {}
+        cond_var = threading.Condition(self.synchronous_results_lock)
+        def responseHandler(response, seq_num):
+            with self.synchronous_results_lock:
+                responses[seq_num] = response
+                if len(responses) == len(frames):
+                    cond_var.notify()
+
+        with self.response_handlers_lock:
+            for frame in frames:
+                self.response_handlers[frame.seq_num] = \
+                        lambda response, seq_num=frame.seq_num: responseHandler(response, seq_num)
+        for frame in frames:
+            self._writeFrame(frame)
+
+        with self.synchronous_results_lock:
+            while len(responses) < len(frames):
+                cond_var.wait()
+        return [responses[frame.seq_num] for frame in frames]
+
+    # Subscribes to many URIs in one round trip. Each spec is a dict of
+    # subscribe's keyword arguments, including "uri" and "result_handler".
+    # Returns (handles, errors): a list of subscription handles in the order
+    # of specs, None for those that failed, and a dict mapping the index of
+    # each failed spec to the reason.
+    def subscribeMany(self, specs):
+        frames = []
+        for spec in specs:
+            auto_chain = spec.get("auto_chain", False)
+            if self.default_auto_chain is not None:
+                auto_chain = self.default_auto_chain
+            frame = Client._createSubscribeFrame(spec["uri"], spec.get("primary_access_chain"),
+                                                 spec.get("expiry"), spec.get("expiry_delta"),
+                                                 spec.get("elaborate_pac"),
+                                                 spec.get("unpack", True), auto_chain,
+                                                 spec.get("routing_objects"))
+            with self.result_handlers_lock:
+                self.result_handlers[frame.seq_num] = spec["result_handler"]
+            self._setPayloadFilter(frame.seq_num, spec.get("po_filter"))
+            self._setDedup(frame.seq_num, spec.get("dedup"))
+            self._setErrorHandler(frame.seq_num, spec.get("error_handler"))
+            frames.append(frame)
+
+        handles = []
+        errors = {}
+        for i, response in enumerate(self._requestMany(frames)):
+            if response.status == "okay":
+                handles.append(response.getFirstValue("handle"))
+            else:
+                handles.append(None)
+                errors[i] = response.reason
+        return handles, errors
+
+    # Unsubscribes many handles in one round trip. Returns a dict mapping each
+    # handle that could not be unsubscribed to the reason.
+    def unsubscribeMany(self, handles):
+        frames = [(handle, Client._createUnsubscribeFrame(handle)) for handle in handles]
+        errors = {}
+        responses = self._requestMany([frame for _, frame in frames])
+        for (handle, _), response in zip(frames, responses):
+            if response.status != "okay":
+                errors[handle] = response.reason
+        return errors
+
 
     @staticmethod
     def _createPublishFrame(uri, persist, primary_access_chain, expiry, expiry_delta,
@@ -335,8 +836,8 @@ class Client(object):
             frame.addKVPair("primary_access_chain", primary_access_chain)
 
         if expiry is not None:
-            expiry_time = datetime.utcfromtimestamp(expiry)
-            frame.addKVPair("expiry", _utcToRfc3339(expiry_time))
+            expiry_time = datetime.datetime.utcfromtimestamp(expiry)
+            frame.addKVPair("expiry", Client._utcToRfc3339(expiry_time))
         if expiry_delta is not None:
             frame.addKVPair("expirydelta", "{0}ms".format(expiry_delta))
 
@@ -367,7 +868,7 @@ class Client(object):
 
         with self.response_handlers_lock:
             self.response_handlers[frame.seq_num] = response_handler
-        frame.writeToSocket(self.socket)
+        self._writeFrame(frame)
 
     def publish(self, uri, persist=False, primary_access_chain=None, expiry=None,
                 expiry_delta=None, elaborate_pac=None, auto_chain=False,
@@ -388,7 +889,7 @@ class Client(object):
         with self.synchronous_results_lock:
             self.synchronous_cond_vars[frame.seq_num] = \
                     threading.Condition(self.synchronous_results_lock)
-        frame.writeToSocket(self.socket)
+        self._writeFrame(frame)
 
         with self.synchronous_results_lock:
             while frame.seq_num not in self.synchronous_results:
@@ -399,6 +900,20 @@ class Client(object):
         if response.status != "okay":
             raise RuntimeError("Failed to publish: " + response.reason)
 
+    # Publishes without waiting for or tracking the agent's response, for
+    # high-rate data where individual losses don't matter. Outcomes are only
+    # counted in self.unacked_stats.
+    def publishUnacked(self, uri, persist=False, primary_access_chain=None, expiry=None,
+                       expiry_delta=None, elaborate_pac=None, auto_chain=False,
+                       routing_objects=None, payload_objects=None):
+        if self.default_auto_chain is not None:
+            auto_chain = self.default_auto_chain
+        frame = Client._createPublishFrame(uri, persist, primary_access_chain, expiry,
+                                           expiry_delta, elaborate_pac, auto_chain,
+                                           routing_objects, payload_objects)
+        frame.seq_num = UNACKED_SEQ_NUM
+        self._writeFrame(frame)
+
 
     @staticmethod
     def _createListFrame(uri, primary_access_chain, expiry, expiry_delta,
@@ -411,8 +926,8 @@ class Client(object):
             frame.addKVPair("primary_access_chain", primary_access_chain)
 
         if expiry is not None:
-            expiry_time = datetime.utcfromtimestamp(expiry)
-            frame.addKVPair("expiry", _utcToRfc3339(expiry_time))
+            expiry_time = datetime.datetime.utcfromtimestamp(expiry)
+            frame.addKVPair("expiry", Client._utcToRfc3339(expiry_time))
         if expiry_delta is not None:
             frame.addKVPair("expirydelta", "{0}ms".format(expiry_delta))
 
@@ -433,7 +948,7 @@ class Client(object):
 
     def asyncList(self, uri, response_handler, list_result_handler, primary_access_chain=None,
                   expiry=None, expiry_delta=None, elaborate_pac=None, auto_chain=False,
-                  routing_objects=None):
+                  routing_objects=None, error_handler=None):
         if self.default_auto_chain is not None:
             auto_chain = self.default_auto_chain
         frame = Client._createListFrame(uri, primary_access_chain, expiry, expiry_delta,
@@ -443,7 +958,8 @@ class Client(object):
             self.response_handlers[frame.seq_num] = response_handler
         with self.list_result_handlers_lock:
             self.list_result_handlers[frame.seq_num] = list_result_handler
-        frame.writeToSocket(self.socket)
+        self._setErrorHandler(frame.seq_num, error_handler)
+        self._writeFrame(frame)
 
     def list(self, uri, primary_access_chain=None, expiry=None, expiry_delta=None,
              elaborate_pac=None, auto_chain=False, routing_objects=None):
@@ -467,14 +983,20 @@ class Client(object):
             else:
                 children.append(child)
 
+        def errorHandler(reason):
+            with self.synchronous_results_lock:
+                self.synchronous_results[frame.seq_num] = reason
+                self.synchronous_cond_vars[frame.seq_num].notify()
+
         with self.response_handlers_lock:
             self.response_handlers[frame.seq_num] = responseHandler
         with self.list_result_handlers_lock:
             self.list_result_handlers[frame.seq_num] = listResultHandler
+        self._setErrorHandler(frame.seq_num, errorHandler)
         with self.synchronous_results_lock:
             self.synchronous_cond_vars[frame.seq_num] = \
                     threading.Condition(self.synchronous_results_lock)
-        frame.writeToSocket(self.socket)
+        self._writeFrame(frame)
 
         with self.synchronous_results_lock:
             while frame.seq_num not in self.synchronous_results:
@@ -500,8 +1022,8 @@ class Client(object):
             frame.addKVPair("primary_access_chain", primary_access_chain)
 
         if expiry is not None:
-            expiry_time = datetime.utcfromtimestamp(expiry)
-            frame.addKVPair("expiry", _utcToRfc3339(expiry_time))
+            expiry_time = datetime.datetime.utcfromtimestamp(expiry)
+            frame.addKVPair("expiry", Client._utcToRfc3339(expiry_time))
         if expiry_delta is not None:
             frame.addKVPair("expirydelta", "{0}ms".format(expiry_delta))
 
@@ -526,7 +1048,7 @@ class Client(object):
 
     def asyncQuery(self, uri, response_handler, result_handler, primary_access_chain=None,
                    expiry=None, expiry_delta=None, elaborate_pac=None, unpack=True,
-                   auto_chain=False, routing_objects=None):
+                   auto_chain=False, routing_objects=None, error_handler=None):
         if self.default_auto_chain is not None:
             auto_chain = self.default_auto_chain
         frame = Client._createQueryFrame(uri, primary_access_chain, expiry,
@@ -537,10 +1059,13 @@ class Client(object):
             self.response_handlers[frame.seq_num] = response_handler
         with self.result_handlers_lock:
             self.result_handlers[frame.seq_num] = result_handler
-        frame.writeToSocket(self.socket)
+        self._setErrorHandler(frame.seq_num, error_handler)
+        self._writeFrame(frame)
+        return frame.seq_num
 
     def query(self, uri, primary_access_chain=None, expiry=None, expiry_delta=None,
-              elaborate_pac=None, unpack=True, auto_chain=False, routing_objects=None):
+              elaborate_pac=None, unpack=True, auto_chain=False, routing_objects=None,
+              columnar=False, kv_columns=None):
         if self.default_auto_chain is not None:
             auto_chain = self.default_auto_chain
         frame = Client._createQueryFrame(uri, primary_access_chain, expiry,
@@ -553,24 +1078,46 @@ class Client(object):
                     self.synchronous_results[frame.seq_num] = response.reason
                     self.synchronous_cond_vars[frame.seq_num].notify()
 
-        results = []
-        def resultHandler(result):
-            finished = result.getFirstValue("finished")
-            if finished == "true":
-                with self.synchronous_results_lock:
-                    self.synchronous_results[frame.seq_num] = results
-                    self.synchronous_cond_vars[frame.seq_num].notify()
-            else:
-                results.append(result)
+        if columnar:
+            # Results are appended straight from their frames, so no
+            # BosswaveResult or PayloadObject is ever constructed
+            results = ColumnarResult(kv_columns)
+            def frameHandler(result_frame):
+                if result_frame.getFirstValue("finished") == "true":
+                    with self.synchronous_results_lock:
+                        self.synchronous_results[frame.seq_num] = results
+                        self.synchronous_cond_vars[frame.seq_num].notify()
+                else:
+                    results.appendFrame(result_frame)
+        else:
+            results = []
+            def resultHandler(result):
+                finished = result.getFirstValue("finished")
+                if finished == "true":
+                    with self.synchronous_results_lock:
+                        self.synchronous_results[frame.seq_num] = results
+                        self.synchronous_cond_vars[frame.seq_num].notify()
+                else:
+                    results.append(result)
+
+        def errorHandler(reason):
+            with self.synchronous_results_lock:
+                self.synchronous_results[frame.seq_num] = reason
+                self.synchronous_cond_vars[frame.seq_num].notify()
 
         with self.response_handlers_lock:
             self.response_handlers[frame.seq_num] = responseHandler
-        with self.result_handlers_lock:
-            self.result_handlers[frame.seq_num] = resultHandler
+        if columnar:
+            with self.frame_handlers_lock:
+                self.frame_handlers[frame.seq_num] = frameHandler
+        else:
+            with self.result_handlers_lock:
+                self.result_handlers[frame.seq_num] = resultHandler
+        self._setErrorHandler(frame.seq_num, errorHandler)
         with self.synchronous_results_lock:
             self.synchronous_cond_vars[frame.seq_num] = \
                     threading.Condition(self.synchronous_results_lock)
-        frame.writeToSocket(self.socket)
+        self._writeFrame(frame)
 
         with self.synchronous_results_lock:
             while frame.seq_num not in self.synchronous_results:
@@ -583,6 +1130,113 @@ class Client(object):
         else:
             return result
 
+    # Queries many URIs, keeping up to concurrency queries in flight. Returns
+    # (results, errors): results maps each message URI to the list of its
+    # distinct results, so a message matched by several of the queried
+    # patterns appears once, and errors maps each failed pattern to the
+    # reason. With group_by_query, results instead maps each queried pattern
+    # to all of its results. A query that has not finished within timeout
+    # seconds fails, and its late results are dropped.
+    def queryMany(self, uris, concurrency=DEFAULT_QUERY_CONCURRENCY, timeout=None,
+                  group_by_query=False, **query_kwargs):
+        if concurrency < 1:
+            raise ValueError("Concurrency must be at least 1")
+        pending = collections.deque()
+        queued = set()
+        for uri in uris:
+            if uri not in queued:
+                queued.add(uri)
+                pending.append(uri)
+        patterns = list(pending)
+
+        cond_var = threading.Condition()
+        results = {}
+        errors = {}
+        # Maps each pattern in flight to [sequence number, deadline]
+        in_flight = {}
+        completions = [0]
+
+        def finish(uri, reason):
+            with cond_var:
+                if uri in in_flight:
+                    del in_flight[uri]
+                    if reason is not None:
+                        del results[uri]
+                        errors[uri] = reason
+                    completions[0] += 1
+                    cond_var.notify()
+
+        def start(uri):
+            def responseHandler(response):
+                if response.status != "okay":
+                    finish(uri, response.reason)
+
+            def resultHandler(result):
+                if result.getFirstValue("finished") == "true":
+                    finish(uri, None)
+                else:
+                    with cond_var:
+                        if uri in in_flight:
+                            results[uri].append(result)
+            return self.asyncQuery(uri, responseHandler, resultHandler,
+                                   error_handler=lambda reason: finish(uri, reason),
+                                   **query_kwargs)
+
+        while True:
+            starting = []
+            expired = []
+            with cond_var:
+                now = time.time()
+                for uri, entry in in_flight.items():
+                    if entry[1] is not None and now >= entry[1]:
+                        del in_flight[uri]
+                        del results[uri]
+                        errors[uri] = "Query timed out"
+                        expired.append(entry[0])
+                while len(pending) > 0 and len(in_flight) < concurrency:
+                    uri = pending.popleft()
+                    deadline = time.time() + timeout if timeout is not None else None
+                    entry = [None, deadline]
+                    in_flight[uri] = entry
+                    results[uri] = []
+                    starting.append((uri, entry))
+                seen_completions = completions[0]
+                done = len(in_flight) == 0
+
+            for seq_num in expired:
+                self._cancelRequest(seq_num)
+            if done:
+                break
+            # Queries are sent without holding cond_var, which the listener
+            # thread needs to deliver their responses
+            for uri, entry in starting:
+                entry[0] = start(uri)
+
+            with cond_var:
+                while completions[0] == seen_completions and len(in_flight) > 0:
+                    deadlines = [entry[1] for entry in in_flight.values() if entry[1] is not None]
+                    if len(deadlines) == 0:
+                        cond_var.wait()
+                        continue
+                    remaining = min(deadlines) - time.time()
+                    if remaining <= 0:
+                        break
+                    cond_var.wait(remaining)
+
+        if group_by_query:
+            return results, errors
+        # Messages are told apart by URI and a digest of their payload objects
+        dedup = DedupCache()
+        seen = set()
+        merged = {}
+        for pattern in patterns:
+            for result in results.get(pattern, ()):
+                key = dedup.frameKey(result)
+                if key not in seen:
+                    seen.add(key)
+                    merged.setdefault(result.uri, []).append(result)
+        return merged, errors
+
 
     @staticmethod
     def _createMakeEntityFrame(contact, comment, expiry, expiry_delta, revokers,
@@ -596,13 +1250,13 @@ class Client(object):
             frame.addKVPair("comment", comment)
 
         if expiry is not None:
-            expiry_time = datetime.utcfromtimestamp(expiry)
-            frame.addKVPair("expiry", _utfToRfc3339(expiry_time))
+            expiry_time = datetime.datetime.utcfromtimestamp(expiry)
+            frame.addKVPair("expiry", Client._utcToRfc3339(expiry_time))
         if expiry_delta is not None:
             frame.addKVPair("expirydelta", "{0}ms".format(expiry_delta))
 
         if revokers is not None:
-            for revoker in reovkers:
+            for revoker in revokers:
                 frame.addKVPair("revoker", revoker)
         if omit_creation_date:
             frame.addKVPair("omitcreationdate", "true")
@@ -618,7 +1272,7 @@ class Client(object):
                                               revokers, omit_creation_date)
         with self.response_handlers_lock:
             self.response_handlers[frame.seq_num] = response_handler
-        frame.writeToSocket(self.socket)
+        self._writeFrame(frame)
 
     def makeEntity(self, contact=None, comment=None, expiry=None, expiry_delta=None,
                    revokers=None, omit_creation_date=False):
@@ -644,7 +1298,7 @@ class Client(object):
         with self.synchronous_results_lock:
             self.synchronous_cond_vars[frame.seq_num] = \
                     threading.Condition(self.synchronous_results_lock)
-        frame.writeToSocket(self.socket)
+        self._writeFrame(frame)
 
         with self.synchronous_results_lock:
             while frame.seq_num not in self.synchronous_results:
@@ -680,13 +1334,13 @@ class Client(object):
             frame.addKVPair("comment", comment)
 
         if expiry is not None:
-            expiry_time = datetime.utcfromtimestamp(expiry)
-            frame.addKVPair("expiry", _utfToRfc3339(expiry_time))
+            expiry_time = datetime.datetime.utcfromtimestamp(expiry)
+            frame.addKVPair("expiry", Client._utcToRfc3339(expiry_time))
         if expiry_delta is not None:
             frame.addKVPair("expirydelta", "{0}ms".format(expiry_delta))
 
         if revokers is not None:
-            for revoker in reovkers:
+            for revoker in revokers:
                 frame.addKVPair("revoker", revoker)
 
         if omit_creation_date:
@@ -702,13 +1356,13 @@ class Client(object):
     def asyncMakeDot(self, response_handler, to, uri, ttl=None, is_permission=False,
                      contact=None, comment=None, expiry=None, expiry_delta=None,
                      revokers=None, omit_creation_date=False, access_permissions=None):
-        frame = Client._createMakeDotFrame(to, ttl, is_permission, contact, comment,
+        frame = Client._createMakeDotFrame(to, uri, ttl, is_permission, contact, comment,
                                            expiry, expiry_delta, revokers,
-                                           omit_creation_date, access_permissions, uri)
+                                           omit_creation_date, access_permissions)
 
         with self.response_handlers_lock:
             self.response_handlers[frame.seq_num] = response_handler
-        frame.writeToSocket(self.socket)
+        self._writeFrame(frame)
 
     def makeDot(self, to, uri, ttl=None, is_permission=False, contact=None,
                 comment=None, expiry=None, expiry_delta=None, revokers=None,
@@ -733,12 +1387,10 @@ class Client(object):
 
         with self.response_handlers_lock:
             self.response_handlers[frame.seq_num] = responseHandler
-        with self.result_handlers_lock:
-            self.result_handlers[frame.seq_num] = resultHandler
         with self.synchronous_results_lock:
             self.synchronous_cond_vars[frame.seq_num] = \
             threading.Condition(self.synchronous_results_lock)
-        frame.writeToSocket(self.socket)
+        self._writeFrame(frame)
 
         with self.synchronous_results_lock:
             while frame.seq_num not in self.synchronous_results:
@@ -753,6 +1405,74 @@ class Client(object):
             return result
 
 
+    # Returns (key, raw object) for a successful "make" or "makd" response,
+    # and the failure reason otherwise
+    @staticmethod
+    def _parseMakeResponse(response, key_name):
+        if response.status != "okay":
+            return response.reason
+        if len(response.payload_objects) != 1:
+            return "Too few payload objects in response"
+        return (response.getFirstValue(key_name), response.payload_objects[0].content)
+
+    # Sends one request per spec, keeping at most window requests in flight,
+    # and yields (spec, key, raw object) as responses arrive. A failed request
+    # raises RuntimeError, or is passed to on_error(spec, reason) if given.
+    def _pipelineMake(self, specs, create_frame, key_name, window, on_error):
+        if window < 1:
+            raise ValueError("Window must be at least 1")
+        responses = Queue.Queue()
+        specs = iter(specs)
+        in_flight = 0
+        exhausted = False
+        while True:
+            while not exhausted and in_flight < window:
+                try:
+                    spec = next(specs)
+                except StopIteration:
+                    exhausted = True
+                    break
+                frame = create_frame(spec)
+                self.asyncRequest(frame, lambda response, spec=spec: responses.put((spec, response)))
+                in_flight += 1
+            if in_flight == 0:
+                return
+
+            spec, response = responses.get()
+            in_flight -= 1
+            result = Client._parseMakeResponse(response, key_name)
+            if type(result) is str:
+                if on_error is None:
+                    raise RuntimeError("Failed to provision {0}: {1}".format(spec, result))
+                on_error(spec, result)
+            else:
+                yield (spec, result[0], result[1])
+
+    # Bulk version of makeEntity. Each spec is a dict of makeEntity's keyword
+    # arguments. Yields (spec, vk, raw_entity) in completion order.
+    def makeEntities(self, specs, window=DEFAULT_PROVISION_WINDOW, on_error=None):
+        def createFrame(spec):
+            return Client._createMakeEntityFrame(spec.get("contact"), spec.get("comment"),
+                                                 spec.get("expiry"), spec.get("expiry_delta"),
+                                                 spec.get("revokers"),
+                                                 spec.get("omit_creation_date", False))
+        return self._pipelineMake(specs, createFrame, "vk", window, on_error)
+
+    # Bulk version of makeDot. Each spec is a dict of makeDot's keyword
+    # arguments, including "to" and "uri". Yields (spec, hash, raw_dot) in
+    # completion order.
+    def makeDots(self, specs, window=DEFAULT_PROVISION_WINDOW, on_error=None):
+        def createFrame(spec):
+            return Client._createMakeDotFrame(spec["to"], spec["uri"], spec.get("ttl"),
+                                              spec.get("is_permission", False),
+                                              spec.get("contact"), spec.get("comment"),
+                                              spec.get("expiry"), spec.get("expiry_delta"),
+                                              spec.get("revokers"),
+                                              spec.get("omit_creation_date", False),
+                                              spec.get("access_permissions"))
+        return self._pipelineMake(specs, createFrame, "hash", window, on_error)
+
+
     def asyncMakeChain(self, response_handler, is_permission=False,
                        unelaborate=False, dots=None):
         seq_num = Frame.generateSequenceNumber()
@@ -770,7 +1490,7 @@ class Client(object):
 
         with self.response_handlers_lock:
             self.response_handlers[seq_num] = response_handler
-        frame.writeToSocket(self.socket)
+        self._writeFrame(frame)
 
     def makeChain(self, is_permission=False, unelaborate=False, dots=None):
         seq_num = Frame.generateSequenceNumber()
@@ -804,7 +1524,7 @@ class Client(object):
         with self.synchronous_results_lock:
             self.synchronous_cond_vars[frame.seq_num] = \
                     threading.Condition(self.synchronous_results_lock)
-        frame.writeToSocket(self.socket)
+        self._writeFrame(frame)
 
         with self.synchronous_results_lock:
             while frame.seq_num not in self.synchronous_results:
@@ -832,7 +1552,7 @@ class Client(object):
 
         with self.response_handlers_lock:
             self.response_handlers[seq_num] = response_handler
-        frame.writeToSocket(self.socket)
+        self._writeFrame(frame)
 
         if view_change_handler is not None:
             with self.result_handlers_lock:
@@ -859,7 +1579,7 @@ class Client(object):
         with self.synchronous_results_lock:
             self.synchronous_cond_vars[seq_num] = \
                     threading.Condition(self.synchronous_results_lock)
-        frame.writeToSocket(self.socket)
+        self._writeFrame(frame)
 
         if view_change_handler is not None:
             with self.result_handlers_lock:
@@ -894,7 +1614,7 @@ class Client(object):
             self.response_handlers[seq_num] = response_handler
         with self.result_handlers_lock:
             self.result_handlers[seq_num] = result_handler
-        frame.writeToSocket(self.socket)
+        self._writeFrame(frame)
 
     def viewSubscribe(self, interface_name, result_handler, signal=None, slot=None):
         if signal is None and slot is None:
@@ -920,7 +1640,7 @@ class Client(object):
         with self.synchronous_results_lock:
             self.synchronous_cond_vars[seq_num] = \
                     threading.Condition(self.synchronous_results_lock)
-        frame.writeToSocket(self.socket)
+        self._writeFrame(frame)
 
         with self.synchronous_results_lock:
             while not seq_num in self.symchronous_results:
@@ -948,7 +1668,7 @@ class Client(object):
 
         with self.response_handlers_lock:
             self.response_handlers[seq_num] = response_handler
-        frame.writeToSocket(self.socket)
+        self._writeFrame(frame)
 
     def viewPublish(self, interface_name, payload_objects, signal=None, slot=None):
         if signal is None and slot is NOne:
@@ -973,7 +1693,7 @@ class Client(object):
         with self.synchronous_results_lock:
             self.synchronous_cond_vars[seq_num] = \
                     threading.Condition(self.synchronous_results_lock)
-        frame.writeToSocket(self.socket)
+        self._writeFrame(frame)
 
         with self.synchronous_results_lock:
             while not seq_num in self.synchronous_results:
@@ -999,7 +1719,7 @@ class Client(object):
         with self.synchronous_results_lock:
             self.synchronous_cond_vars[seq_num] = \
                     threading.Condition(self.synchronous_results_lock)
-        frame.writeToSocket(self.socket)
+        self._writeFrame(frame)
 
         with self.synchronous_results_lock:
             while not seq_num in self.synchronous_results:
@@ -1031,7 +1751,7 @@ class Client(object):
         with self.synchronous_results_lock:
             self.synchronous_cond_vars[seq_num] = \
                     threading.Condition(self.synchronous_results_lock)
-        frame.writeToSocket(self.socket)
+        self._writeFrame(frame)
 
         with self.synchronous_results_lock:
             while not seq_num in self.synchronous_results:
@@ -1042,3 +1762,109 @@ class Client(object):
         if result.status != "okay":
             raise RuntimeError("Unresolve failed: " + result.reason)
         return result.getFirstValue("value")
+
+    # Sends an alias lookup that the agent answers locally. response_handler
+    # is called with the response and the round trip time in seconds.
+    def asyncPing(self, response_handler):
+        seq_num = Frame.generateSequenceNumber()
+        frame = Frame("resa", seq_num)
+        frame.addKVPair("longkey", PING_ALIAS)
+
+        start = time.time()
+        def responseHandler(response):
+            # Timed on the listener thread, before any wake-up latency
+            response_handler(response, time.time() - start)
+
+        with self.response_handlers_lock:
+            self.response_handlers[seq_num] = responseHandler
+        try:
+            self._writeFrame(frame)
+        except socket.error:
+            self._cancelRequest(seq_num)
+            raise
+        return seq_num
+
+    # Measures the round trip time to the agent, in seconds. Any answer
+    # counts; only a lost connection or no answer within timeout seconds
+    # raises.
+    def ping(self, timeout=None):
+        answered = threading.Event()
+        answers = []
+        def responseHandler(response, rtt):
+            answers.append((response, rtt))
+            answered.set()
+
+        try:
+            seq_num = self.asyncPing(responseHandler)
+        except socket.error as e:
+            raise RuntimeError("Ping failed: " + str(e))
+        if not answered.wait(timeout):
+            self._cancelRequest(seq_num)
+            raise RuntimeError("Ping timed out")
+
+        response, rtt = answers[0]
+        if response.status != "okay" and response.reason == CONNECTION_LOST:
+            raise RuntimeError("Ping failed: " + response.reason)
+        return rtt
+
+    # Pings the agent every interval seconds. If no answer arrives within
+    # timeout seconds the connection is considered stalled, as a half-open
+    # TCP connection would be, and is shut down: every request waiting on it
+    # fails with CONNECTION_LOST and reconnect() may be called. Round trip
+    # times are recorded in self.heartbeat_stats.
+    def startHeartbeat(self, interval=DEFAULT_HEARTBEAT_INTERVAL,
+                       timeout=DEFAULT_HEARTBEAT_TIMEOUT):
+        if interval <= 0 or timeout <= 0:
+            raise ValueError("Heartbeat interval and timeout must be positive")
+        self.stopHeartbeat()
+        stopped = threading.Event()
+        self.heartbeat_stopped = stopped
+        heartbeat = threading.Thread(target=self._heartbeat, args=(interval, timeout, stopped))
+        heartbeat.daemon = True
+        heartbeat.start()
+
+    def stopHeartbeat(self):
+        stopped = self.heartbeat_stopped
+        self.heartbeat_stopped = None
+        if stopped is not None:
+            stopped.set()
+
+    def _heartbeat(self, interval, timeout, stopped):
+        while not stopped.wait(interval):
+            with self.connection_lock:
+                if not self.connected:
+                    continue
+                sock = self.socket
+
+            answered = threading.Event()
+            answers = []
+            def responseHandler(response, rtt):
+                answers.append((response, rtt))
+                answered.set()
+            # Sent from its own thread, so that a send blocked on a stalled
+            # connection is detected as well
+            sender = threading.Thread(target=self._sendProbe, args=(responseHandler,))
+            sender.daemon = True
+            sender.start()
+
+            if not answered.wait(timeout):
+                if stopped.is_set():
+                    return
+                self.heartbeat_stats.stalls += 1
+                try:
+                    # The reader sees the connection end and fails every
+                    # waiting request
+                    sock.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    pass
+                continue
+            response, rtt = answers[0]
+            if response.status == "okay" or response.reason != CONNECTION_LOST:
+                self.heartbeat_stats.record(rtt)
+
+    def _sendProbe(self, response_handler):
+        try:
+            self.asyncPing(response_handler)
+        except socket.error:
+            # Detected as a stall, or the connection was lost meanwhile
+            pass
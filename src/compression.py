@@ -0,0 +1,63 @@
+import zlib
+
+from bwtypes import COMPRESSED_MAGIC, CompressedPayloadObject, FilePayloadObject, \
+                    dottedToNum
+from multiplexer import URITrie
+
+DEFAULT_THRESHOLD = 1024
+DEFAULT_LEVEL = 6
+
+# Decides which published payload objects are compressed, and at what zlib
+# level. Payloads no larger than threshold are sent as-is. The level is taken
+# from the first matching URI pattern in uri_levels, then from type_levels
+# (keyed by dotted type or type number), then from level. A level of 0
+# disables compression. A payload is only sent compressed if that makes it
+# smaller.
+class CompressionPolicy(object):
+    def __init__(self, threshold=DEFAULT_THRESHOLD, level=DEFAULT_LEVEL,
+                 uri_levels=None, type_levels=None):
+        self.threshold = threshold
+        self.level = level
+        self.uri_levels = URITrie()
+        if uri_levels is not None:
+            for pattern, uri_level in uri_levels.iteritems():
+                self.uri_levels.add(pattern, uri_level)
+        self.type_levels = {}
+        if type_levels is not None:
+            for po_type, type_level in type_levels.iteritems():
+                if isinstance(po_type, tuple):
+                    po_type = dottedToNum(po_type)
+                self.type_levels[po_type] = type_level
+
+    def levelFor(self, uri, po):
+        uri_levels = self.uri_levels.match(uri)
+        if len(uri_levels) > 0:
+            return uri_levels[0]
+        if len(self.type_levels) > 0:
+            type_num = po.type_num
+            if type_num is None:
+                type_num = dottedToNum(po.type_dotted)
+            type_level = self.type_levels.get(type_num)
+            if type_level is not None:
+                return type_level
+        return self.level
+
+    def compress(self, uri, payload_objects):
+        compressed_pos = []
+        for po in payload_objects:
+            if isinstance(po, (CompressedPayloadObject, FilePayloadObject)) or \
+                    len(po.content) <= self.threshold:
+                compressed_pos.append(po)
+                continue
+            level = self.levelFor(uri, po)
+            if level == 0:
+                compressed_pos.append(po)
+                continue
+            compressed = COMPRESSED_MAGIC + zlib.compress(po.content, level)
+            if len(compressed) >= len(po.content):
+                compressed_pos.append(po)
+                continue
+            compressed_po = CompressedPayloadObject(po.type_dotted, po.type_num, compressed)
+            compressed_po.content = po.content
+            compressed_pos.append(compressed_po)
+        return compressed_pos
@@ -0,0 +1,72 @@
+import collections
+import socket
+import threading
+
+from bwtypes import UNACKED_SEQ_NUM
+
+# Queues outgoing publications for a writer thread, keeping at most one unsent
+# frame per command and URI. A publication to a URI that still has a frame
+# waiting replaces that frame in place, so when producers outrun the socket
+# only the newest value per URI is sent. Acknowledged and unacknowledged
+# publications never replace each other, since only the former get a
+# response. Publications may be reordered with respect to other requests,
+# which are written directly. The queue closes when the socket fails, and
+# Client.reconnect() replaces it.
+class ConflatingQueue(object):
+    def __init__(self, client):
+        self.client = client
+        self.frames = collections.OrderedDict()
+        self.cond_var = threading.Condition()
+        self.closed = False
+        self.superseded = 0
+        self.superseded_by_uri = collections.defaultdict(int)
+        self.writer = threading.Thread(target=self._run)
+        self.writer.daemon = True
+        self.writer.start()
+
+    # Returns False, without queueing the frame, once the queue is closed
+    def put(self, frame):
+        uri = frame.getFirstValue("uri")
+        key = (frame.command, uri, frame.seq_num == UNACKED_SEQ_NUM)
+        with self.cond_var:
+            if self.closed:
+                return False
+            old_frame = self.frames.get(key)
+            if old_frame is not None:
+                # The superseded publication is acknowledged along with its
+                # replacement. Handlers are merged before the replacement can
+                # be sent, so its response can't arrive first.
+                self.client._mergeResponseHandlers(old_frame.seq_num, frame.seq_num)
+                self.superseded += 1
+                self.superseded_by_uri[uri] += 1
+            else:
+                self.cond_var.notify()
+            self.frames[key] = frame
+        return True
+
+    def __len__(self):
+        with self.cond_var:
+            return len(self.frames)
+
+    def _run(self):
+        while True:
+            with self.cond_var:
+                while len(self.frames) == 0 and not self.closed:
+                    self.cond_var.wait()
+                if len(self.frames) == 0:
+                    return
+                _, frame = self.frames.popitem(last=False)
+            try:
+                self.client._sendFrame(frame)
+            except socket.error:
+                with self.cond_var:
+                    self.closed = True
+                    self.frames.clear()
+                return
+
+    # Stops the writer once every queued frame has been sent
+    def close(self):
+        with self.cond_var:
+            self.closed = True
+            self.cond_var.notify()
+        self.writer.join()
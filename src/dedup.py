@@ -0,0 +1,86 @@
+import collections
+import hashlib
+import struct
+import threading
+import time
+
+from bwtypes import _lookupPayloadType, dottedToNum
+
+DEFAULT_MAX_ENTRIES = 65536
+# Type number and length of each payload object, hashed ahead of its body
+ITEM_HEADER = struct.Struct("<IQ")
+
+# Remembers recently delivered messages so that repeated deliveries of the
+# same message can be dropped. A message is identified by the value of its
+# id_key kv pair if it has one, and otherwise by a digest of its URI and
+# payload objects. At most max_entries messages are remembered, each for at
+# most window seconds if a window is given. One cache may be shared by
+# several subscriptions to suppress duplicates across them.
+class DedupCache(object):
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, window=None, id_key=None):
+        if max_entries < 1:
+            raise ValueError("Cache must hold at least one entry")
+        self.max_entries = max_entries
+        self.window = window
+        self.id_key = id_key
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # Takes a Frame, or a BosswaveResult
+    def frameKey(self, frame):
+        if self.id_key is not None:
+            message_id = frame.getFirstValue(self.id_key)
+            if message_id is not None:
+                return "id:" + message_id
+
+        digest = hashlib.sha1(frame.getFirstValue("uri") or "")
+        # Bodies are read without constructing PayloadObjects where possible
+        raw_payload_objects = getattr(frame, "raw_payload_objects", ())
+        if len(raw_payload_objects) > 0:
+            for type_str, body in raw_payload_objects:
+                type_dotted, type_num = _lookupPayloadType(type_str)
+                if type_num is None:
+                    type_num = dottedToNum(type_dotted)
+                digest.update(ITEM_HEADER.pack(type_num, len(body)))
+                digest.update(body)
+        elif frame.payload_objects is not None:
+            for po in frame.payload_objects:
+                content = po.content
+                type_num = po.type_num
+                if type_num is None:
+                    type_num = dottedToNum(po.type_dotted)
+                digest.update(ITEM_HEADER.pack(type_num, len(content)))
+                digest.update(content)
+        return digest.digest()
+
+    # Records the frame's message, returning True if it was already seen
+    def isDuplicate(self, frame):
+        key = self.frameKey(frame)
+        now = time.time()
+        with self.lock:
+            if self.window is not None:
+                cutoff = now - self.window
+                while len(self.entries) > 0:
+                    oldest_key, timestamp = next(self.entries.iteritems())
+                    if timestamp >= cutoff:
+                        break
+                    del self.entries[oldest_key]
+
+            if key in self.entries:
+                self.hits += 1
+                return True
+            self.misses += 1
+            self.entries[key] = now
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            return False
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
@@ -0,0 +1,324 @@
+import itertools
+import socket
+import threading
+import time
+
+from bwtypes import BosswaveResponse
+from client import Client
+from transport import transportFromAddress
+
+DEFAULT_PROBE_INTERVAL = 5.0
+DEFAULT_PROBE_TIMEOUT = 2.0
+# Another agent takes over from a healthy current agent only if its latency
+# is below this fraction of the current agent's
+DEFAULT_SWITCH_RATIO = 0.5
+# Weight of each new probe in an agent's smoothed latency
+LATENCY_SMOOTHING = 0.3
+
+class _Agent(object):
+    def __init__(self, transport):
+        self.transport = transport
+        self.client = None
+        # Entity key last set on client
+        self.entity_key = None
+        # Smoothed round trip time in seconds, None while unhealthy
+        self.latency = None
+
+    def isHealthy(self):
+        client = self.client
+        return client is not None and client.connected and self.latency is not None
+
+# Spreads a client over several agents. Every agent is connected to and
+# pinged every probe_interval seconds, and requests go to the healthy agent
+# with the lowest latency. When the current agent fails a probe or loses its
+# connection, traffic fails over to the next fastest agent within about
+# probe_interval + probe_timeout seconds, and subscriptions made through the
+# FailoverClient are made again on the new agent. Failed agents are retried
+# at every probe. With redundancy > 1, each publication is sent to that many
+# of the fastest agents at once and succeeds if any of them accepts it.
+#
+#   bw_client = FailoverClient(["agent1.example.com:28589", "agent2.example.com:28589"])
+#   bw_client.setEntityFromFile("me.ent")
+#   bw_client.subscribe("building/+/temp", onTemperature)
+class FailoverClient(object):
+    def __init__(self, agents, probe_interval=DEFAULT_PROBE_INTERVAL,
+                 probe_timeout=DEFAULT_PROBE_TIMEOUT, redundancy=1,
+                 switch_ratio=DEFAULT_SWITCH_RATIO, **client_kwargs):
+        if len(agents) == 0:
+            raise ValueError("At least one agent is required")
+        if redundancy < 1:
+            raise ValueError("Redundancy must be at least 1")
+        self.agents = []
+        for agent in agents:
+            if isinstance(agent, basestring):
+                agent = transportFromAddress(agent)
+            self.agents.append(_Agent(agent))
+        self.probe_interval = probe_interval
+        self.probe_timeout = probe_timeout
+        self.redundancy = redundancy
+        self.switch_ratio = switch_ratio
+        self.client_kwargs = client_kwargs
+        self.entity_key = None
+        # Held while the current agent changes and subscriptions move
+        self.lock = threading.RLock()
+        self.current = None
+        self.failovers = 0
+        self.subscriptions = {}
+        # Ids of subscriptions some thread is moving to the current agent
+        self.moving = set()
+        self.subscription_ids = itertools.count(1)
+
+        self.stopped = threading.Event()
+        self.ready = threading.Event()
+        self.first_probes = len(self.agents)
+        self.threads = []
+        for agent in self.agents:
+            thread = threading.Thread(target=self._run, args=(agent,))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+        self.ready.wait()
+        if self.current is None:
+            self.close()
+            raise RuntimeError("No agent could be reached")
+
+    # Connects, sets the entity and pings outside the lock, updating the
+    # agent's state under it. An agent is healthy only once its client has
+    # the current entity and has answered a ping.
+    def _probe(self, agent):
+        client = agent.client
+        if client is not None and not client.connected:
+            self._drop(agent, client)
+            client = None
+        if client is None:
+            try:
+                client = Client(transport=agent.transport, **self.client_kwargs)
+            except (socket.error, RuntimeError):
+                return
+            with self.lock:
+                agent.client = client
+
+        entity_key = self.entity_key
+        if agent.entity_key != entity_key:
+            try:
+                client.setEntity(entity_key)
+            except (socket.error, RuntimeError):
+                self._drop(agent, client)
+                return
+            with self.lock:
+                agent.entity_key = entity_key
+
+        try:
+            rtt = client.ping(self.probe_timeout)
+        except RuntimeError:
+            # A stalled connection is dropped so that it is reopened
+            self._drop(agent, client)
+            return
+        with self.lock:
+            if agent.latency is None:
+                agent.latency = rtt
+            else:
+                agent.latency += LATENCY_SMOOTHING * (rtt - agent.latency)
+
+    def _drop(self, agent, client):
+        with self.lock:
+            agent.client = None
+            agent.entity_key = None
+            agent.latency = None
+        client.close()
+
+    def _run(self, agent):
+        while not self.stopped.is_set():
+            self._probe(agent)
+            with self.lock:
+                if not self.stopped.is_set():
+                    self._select()
+                if not self.ready.is_set():
+                    self.first_probes -= 1
+                    if self.current is not None or self.first_probes == 0:
+                        self.ready.set()
+            self._moveSubscriptions()
+            self.stopped.wait(self.probe_interval)
+
+    # Picks the agent requests should go to. Called with the lock held.
+    def _select(self):
+        healthy = [agent for agent in self.agents if agent.isHealthy()]
+        current = self.current
+        if len(healthy) > 0:
+            best = min(healthy, key=lambda agent: agent.latency)
+            if current is None or not current.isHealthy() or \
+                    best.latency < current.latency * self.switch_ratio:
+                if best is not current:
+                    # Only switches away from a failed agent are failovers
+                    if current is not None and not current.isHealthy():
+                        self.failovers += 1
+                    self.current = best
+
+    # Makes every subscription on the current agent that is not already
+    # there, dropping it from its previous agent. Which subscriptions move is
+    # decided under the lock, but the requests are made outside it, so that a
+    # stalled agent holds up no other thread.
+    def _moveSubscriptions(self):
+        with self.lock:
+            if self.current is None or self.current.client is None:
+                return
+            client = self.current.client
+            moves = []
+            for subscription_id, subscription in self.subscriptions.items():
+                if subscription[1] is not client and subscription_id not in self.moving:
+                    self.moving.add(subscription_id)
+                    moves.append((subscription_id, list(subscription)))
+
+        # The new subscription is made before the old one is dropped, so
+        # that no message is missed when leaving a healthy agent. Messages
+        # may be delivered twice meanwhile.
+        for subscription_id, (spec, old_client, old_handle) in moves:
+            try:
+                handle = client.subscribe(**spec)
+            except (socket.error, RuntimeError):
+                # Left where it is and retried at the next probe
+                with self.lock:
+                    self.moving.discard(subscription_id)
+                continue
+            with self.lock:
+                self.moving.discard(subscription_id)
+                subscription = self.subscriptions.get(subscription_id)
+                if subscription is not None:
+                    subscription[1] = client
+                    subscription[2] = handle
+            if subscription is None:
+                # Unsubscribed from the old agent while it was moving
+                old_client, old_handle = client, handle
+            if old_client is not None and old_client.connected and old_handle is not None:
+                try:
+                    old_client.unsubscribe(old_handle)
+                except (socket.error, RuntimeError):
+                    pass
+
+    def _currentClient(self):
+        with self.lock:
+            if self.current is None or not self.current.isHealthy():
+                self._select()
+            if self.current is None or not self.current.isHealthy():
+                raise RuntimeError("No healthy agent")
+            return self.current.client
+
+    def _markFailed(self, client):
+        with self.lock:
+            for agent in self.agents:
+                if agent.client is client:
+                    agent.latency = None
+            self._select()
+        self._moveSubscriptions()
+
+    # Runs operation with the current agent's client, failing over and
+    # trying once more if that client's connection is lost
+    def _withFailover(self, operation):
+        client = self._currentClient()
+        try:
+            return operation(client)
+        except (socket.error, RuntimeError):
+            if client.connected:
+                raise
+        self._markFailed(client)
+        return operation(self._currentClient())
+
+    # The client of the current agent, for requests not wrapped here. It
+    # does not fail over by itself.
+    def getClient(self):
+        return self._currentClient()
+
+    # Smoothed latency in seconds of each agent, None for unhealthy agents
+    def latencies(self):
+        return [(str(agent.transport), agent.latency) for agent in self.agents]
+
+    # Sets the entity on every connected agent. Agents that miss it, or
+    # connect later, get it at their next probe.
+    def setEntity(self, key):
+        with self.lock:
+            self.entity_key = key
+            agents = [(agent, agent.client) for agent in self.agents
+                      if agent.client is not None]
+        for agent, client in agents:
+            try:
+                client.setEntity(key)
+            except (socket.error, RuntimeError):
+                if client.connected:
+                    raise
+                continue
+            with self.lock:
+                if agent.client is client and self.entity_key == key:
+                    agent.entity_key = key
+
+    def setEntityFromFile(self, key_file_name):
+        with open(key_file_name, "rb") as f:
+            f.read(1) # Strip leading byte
+            self.setEntity(f.read())
+
+    def publish(self, uri, **kwargs):
+        if self.redundancy == 1:
+            self._withFailover(lambda client: client.publish(uri, **kwargs))
+            return
+
+        with self.lock:
+            healthy = sorted([agent for agent in self.agents if agent.isHealthy()],
+                             key=lambda agent: agent.latency)
+            clients = [agent.client for agent in healthy[:self.redundancy]]
+        if len(clients) == 0:
+            raise RuntimeError("No healthy agent")
+
+        responses = []
+        done = threading.Condition()
+        def responseHandler(response):
+            with done:
+                responses.append(response)
+                done.notify()
+        for client in clients:
+            try:
+                client.asyncPublish(uri, responseHandler, **kwargs)
+            except socket.error as e:
+                responseHandler(BosswaveResponse("error", str(e), [], [], []))
+        # An agent that stalls fails the publication after probe_timeout
+        deadline = time.time() + self.probe_timeout
+        with done:
+            while len(responses) < len(clients):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                done.wait(remaining)
+            responses = list(responses)
+        reasons = [response.reason for response in responses]
+        if len(responses) < len(clients):
+            reasons.append("Publish timed out")
+        if not any([response.status == "okay" for response in responses]):
+            raise RuntimeError("Failed to publish: " + "; ".join(reasons))
+
+    # Returns an id for unsubscribe(), which stays valid across failovers
+    def subscribe(self, uri, result_handler, **kwargs):
+        spec = dict(kwargs, uri=uri, result_handler=result_handler)
+        def subscribeOn(client):
+            handle = client.subscribe(**spec)
+            with self.lock:
+                subscription_id = next(self.subscription_ids)
+                # Moved at the next probe if the agent changed meanwhile
+                self.subscriptions[subscription_id] = [spec, client, handle]
+                return subscription_id
+        return self._withFailover(subscribeOn)
+
+    def unsubscribe(self, subscription_id):
+        with self.lock:
+            spec, client, handle = self.subscriptions.pop(subscription_id)
+        if client is not None and client.connected and handle is not None:
+            client.unsubscribe(handle)
+
+    def query(self, uri, **kwargs):
+        return self._withFailover(lambda client: client.query(uri, **kwargs))
+
+    def close(self):
+        self.stopped.set()
+        for thread in self.threads:
+            if thread is not threading.current_thread():
+                thread.join()
+        for agent in self.agents:
+            if agent.client is not None:
+                agent.client.close()
@@ -0,0 +1,202 @@
+import itertools
+import threading
+
+MATCH_CACHE_SIZE = 4096
+
+def _segments(uri):
+    return uri.strip('/').split('/')
+
+def _covers(general, i, specific, j):
+    if i == len(general):
+        return j == len(specific)
+    if general[i] == '*':
+        # A '*' matches any sequence of segments, wildcards included
+        for k in range(j, len(specific) + 1):
+            if _covers(general, i + 1, specific, k):
+                return True
+        return False
+    if j == len(specific) or specific[j] == '*':
+        return False
+    if general[i] == '+' or general[i] == specific[j]:
+        return _covers(general, i + 1, specific, j + 1)
+    return False
+
+# True if every URI matched by the specific pattern is also matched by the
+# general one
+def uriCovers(general, specific):
+    return _covers(_segments(general), 0, _segments(specific), 0)
+
+class _TrieNode(object):
+    def __init__(self):
+        self.children = {}
+        self.plus = None
+        self.star = None
+        self.values = []
+
+# Matches URIs against a set of Bosswave URI patterns, in which '+' matches
+# exactly one segment and '*' matches any number of segments, including none.
+# Results are cached per URI until the set of patterns changes.
+class URITrie(object):
+    def __init__(self):
+        self.root = _TrieNode()
+        self.size = 0
+        self.cache = {}
+
+    def __len__(self):
+        return self.size
+
+    def _node(self, pattern, create):
+        node = self.root
+        for segment in _segments(pattern):
+            if segment == '+':
+                if node.plus is None and create:
+                    node.plus = _TrieNode()
+                node = node.plus
+            elif segment == '*':
+                if node.star is None and create:
+                    node.star = _TrieNode()
+                node = node.star
+            else:
+                child = node.children.get(segment)
+                if child is None and create:
+                    child = _TrieNode()
+                    node.children[segment] = child
+                node = child
+            if node is None:
+                return None
+        return node
+
+    def add(self, pattern, value):
+        self._node(pattern, True).values.append(value)
+        self.size += 1
+        self.cache = {}
+
+    def remove(self, pattern, value):
+        node = self._node(pattern, False)
+        if node is None or value not in node.values:
+            return False
+        node.values.remove(value)
+        self.size -= 1
+        self.cache = {}
+        return True
+
+    def _match(self, node, segments, i, matches):
+        if node.star is not None:
+            for j in range(i, len(segments) + 1):
+                self._match(node.star, segments, j, matches)
+        if i == len(segments):
+            matches.extend(node.values)
+            return
+        child = node.children.get(segments[i])
+        if child is not None:
+            self._match(child, segments, i + 1, matches)
+        if node.plus is not None:
+            self._match(node.plus, segments, i + 1, matches)
+
+    # Returns the values of all patterns matching uri, each at most once
+    def match(self, uri):
+        matches = self.cache.get(uri)
+        if matches is None:
+            found = []
+            self._match(self.root, _segments(uri), 0, found)
+            matches = []
+            seen = set()
+            for value in found:
+                if id(value) not in seen:
+                    seen.add(id(value))
+                    matches.append(value)
+            if len(self.cache) < MATCH_CACHE_SIZE:
+                self.cache[uri] = matches
+        return matches
+
+class _Upstream(object):
+    def __init__(self, uri):
+        self.uri = uri
+        self.handle = None
+        self.trie = URITrie()
+        self.local_handles = set()
+
+# Shares agent-side subscriptions among many local handlers. Each local
+# pattern is attached to one upstream subscription that covers it: either one
+# of the configured prefixes (e.g. "building/*"), an existing upstream whose
+# pattern covers it, or a new upstream for the pattern itself. Incoming
+# messages are matched against the patterns attached to the upstream that
+# delivered them, so each handler sees a message once. An upstream
+# subscription is torn down when its last local handler leaves.
+class SubscriptionMultiplexer(object):
+    def __init__(self, client, prefixes=None, **subscribe_kwargs):
+        self.client = client
+        self.prefixes = list(prefixes) if prefixes is not None else []
+        self.subscribe_kwargs = subscribe_kwargs
+        self.lock = threading.RLock()
+        self.upstreams = {}
+        self.local_subscriptions = {}
+        self.handle_counter = itertools.count(1)
+
+    def _dispatcher(self, upstream):
+        def dispatch(result):
+            with self.lock:
+                entries = upstream.trie.match(result.uri)
+            for _, handler in entries:
+                handler(result)
+        return dispatch
+
+    def _openUpstream(self, uri):
+        upstream = _Upstream(uri)
+        upstream.handle = self.client.subscribe(uri, self._dispatcher(upstream),
+                                                **self.subscribe_kwargs)
+        self.upstreams[uri] = upstream
+        return upstream
+
+    def _closeUpstream(self, upstream):
+        del self.upstreams[upstream.uri]
+        self.client.unsubscribe(upstream.handle)
+
+    def _findUpstream(self, pattern):
+        for upstream in self.upstreams.itervalues():
+            if uriCovers(upstream.uri, pattern):
+                return upstream
+        uri = pattern
+        for prefix in self.prefixes:
+            if uriCovers(prefix, pattern):
+                uri = prefix
+                break
+
+        upstream = self._openUpstream(uri)
+        # Fold narrower upstreams into the new one to avoid duplicate deliveries
+        for other in self.upstreams.values():
+            if other is not upstream and uriCovers(uri, other.uri):
+                for local_handle in other.local_handles:
+                    local_pattern, entry, _ = self.local_subscriptions[local_handle]
+                    other.trie.remove(local_pattern, entry)
+                    upstream.trie.add(local_pattern, entry)
+                    upstream.local_handles.add(local_handle)
+                    self.local_subscriptions[local_handle] = (local_pattern, entry, upstream)
+                other.local_handles.clear()
+                self._closeUpstream(other)
+        return upstream
+
+    def subscribe(self, pattern, handler):
+        with self.lock:
+            upstream = self._findUpstream(pattern)
+            local_handle = next(self.handle_counter)
+            entry = (local_handle, handler)
+            upstream.trie.add(pattern, entry)
+            upstream.local_handles.add(local_handle)
+            self.local_subscriptions[local_handle] = (pattern, entry, upstream)
+            return local_handle
+
+    def unsubscribe(self, local_handle):
+        with self.lock:
+            local_subscription = self.local_subscriptions.pop(local_handle, None)
+            if local_subscription is None:
+                raise ValueError("Unknown subscription handle: " + str(local_handle))
+            pattern, entry, upstream = local_subscription
+            upstream.trie.remove(pattern, entry)
+            upstream.local_handles.discard(local_handle)
+            if len(upstream.local_handles) == 0:
+                self._closeUpstream(upstream)
+
+    def upstreamURIs(self):
+        with self.lock:
+            return self.upstreams.keys()
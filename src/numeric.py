@@ -0,0 +1,55 @@
+import numpy as np
+
+import ponames
+from bwtypes import dottedToNum, numToDotted
+
+DOUBLE_DTYPE = "<f8"
+
+def _normalizeType(po_type):
+    if isinstance(po_type, tuple):
+        return po_type, dottedToNum(po_type)
+    return numToDotted(po_type), po_type
+
+# Decodes every payload object of the given type in a batch of
+# BosswaveResults (e.g. the output of Client.query or a buffered window of
+# subscription messages) with a single np.frombuffer call over their
+# concatenated contents. Payloads holding several values contribute one entry
+# per value. Returns (values, uris, timestamps) as parallel arrays; the
+# timestamp of a result that has none is NaN.
+def decodeNumeric(results, po_type=ponames.PODFDouble, dtype=DOUBLE_DTYPE):
+    dtype = np.dtype(dtype)
+    item_size = dtype.itemsize
+    type_dotted, type_num = _normalizeType(po_type)
+
+    bodies = []
+    counts = []
+    uris = []
+    timestamps = []
+    for result in results:
+        if result.payload_objects is None:
+            continue
+        for po in result.payload_objects:
+            if po.type_num != type_num and po.type_dotted != type_dotted:
+                continue
+            content = po.content
+            count = len(content) // item_size
+            if count == 0:
+                continue
+            if count * item_size != len(content):
+                content = content[:count*item_size]
+            bodies.append(content)
+            counts.append(count)
+            uris.append(result.uri)
+            timestamps.append(result.timestamp)
+
+    values = np.frombuffer("".join(bodies), dtype=dtype)
+    uris = np.array(uris, dtype=object)
+    timestamps = np.array(timestamps, dtype=np.float64)
+    if len(values) != len(counts):
+        counts = np.array(counts)
+        uris = np.repeat(uris, counts)
+        timestamps = np.repeat(timestamps, counts)
+    return values, uris, timestamps
+
+def decodeDoubles(results):
+    return decodeNumeric(results, ponames.PODFDouble, DOUBLE_DTYPE)
@@ -0,0 +1,304 @@
+import collections
+import mmap
+import os
+import socket
+import struct
+import threading
+import time
+
+from bwtypes import Frame, FrameParser, frameHeader
+from client import Client, CONNECTION_LOST
+
+OUTBOX_MAGIC = "BW2OBX\x01\x00"
+# Magic, then the offset up to which the segment's records are acknowledged
+SEGMENT_HEADER = struct.Struct("<8sQ")
+RECORD_HEADER = struct.Struct("<I")
+DEFAULT_SEGMENT_SIZE = 16 * 1024 * 1024
+DEFAULT_WINDOW = 64
+DEFAULT_RETRY_INTERVAL = 5.0
+
+# A publish frame sent as bytes that were already serialized, under a
+# sequence number of its own. Its key/value pairs are kept for the client's
+# conflation.
+class _SerializedFrame(Frame):
+    def __init__(self, data, seq_num, kv_pairs):
+        Frame.__init__(self, data[:4], seq_num)
+        self.kv_pairs = kv_pairs
+        self.data = data
+
+    def serialize(self):
+        body_offset = self.data.index("\n") + 1
+        return frameHeader(self.command, len(self.data) - body_offset, self.seq_num) + \
+               self.data[body_offset:]
+
+# One file of the outbox log. Records are a length followed by a serialized
+# publish frame; the file is preallocated, so a zero length marks the end of
+# the records written so far.
+class _Segment(object):
+    def __init__(self, path, size=None):
+        self.path = path
+        create = not os.path.exists(path)
+        self.file = open(path, "w+b" if create else "r+b")
+        if create:
+            self.file.truncate(size)
+        self.mm = mmap.mmap(self.file.fileno(), 0)
+        self.size = len(self.mm)
+        if create:
+            self.mm[0:SEGMENT_HEADER.size] = SEGMENT_HEADER.pack(OUTBOX_MAGIC,
+                                                                  SEGMENT_HEADER.size)
+        magic, self.acked = SEGMENT_HEADER.unpack_from(self.mm, 0)
+        if magic != OUTBOX_MAGIC:
+            self.close()
+            raise ValueError("Not an outbox segment: " + path)
+
+        # Find the end of the records already written
+        self.end = SEGMENT_HEADER.size
+        while self.end + RECORD_HEADER.size <= self.size:
+            length = RECORD_HEADER.unpack_from(self.mm, self.end)[0]
+            if length == 0:
+                break
+            self.end += RECORD_HEADER.size + length
+
+    def append(self, data):
+        record_end = self.end + RECORD_HEADER.size + len(data)
+        if record_end > self.size:
+            return False
+        self.mm[self.end+RECORD_HEADER.size:record_end] = data
+        # The length goes in last, so a partially written record is never read
+        RECORD_HEADER.pack_into(self.mm, self.end, len(data))
+        # Written to disk before it may be sent; flushes start on a page
+        start = self.end - self.end % mmap.PAGESIZE
+        self.mm.flush(start, record_end - start)
+        self.end = record_end
+        return True
+
+    def read(self, offset):
+        length = RECORD_HEADER.unpack_from(self.mm, offset)[0]
+        start = offset + RECORD_HEADER.size
+        return self.mm[start:start+length], start + length
+
+    def acknowledge(self, offset):
+        self.acked = offset
+        SEGMENT_HEADER.pack_into(self.mm, 0, OUTBOX_MAGIC, offset)
+
+    def close(self):
+        self.mm.flush()
+        self.mm.close()
+        self.file.close()
+
+    def remove(self):
+        self.close()
+        os.unlink(self.path)
+
+# A durable store-and-forward queue for publications. Every publication is
+# appended to a log of memory-mapped segment files in directory, and goes
+# straight to the agent while it is reachable and the in-flight window has
+# room. Otherwise a drain thread sends logged publications in order, at most
+# rate per second, reconnecting the client when the connection is down. Segments
+# are deleted once all their publications are acknowledged, and a new Outbox
+# on the same directory resumes from the first unacknowledged publication.
+# Delivery is at least once: publications in flight when the connection is
+# lost are sent again.
+#
+#   outbox = Outbox(bw_client, "/var/spool/bw2outbox", rate=200)
+#   outbox.publish(uri, payload_objects=pos)
+class Outbox(object):
+    def __init__(self, client, directory, segment_size=DEFAULT_SEGMENT_SIZE,
+                 window=DEFAULT_WINDOW, rate=None, retry_interval=DEFAULT_RETRY_INTERVAL):
+        if window < 1:
+            raise ValueError("Window must be at least 1")
+        self.client = client
+        self.directory = directory
+        self.segment_size = segment_size
+        self.window = window
+        self.rate = rate
+        self.retry_interval = retry_interval
+        self.cond_var = threading.Condition()
+        self.in_flight = 0
+        self.failed = 0
+        self.closed = False
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.segments = collections.deque()
+        names = sorted(name for name in os.listdir(directory) if name.endswith(".seg"))
+        for name in names:
+            self.segments.append(_Segment(os.path.join(directory, name)))
+        if len(self.segments) > 0:
+            self.next_segment_id = int(names[-1][:-len(".seg")]) + 1
+        else:
+            self.next_segment_id = 0
+            self._addSegment()
+
+        # Logged publications sent but not yet acknowledged, oldest first, as
+        # [segment, end offset, acknowledged]
+        self.unacked = collections.deque()
+        self._rewind()
+
+        self.drain_thread = threading.Thread(target=self._drain)
+        self.drain_thread.daemon = True
+        self.drain_thread.start()
+
+    def _addSegment(self):
+        path = os.path.join(self.directory, "{0:010d}.seg".format(self.next_segment_id))
+        self.next_segment_id += 1
+        segment = _Segment(path, self.segment_size)
+        self.segments.append(segment)
+        return segment
+
+    # Moves the read position back to the first unacknowledged publication
+    def _rewind(self):
+        self.unacked.clear()
+        self.read_segment = 0
+        self.read_offset = self.segments[0].acked
+
+    # Whether logged publications are waiting to be sent
+    def _backlog(self):
+        return self.read_segment < len(self.segments) - 1 or \
+               self.read_offset < self.segments[self.read_segment].end
+
+    def publish(self, uri, persist=False, primary_access_chain=None, expiry=None,
+                expiry_delta=None, elaborate_pac=None, auto_chain=False,
+                routing_objects=None, payload_objects=None):
+        if self.client.default_auto_chain is not None:
+            auto_chain = self.client.default_auto_chain
+        frame = Client._createPublishFrame(uri, persist, primary_access_chain, expiry,
+                                           expiry_delta, elaborate_pac, auto_chain,
+                                           routing_objects, payload_objects)
+        # Compressed before logging, since logged bytes are sent as they are
+        compression = self.client.compression
+        if compression is not None:
+            frame.payload_objects = compression.compress(uri, frame.payload_objects)
+        data = frame.serialize()
+        # Every publication is logged first, so that all of them are sent,
+        # and resent, in the order of the log. One with nothing logged before
+        # it waiting is sent right away rather than by the drain thread.
+        with self.cond_var:
+            if self.closed:
+                raise RuntimeError("Outbox is closed")
+            direct = self.client.connected and self.in_flight < self.window and \
+                     not self._backlog()
+            self._append(data)
+            if direct:
+                segment, _, end = self._nextRecord()
+                entry = [segment, end, False]
+                self.unacked.append(entry)
+                self.in_flight += 1
+        if direct:
+            self._send(data, frame.kv_pairs, entry)
+
+    def _append(self, data):
+        if SEGMENT_HEADER.size + RECORD_HEADER.size + len(data) > self.segment_size:
+            raise ValueError("Publication is larger than an outbox segment")
+        if not self.segments[-1].append(data):
+            self._addSegment().append(data)
+        self.cond_var.notify_all()
+
+    # Sends the serialized data of the logged publication entry. If the
+    # connection is lost first, it is sent again from the log.
+    def _send(self, data, kv_pairs, entry):
+        frame = _SerializedFrame(data, Frame.generateSequenceNumber(), kv_pairs)
+
+        def responseHandler(response):
+            with self.cond_var:
+                self.in_flight -= 1
+                if response.status == "okay" or response.reason != CONNECTION_LOST:
+                    if response.status != "okay":
+                        self.failed += 1
+                    entry[2] = True
+                    self._compact()
+                self.cond_var.notify_all()
+
+        try:
+            self.client.asyncRequest(frame, responseHandler)
+        except socket.error:
+            self.client.dropConnection()
+
+    # Records the acknowledged prefix of the log, deleting fully acknowledged
+    # segments other than the one being written
+    def _compact(self):
+        while len(self.unacked) > 0 and self.unacked[0][2]:
+            segment, offset, _ = self.unacked.popleft()
+            segment.acknowledge(offset)
+        while len(self.segments) > 1:
+            segment = self.segments[0]
+            pending = any(entry[0] is segment for entry in self.unacked)
+            if pending or segment.acked < segment.end or self.read_segment == 0:
+                break
+            self.segments.popleft()
+            self.read_segment -= 1
+            segment.remove()
+
+    def _nextRecord(self):
+        while True:
+            segment = self.segments[self.read_segment]
+            if self.read_offset < segment.end:
+                data, end = segment.read(self.read_offset)
+                self.read_offset = end
+                return segment, data, end
+            if self.read_segment == len(self.segments) - 1:
+                return None
+            self.read_segment += 1
+            self.read_offset = self.segments[self.read_segment].acked
+            self._compact()
+
+    def _drain(self):
+        interval = 1.0 / self.rate if self.rate is not None else 0
+        last_send = 0
+        while True:
+            if not self.client.connected:
+                with self.cond_var:
+                    if self.closed:
+                        return
+                    # Publications in flight on the old connection are resent
+                    self._rewind()
+                try:
+                    self.client.reconnect()
+                except (socket.error, RuntimeError):
+                    with self.cond_var:
+                        self.cond_var.wait(self.retry_interval)
+                    continue
+
+            with self.cond_var:
+                record = None
+                while not self.closed and self.client.connected:
+                    if self.in_flight < self.window:
+                        record = self._nextRecord()
+                        if record is not None:
+                            break
+                    self.cond_var.wait(self.retry_interval)
+                if self.closed:
+                    return
+                if record is None:
+                    continue
+                segment, data, end = record
+                entry = [segment, end, False]
+                self.unacked.append(entry)
+                self.in_flight += 1
+
+            delay = last_send + interval - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            last_send = time.time()
+            self._send(data, FrameParser().feed(data)[0].kv_pairs, entry)
+
+    # Number of logged publications not yet acknowledged
+    def pending(self):
+        with self.cond_var:
+            count = 0
+            for segment in self.segments:
+                offset = segment.acked
+                while offset < segment.end:
+                    offset = segment.read(offset)[1]
+                    count += 1
+            return count
+
+    def close(self):
+        with self.cond_var:
+            self.closed = True
+            self.cond_var.notify_all()
+        self.drain_thread.join()
+        with self.cond_var:
+            for segment in self.segments:
+                segment.close()
+            self.segments.clear()
@@ -0,0 +1,121 @@
+import json
+import msgpack
+import struct
+import threading
+
+import ponames
+from bwtypes import PayloadObject, PayloadTypeFilter, dottedToNum
+
+DOUBLE = struct.Struct("<d")
+
+class _Codec(object):
+    def __init__(self, prefix, mask, decode, encode):
+        self.prefix = prefix
+        self.mask = mask
+        self.decode = decode
+        self.encode = encode
+
+    def matches(self, type_num):
+        shift = 32 - self.mask
+        return (type_num >> shift) == (self.prefix >> shift)
+
+# Codecs are looked up by payload type number. The codec registered with the
+# longest matching mask wins, so a codec for "2.0.3.0/24" takes precedence
+# over one for "2.0.0.0/8". Lookups are cached per type number.
+class CodecRegistry(object):
+    def __init__(self):
+        self.codecs = []
+        self.cache = {}
+        self.lock = threading.Lock()
+
+    def register(self, po_type, decode, encode=None):
+        with self.lock:
+            for prefix, mask in PayloadTypeFilter(po_type).prefixes:
+                self.codecs.append(_Codec(prefix, mask, decode, encode))
+            self.codecs.sort(key=lambda codec: codec.mask, reverse=True)
+            self.cache = {}
+
+    def lookup(self, type_num):
+        codec = self.cache.get(type_num)
+        if codec is None:
+            with self.lock:
+                for candidate in self.codecs:
+                    if candidate.matches(type_num):
+                        codec = candidate
+                        break
+                if codec is not None:
+                    self.cache[type_num] = codec
+        return codec
+
+registry = CodecRegistry()
+
+def _typeNum(type_dotted, type_num):
+    if type_num is not None:
+        return type_num
+    return dottedToNum(type_dotted)
+
+def decodePayload(po):
+    codec = registry.lookup(_typeNum(po.type_dotted, po.type_num))
+    if codec is None:
+        raise ValueError("No codec registered for payload object type")
+    return codec.decode(po.content)
+
+def encodePayload(po_type, value):
+    if isinstance(po_type, tuple):
+        type_dotted, type_num = po_type, None
+    else:
+        type_dotted, type_num = None, po_type
+    codec = registry.lookup(_typeNum(type_dotted, type_num))
+    if codec is None or codec.encode is None:
+        raise ValueError("No encoder registered for payload object type")
+    return PayloadObject(type_dotted, type_num, codec.encode(value))
+
+def registerCodec(po_type, decode, encode=None):
+    registry.register(po_type, decode, encode)
+
+# msgpack packers and unpackers are reused per thread rather than created for
+# every payload
+_msgpack_state = threading.local()
+
+def _packMsgPack(value):
+    packer = getattr(_msgpack_state, "packer", None)
+    if packer is None:
+        packer = msgpack.Packer()
+        _msgpack_state.packer = packer
+    return packer.pack(value)
+
+def _unpackMsgPack(data):
+    unpacker = getattr(_msgpack_state, "unpacker", None)
+    if unpacker is None:
+        unpacker = msgpack.Unpacker()
+        _msgpack_state.unpacker = unpacker
+    unpacker.feed(data)
+    try:
+        value = unpacker.unpack()
+    except Exception:
+        _msgpack_state.unpacker = None
+        raise
+    # Drop any trailing data so that it can't leak into the next payload
+    for _ in unpacker:
+        _msgpack_state.unpacker = None
+        break
+    return value
+
+def _decodeDouble(data):
+    return DOUBLE.unpack(data)[0]
+
+def _encodeDouble(value):
+    return DOUBLE.pack(value)
+
+def _decodeText(data):
+    return data.decode("utf-8")
+
+def _encodeText(value):
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    return value
+
+registerCodec(ponames.PODFMaskMsgPack, _unpackMsgPack, _packMsgPack)
+registerCodec(ponames.PODFMaskDouble, _decodeDouble, _encodeDouble)
+registerCodec(ponames.PODFMaskText, _decodeText, _encodeText)
+registerCodec(ponames.PODFMaskJSON, json.loads, json.dumps)
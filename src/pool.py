@@ -0,0 +1,109 @@
+import collections
+import threading
+
+from client import Client
+
+DEFAULT_MAX_CLIENTS = 16
+
+def _readEntityFile(entity_file):
+    with open(entity_file, 'rb') as f:
+        f.read(1) # Strip leading byte
+        return f.read()
+
+# Keeps one warm connection per entity for services that act on behalf of
+# many entities. A connection is opened, and its entity set, the first time
+# the entity is used; each entity file is only read once. When more than
+# max_clients connections are open, the least recently used one is closed, so
+# a client returned by getClient should not be held on to across calls.
+#
+#   pool = EntityPool(max_clients=64)
+#   pool.getClient("tenants/acme.ent").publish(uri, payload_objects=pos)
+class EntityPool(object):
+    def __init__(self, max_clients=DEFAULT_MAX_CLIENTS, client_factory=None,
+                 auto_chain=None, **client_kwargs):
+        if max_clients < 1:
+            raise ValueError("Pool must hold at least one client")
+        if client_factory is None:
+            client_factory = lambda: Client(**client_kwargs)
+        self.max_clients = max_clients
+        self.client_factory = client_factory
+        self.auto_chain = auto_chain
+        self.lock = threading.Lock()
+        self.clients = collections.OrderedDict()
+        self.keys = {}
+        self.opening = {}
+
+    def _key(self, entity_file):
+        with self.lock:
+            key = self.keys.get(entity_file)
+        if key is None:
+            key = _readEntityFile(entity_file)
+            with self.lock:
+                self.keys[entity_file] = key
+        return key
+
+    def _open(self, entity_file):
+        client = self.client_factory()
+        try:
+            if self.auto_chain is not None:
+                client.overrideAutoChainTo(self.auto_chain)
+            client.setEntity(self._key(entity_file))
+        except Exception:
+            client.close()
+            raise
+        return client
+
+    def getClient(self, entity_file):
+        lost = []
+        while True:
+            with self.lock:
+                client = self.clients.pop(entity_file, None)
+                if client is not None:
+                    if client.connected:
+                        # Reinsert to mark the client as most recently used
+                        self.clients[entity_file] = client
+                        return client
+                    # Its connection was lost; a new one replaces it
+                    lost.append(client)
+                opening = self.opening.get(entity_file)
+                if opening is None:
+                    opening = threading.Event()
+                    self.opening[entity_file] = opening
+                    break
+            # Another thread is connecting for this entity
+            opening.wait()
+
+        for lost_client in lost:
+            lost_client.close()
+
+        evicted = []
+        try:
+            client = self._open(entity_file)
+            with self.lock:
+                self.clients[entity_file] = client
+                while len(self.clients) > self.max_clients:
+                    evicted.append(self.clients.popitem(last=False)[1])
+        finally:
+            with self.lock:
+                del self.opening[entity_file]
+            opening.set()
+        for old_client in evicted:
+            old_client.close()
+        return client
+
+    def evict(self, entity_file):
+        with self.lock:
+            client = self.clients.pop(entity_file, None)
+        if client is not None:
+            client.close()
+
+    def entities(self):
+        with self.lock:
+            return self.clients.keys()
+
+    def close(self):
+        with self.lock:
+            clients = self.clients.values()
+            self.clients = collections.OrderedDict()
+        for client in clients:
+            client.close()
@@ -0,0 +1,147 @@
+import itertools
+import mmap
+import multiprocessing
+import threading
+import traceback
+
+from bwtypes import BosswaveResult, PayloadObject, RoutingObject
+
+DEFAULT_SHM_THRESHOLD = 16384
+DEFAULT_RING_SIZE = 64 * 1024 * 1024
+
+# Payload bodies larger than the pool's threshold are copied into a ring
+# buffer in shared memory (an anonymous mmap inherited by the worker at fork)
+# rather than pickled onto the worker's queue. The parent is the only writer
+# and advances head; the worker releases space by advancing tail once it has
+# copied a body out. Space that is skipped at the end of the ring to keep a
+# body contiguous is released along with that body.
+class _PayloadRing(object):
+    def __init__(self, size):
+        self.size = size
+        self.buffer = mmap.mmap(-1, size)
+        self.head = 0
+        self.tail = multiprocessing.RawValue('L', 0)
+
+    def allocate(self, length):
+        position = self.head % self.size
+        padding = 0
+        if position + length > self.size:
+            padding = self.size - position
+            position = 0
+        advance = padding + length
+        if self.head + advance - self.tail.value > self.size:
+            return None
+        self.head += advance
+        return position, advance
+
+    def release(self, advance):
+        self.tail.value += advance
+
+def _workerMain(queue, ring):
+    handlers = {}
+    while True:
+        item = queue.get()
+        if item is None:
+            return
+        if item[0] == "register":
+            handlers[item[1]] = item[2]
+            continue
+
+        _, handler_id, from_, uri, kv_pairs, ros, pos, timestamp = item
+        # Results of unpack=False subscriptions carry no objects at all
+        try:
+            payload_objects = None
+            if pos is not None:
+                payload_objects = []
+                for type_dotted, type_num, content, position, length, advance in pos:
+                    if content is None:
+                        content = ring.buffer[position:position+length]
+                        ring.release(advance)
+                    payload_objects.append(PayloadObject(type_dotted, type_num, content))
+            routing_objects = None
+            if ros is not None:
+                routing_objects = [RoutingObject(number, content) for number, content in ros]
+
+            result = BosswaveResult(from_, uri, kv_pairs, routing_objects, payload_objects,
+                                    timestamp)
+            handlers[handler_id](result)
+        except Exception:
+            traceback.print_exc()
+
+class _PooledHandler(object):
+    def __init__(self, pool, worker, handler_id):
+        self.pool = pool
+        self.worker = worker
+        self.handler_id = handler_id
+
+    def __call__(self, result):
+        self.pool._submit(self.worker, self.handler_id, result)
+
+# Runs subscription handlers in worker processes so that CPU-bound handlers
+# can use more than one core. wrap() pins a handler to one worker, so results
+# of one subscription are handled in order. Handlers are sent to their worker
+# by pickling, so they must be module-level functions or other picklable
+# callables.
+#
+#   pool = HandlerPool(processes=7)
+#   bw_client.subscribe(uri, pool.wrap(detectAnomalies))
+class HandlerPool(object):
+    def __init__(self, processes=None, shm_threshold=DEFAULT_SHM_THRESHOLD,
+                 ring_size=DEFAULT_RING_SIZE):
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        self.shm_threshold = shm_threshold
+        self.lock = threading.Lock()
+        self.handler_counter = itertools.count()
+        self.next_worker = itertools.cycle(range(processes))
+        self.workers = []
+        for _ in range(processes):
+            queue = multiprocessing.Queue()
+            ring = _PayloadRing(ring_size)
+            process = multiprocessing.Process(target=_workerMain, args=(queue, ring))
+            process.daemon = True
+            process.start()
+            self.workers.append((queue, ring, process))
+
+    def wrap(self, handler):
+        with self.lock:
+            worker = self.workers[next(self.next_worker)]
+            handler_id = next(self.handler_counter)
+        worker[0].put(("register", handler_id, handler))
+        return _PooledHandler(self, worker, handler_id)
+
+    def _submit(self, worker, handler_id, result):
+        queue, ring, _ = worker
+        pos = None
+        with self.lock:
+            if result.payload_objects is not None:
+                pos = []
+                for po in result.payload_objects:
+                    content = po.content
+                    length = len(content)
+                    allocation = None
+                    if length > self.shm_threshold:
+                        allocation = ring.allocate(length)
+                    if allocation is None:
+                        # Small payloads, or a full ring, go inline
+                        pos.append((po.type_dotted, po.type_num, content, 0, length, 0))
+                    else:
+                        position, advance = allocation
+                        ring.buffer[position:position+length] = content
+                        pos.append((po.type_dotted, po.type_num, None, position, length,
+                                    advance))
+            # Enqueue while still holding the lock so that ring allocations
+            # reach the worker in order
+            ros = None
+            if result.routing_objects is not None:
+                ros = [(ro.number, ro.content) for ro in result.routing_objects]
+            queue.put(("result", handler_id, result.from_, result.uri, result.kv_pairs,
+                       ros, pos, result.timestamp))
+
+    def close(self):
+        for queue, _, _ in self.workers:
+            queue.put(None)
+        for _, _, process in self.workers:
+            process.join()
+        for _, ring, _ in self.workers:
+            ring.buffer.close()
@@ -0,0 +1,180 @@
+import collections
+import errno
+import itertools
+import select
+import socket
+import threading
+import traceback
+import Queue
+
+from client import RECV_BUFFER_SIZE
+
+DEFAULT_WORKERS = 4
+_READ_EVENTS = select.POLLIN | select.POLLPRI
+
+def _runCallbacks(queue):
+    while True:
+        handler, item = queue.get()
+        if handler is None:
+            return
+        try:
+            handler(item)
+        except Exception:
+            traceback.print_exc()
+
+# Hosts the connections of many Clients on a single thread. The sockets of
+# all clients created with reactor=... are polled together, their frames are
+# parsed incrementally as data arrives, and callbacks run on a fixed pool of
+# worker threads shared by every client. Each client is pinned to one worker,
+# so its callbacks still run in order. Frame handlers (subscribeRaw,
+# subscribeAggregated) run on the reactor thread itself and must not block.
+# A frame handler that raises loses only its own client's connection.
+#
+#   reactor = Reactor(workers=8)
+#   clients = [Client(host, port, reactor=reactor) for host, port in agents]
+class Reactor(object):
+    def __init__(self, workers=DEFAULT_WORKERS):
+        if workers < 1:
+            raise ValueError("Reactor needs at least one worker")
+        self.poller = select.poll()
+        self.connections = {}
+        # Registrations are applied on the reactor thread, which is woken up
+        # through a socket pair when one is queued
+        self.pending = collections.deque()
+        self.lock = threading.Lock()
+        self.wake_receiver, self.wake_sender = socket.socketpair()
+        self.wake_sender.setblocking(False)
+        self.poller.register(self.wake_receiver.fileno(), _READ_EVENTS)
+        self.stopped = False
+
+        self.queues = []
+        self.workers = []
+        for _ in range(workers):
+            queue = Queue.Queue()
+            worker = threading.Thread(target=_runCallbacks, args=(queue,))
+            worker.daemon = True
+            worker.start()
+            self.queues.append(queue)
+            self.workers.append(worker)
+        self.next_queue = itertools.cycle(self.queues)
+
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    # Returns the callback queue of the next worker, for a new client
+    def callbackQueue(self):
+        with self.lock:
+            return next(self.next_queue)
+
+    def _queue(self, operation):
+        with self.lock:
+            if self.stopped:
+                raise RuntimeError("Reactor is closed")
+            self.pending.append(operation)
+        try:
+            self.wake_sender.send("\0")
+        except socket.error as e:
+            # A full wake-up socket already guarantees a wake-up
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
+    def register(self, client, sock, parser):
+        self._queue(("register", client, sock, parser))
+
+    # Stops reading from sock. Its client is told its connection was lost.
+    def unregister(self, sock):
+        self._queue(("unregister", sock))
+
+    def __len__(self):
+        return len(self.connections)
+
+    def _applyPending(self):
+        while True:
+            with self.lock:
+                if len(self.pending) == 0:
+                    return
+                operation = self.pending.popleft()
+            if operation[0] == "register":
+                _, client, sock, parser = operation
+                try:
+                    fd = sock.fileno()
+                except socket.error:
+                    # Closed before it could be registered
+                    client._connectionLost(sock)
+                    continue
+                self.connections[fd] = (client, sock, parser)
+                self.poller.register(fd, _READ_EVENTS)
+            else:
+                self._remove(operation[1])
+
+    def _remove(self, sock):
+        for fd, (client, registered_sock, _) in self.connections.items():
+            if registered_sock is sock:
+                del self.connections[fd]
+                try:
+                    self.poller.unregister(fd)
+                except (KeyError, ValueError):
+                    pass
+                try:
+                    client._connectionLost(sock)
+                except Exception:
+                    traceback.print_exc()
+                return
+
+    def _receive(self, fd, events):
+        connection = self.connections.get(fd)
+        if connection is None:
+            return
+        client, sock, parser = connection
+        data = ""
+        if not events & select.POLLNVAL:
+            # Also reached on POLLHUP and POLLERR, when recv reports the end
+            # of the connection or its error
+            try:
+                data = sock.recv(RECV_BUFFER_SIZE)
+            except socket.error:
+                pass
+        if len(data) > 0:
+            try:
+                client._handleData(parser, data)
+                return
+            except ValueError:
+                pass
+            except Exception:
+                # A failing frame handler drops only its own client
+                traceback.print_exc()
+        # The agent closed the connection, or sent something unparseable
+        self._remove(sock)
+
+    def _run(self):
+        wake_fd = self.wake_receiver.fileno()
+        while True:
+            events = self.poller.poll()
+            # Registration changes come first, so that events on a socket
+            # closed since it was unregistered are ignored
+            if any(fd == wake_fd for fd, _ in events):
+                self.wake_receiver.recv(RECV_BUFFER_SIZE)
+                self._applyPending()
+                with self.lock:
+                    if self.stopped:
+                        return
+            for fd, event in events:
+                if fd != wake_fd:
+                    self._receive(fd, event)
+
+    # Stops the reactor thread and its workers. Clients still registered
+    # are left without a reader, so they should be closed first.
+    def close(self):
+        with self.lock:
+            if self.stopped:
+                return
+            self.stopped = True
+        self.wake_sender.send("\0")
+        self.thread.join()
+        for queue in self.queues:
+            queue.put((None, None))
+        for worker in self.workers:
+            worker.join()
+        self.wake_receiver.close()
+        self.wake_sender.close()
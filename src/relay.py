@@ -0,0 +1,323 @@
+import calendar
+import itertools
+import os
+import Queue
+import socket
+import sys
+import threading
+import time
+
+from bwtypes import Frame, FrameParser, frameHeader
+from client import Client, RECV_BUFFER_SIZE
+from multiplexer import SubscriptionMultiplexer
+
+# Requests whose results arrive as "rslt" frames after the response
+RESULT_COMMANDS = ("quer", "list", "mkvw", "vsub")
+
+# Returns the options of a local "subs" frame as a hashable key and as
+# keyword arguments of Client.subscribe. Options left at their defaults are
+# omitted, so that default subscriptions share a key.
+def _subscribeOptions(frame):
+    key = []
+    kwargs = {}
+    for name, value in frame.kv_pairs:
+        if name == "uri":
+            continue
+        elif name == "primary_access_chain":
+            kwargs["primary_access_chain"] = value
+        elif name == "expiry":
+            kwargs["expiry"] = calendar.timegm(time.strptime(value, '%Y-%m-%dT%H:%M:%SZ'))
+        elif name == "expirydelta":
+            if not value.endswith("ms"):
+                raise ValueError("Invalid expiry delta: " + value)
+            kwargs["expiry_delta"] = int(value[:-2])
+        elif name == "elaborate_pac":
+            kwargs["elaborate_pac"] = value
+        elif name == "unpack":
+            if value == "true":
+                continue
+            kwargs["unpack"] = False
+        elif name == "autochain":
+            kwargs["auto_chain"] = value == "true"
+        else:
+            raise ValueError("Unsupported subscription option: " + name)
+        key.append((name, value))
+    if frame.routing_objects:
+        kwargs["routing_objects"] = frame.routing_objects
+        key.extend([(ro.number, ro.content) for ro in frame.routing_objects])
+    return tuple(sorted(key)), kwargs
+
+class _LocalConnection(object):
+    def __init__(self, relay, sock):
+        self.relay = relay
+        self.socket = sock
+        self.socket_lock = threading.Lock()
+        # Frames waiting for the writer thread
+        self.queue = Queue.Queue()
+        self.subscriptions = {}
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def send(self, data):
+        if not self.closed:
+            self.queue.put(data)
+
+    # Writes queued frames, so that a slow local process holds up only its
+    # own connection and not the callback thread shared by every connection
+    def _write(self):
+        while True:
+            data = self.queue.get()
+            if data is None:
+                return
+            with self.socket_lock:
+                if self.closed:
+                    return
+                try:
+                    self.socket.sendall(data)
+                except socket.error:
+                    self.closed = True
+
+    def sendFrame(self, frame):
+        self.send(frame.serialize())
+
+    def respond(self, seq_num, status, reason=None, kv_pairs=()):
+        response = Frame("resp", seq_num)
+        response.addKVPair("status", status)
+        if reason is not None:
+            response.addKVPair("reason", reason)
+        for key, value in kv_pairs:
+            response.addKVPair(key, value)
+        self.sendFrame(response)
+
+    def run(self):
+        self.relay._runTask(self._write)
+        helo = Frame("helo", 0)
+        helo.addKVPair("version", "relay")
+        self.sendFrame(helo)
+
+        parser = FrameParser()
+        try:
+            while True:
+                data = self.socket.recv(RECV_BUFFER_SIZE)
+                if len(data) == 0:
+                    break
+                for frame in parser.feed(data):
+                    self.handleFrame(frame)
+        except (socket.error, ValueError):
+            pass
+        finally:
+            self.close()
+
+    def close(self):
+        self.closed = True
+        self.queue.put(None)
+        # Shut down first to unblock a write in progress
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        with self.socket_lock:
+            self.socket.close()
+        with self.lock:
+            subscriptions = self.subscriptions.values()
+            self.subscriptions = {}
+        for key, multiplexer, handle in subscriptions:
+            try:
+                multiplexer.unsubscribe(handle)
+            except (RuntimeError, ValueError):
+                pass
+            self.relay._releaseMultiplexer(key, multiplexer)
+        self.relay._removeConnection(self)
+
+    def handleFrame(self, frame):
+        if frame.command == "sete":
+            # The relay's own entity is used for all traffic
+            vk = getattr(self.relay.client, "vk", None)
+            kv_pairs = (("vk", vk),) if vk is not None else ()
+            self.respond(frame.seq_num, "okay", kv_pairs=kv_pairs)
+        elif frame.command == "subs":
+            self.subscribe(frame)
+        elif frame.command == "usub":
+            self.unsubscribe(frame)
+        else:
+            self.forward(frame)
+
+    def subscribe(self, frame):
+        local_seq = frame.seq_num
+        try:
+            key, kwargs = _subscribeOptions(frame)
+        except ValueError as e:
+            self.respond(local_seq, "error", str(e))
+            return
+
+        def onMessage(result):
+            # The body is shared by every local subscriber of the message
+            body = getattr(result, "_relay_body", None)
+            if body is None:
+                rslt = Frame("rslt", 0)
+                rslt.kv_pairs = result.kv_pairs
+                if result.routing_objects is not None:
+                    rslt.routing_objects = result.routing_objects
+                if result.payload_objects is not None:
+                    rslt.payload_objects = result.payload_objects
+                body = rslt.serializeBody()
+                result._relay_body = body
+            self.send(frameHeader("rslt", len(body), local_seq) + body)
+
+        # Subscriptions block on the agent, so they are made off the
+        # connection's reader thread
+        def doSubscribe():
+            multiplexer = self.relay._multiplexer(key, kwargs)
+            try:
+                handle = multiplexer.subscribe(frame.getFirstValue("uri"), onMessage)
+            except RuntimeError as e:
+                self.relay._releaseMultiplexer(key, multiplexer)
+                self.respond(local_seq, "error", str(e))
+                return
+            local_handle = str(next(self.relay.handle_ids))
+            with self.lock:
+                self.subscriptions[local_handle] = (key, multiplexer, handle)
+            self.respond(local_seq, "okay", kv_pairs=(("handle", local_handle),))
+        self.relay._runTask(doSubscribe)
+
+    def unsubscribe(self, frame):
+        with self.lock:
+            subscription = self.subscriptions.pop(frame.getFirstValue("handle"), None)
+        if subscription is None:
+            self.respond(frame.seq_num, "error", "Unknown subscription handle")
+            return
+
+        def doUnsubscribe():
+            key, multiplexer, handle = subscription
+            try:
+                multiplexer.unsubscribe(handle)
+            except RuntimeError as e:
+                self.respond(frame.seq_num, "error", str(e))
+                return
+            finally:
+                self.relay._releaseMultiplexer(key, multiplexer)
+            self.respond(frame.seq_num, "okay")
+        self.relay._runTask(doUnsubscribe)
+
+    def forward(self, frame):
+        local_seq = frame.seq_num
+        upstream = Frame(frame.command, Frame.generateSequenceNumber())
+        upstream.kv_pairs = frame.kv_pairs
+        upstream.routing_objects = frame.routing_objects
+        upstream.raw_payload_objects = frame.raw_payload_objects
+
+        def onResponse(response):
+            resp = Frame("resp", local_seq)
+            resp.kv_pairs = response.kv_pairs
+            resp.routing_objects = response.routing_objects
+            resp.payload_objects = response.payload_objects
+            self.sendFrame(resp)
+
+        def onResultFrame(result_frame):
+            result_frame.seq_num = local_seq
+            self.sendFrame(result_frame)
+
+        if frame.command in RESULT_COMMANDS:
+            self.relay.client.asyncRequest(upstream, onResponse, onResultFrame)
+        else:
+            self.relay.client.asyncRequest(upstream, onResponse)
+
+# Shares one agent connection among many local processes. The relay listens
+# on a Unix domain socket and speaks the agent protocol, so local processes
+# attach with an ordinary Client, e.g. by setting BW2_AGENT=unix:///path.
+# All traffic uses the relay client's entity. Subscriptions from all local
+# processes are multiplexed onto shared upstream subscriptions, and each
+# upstream message is forwarded once to every interested process. Only
+# subscriptions with the same options (primary access chain, expiry,
+# unpack, ...) share upstream subscriptions; options a local process passes
+# override those the relay was created with.
+class Relay(object):
+    def __init__(self, client, path, prefixes=None, **subscribe_kwargs):
+        self.client = client
+        self.path = path
+        self.prefixes = prefixes
+        self.subscribe_kwargs = subscribe_kwargs
+        self.multiplexer = SubscriptionMultiplexer(client, prefixes, **subscribe_kwargs)
+        # Keyed by subscription options, see _subscribeOptions
+        self.multiplexers = {(): self.multiplexer}
+        self.handle_ids = itertools.count(1)
+        self.connections = set()
+        self.lock = threading.Lock()
+        self.listener = None
+
+    def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(self.path)
+        self.listener.listen(128)
+        accept_thread = threading.Thread(target=self._accept)
+        accept_thread.daemon = True
+        accept_thread.start()
+
+    def close(self):
+        if self.listener is not None:
+            self.listener.close()
+            self.listener = None
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+        with self.lock:
+            connections = list(self.connections)
+        for connection in connections:
+            connection.close()
+
+    def _accept(self):
+        while True:
+            try:
+                sock, _ = self.listener.accept()
+            except (socket.error, AttributeError):
+                return
+            connection = _LocalConnection(self, sock)
+            with self.lock:
+                self.connections.add(connection)
+            self._runTask(connection.run)
+
+    def _multiplexer(self, key, kwargs):
+        with self.lock:
+            multiplexer = self.multiplexers.get(key)
+            if multiplexer is None:
+                multiplexer = SubscriptionMultiplexer(self.client, self.prefixes,
+                                                      **dict(self.subscribe_kwargs, **kwargs))
+                self.multiplexers[key] = multiplexer
+            return multiplexer
+
+    # Forgets the multiplexer for options other than the defaults once
+    # nothing is subscribed through it
+    def _releaseMultiplexer(self, key, multiplexer):
+        with self.lock:
+            if key != () and self.multiplexers.get(key) is multiplexer and \
+                    len(multiplexer.local_subscriptions) == 0:
+                del self.multiplexers[key]
+
+    def _removeConnection(self, connection):
+        with self.lock:
+            self.connections.discard(connection)
+
+    @staticmethod
+    def _runTask(target):
+        thread = threading.Thread(target=target)
+        thread.daemon = True
+        thread.start()
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print "Usage: {} <socket_path>".format(sys.argv[0])
+        sys.exit(1)
+
+    bw_client = Client()
+    bw_client.setEntityFromEnviron()
+    bw_client.overrideAutoChainTo(True)
+    relay = Relay(bw_client, sys.argv[1])
+    relay.start()
+
+    print "Relaying on {}. Ctrl-C to quit.".format(sys.argv[1])
+    try:
+        while True:
+            time.sleep(10000)
+    finally:
+        relay.close()
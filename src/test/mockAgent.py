@@ -0,0 +1,103 @@
+import errno
+import socket
+import threading
+
+from bw2python.bwtypes import Frame, FrameParser
+from bw2python.client import Client
+from bw2python.transport import LoopbackTransport
+
+# Serves every connection made through it, so clients can reconnect, and
+# refuses connections while the agent is unavailable
+class _AgentTransport(LoopbackTransport):
+    def __init__(self, agent):
+        LoopbackTransport.__init__(self)
+        self.agent = agent
+        self.available = True
+
+    def connect(self):
+        if not self.available:
+            raise socket.error(errno.ECONNREFUSED, "Mock agent unavailable")
+        client_sock = LoopbackTransport.connect(self)
+        self.agent._serve(self.agent_socket)
+        return client_sock
+
+# Plays the agent's role on the far end of a LoopbackTransport. Every request
+# is answered with an "okay" response unless a handler is registered for its
+# command, in which case the handler is called with the agent and the frame.
+class MockAgent(object):
+    def __init__(self):
+        self.transport = _AgentTransport(self)
+        self.handlers = {}
+        self.received = []
+        self.lock = threading.Lock()
+
+    def connect(self, **kwargs):
+        return Client(transport=self.transport, **kwargs)
+
+    def _serve(self, sock):
+        self.socket = sock
+        thread = threading.Thread(target=self._run, args=(sock,))
+        thread.daemon = True
+        thread.start()
+
+    def close(self):
+        self.socket.close()
+
+    # Drops the current connection, and refuses new ones until available is
+    # set again
+    def disconnect(self):
+        self.transport.available = False
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+
+    def setAvailable(self, available):
+        self.transport.available = available
+
+    def _run(self, sock):
+        parser = FrameParser()
+        while True:
+            try:
+                data = sock.recv(65536)
+            except Exception:
+                return
+            if len(data) == 0:
+                return
+            for frame in parser.feed(data):
+                with self.lock:
+                    self.received.append(frame)
+                handler = self.handlers.get(frame.command)
+                if handler is not None:
+                    handler(self, frame)
+                else:
+                    self.respond(frame)
+
+    def send(self, frame):
+        with self.lock:
+            frame.writeToSocket(self.socket)
+
+    def respond(self, frame, status="okay", reason=None, kv_pairs=()):
+        response = Frame("resp", frame.seq_num)
+        response.addKVPair("status", status)
+        if reason is not None:
+            response.addKVPair("reason", reason)
+        for key, value in kv_pairs:
+            response.addKVPair(key, value)
+        self.send(response)
+
+    def sendResult(self, seq_num, uri, payload_objects=(), kv_pairs=(), finished=False):
+        result = Frame("rslt", seq_num)
+        result.addKVPair("uri", uri)
+        result.addKVPair("from", "mockagent=")
+        for key, value in kv_pairs:
+            result.addKVPair(key, value)
+        if finished:
+            result.addKVPair("finished", "true")
+        result.addPayloadObjects(list(payload_objects))
+        self.send(result)
+
+    def sendFinished(self, seq_num):
+        result = Frame("rslt", seq_num)
+        result.addKVPair("finished", "true")
+        self.send(result)
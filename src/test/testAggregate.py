@@ -0,0 +1,137 @@
+import struct
+import time
+import unittest
+
+from bw2python import ponames
+from bw2python.aggregate import WindowAggregator
+from bw2python.bwtypes import BosswaveResult, COMPRESSED_MAGIC, Frame, FrameParser, PayloadObject
+from bw2python.compression import CompressionPolicy
+from mockAgent import MockAgent
+
+URI = "scratch.ns/unittests/python/{0}"
+
+def double(value):
+    return PayloadObject(ponames.PODFDouble, None, struct.pack("<d", value))
+
+def makeFrame(uri, pos):
+    frame = Frame("rslt", 1)
+    frame.addKVPair("uri", uri)
+    frame.addPayloadObjects(pos)
+    return FrameParser().feed(frame.serialize())[0]
+
+class TestWindowAggregator(unittest.TestCase):
+    def testAggregates(self):
+        windows = []
+        aggregator = WindowAggregator(windows.append, 3600)
+        aggregator.addFrame(makeFrame(URI.format("a"), [double(1.0), double(3.0)]))
+        aggregator.addFrame(makeFrame(URI.format("b"),
+                                      [PayloadObject(ponames.PODFText, None, "skip"), double(-2.0)]))
+        aggregator.addFrame(makeFrame(URI.format("a"), [double(5.0)]))
+        aggregator.addResult(BosswaveResult("from", URI.format("c"), [], [],
+                                            [PayloadObject(ponames.PODFDouble, None,
+                                                           struct.pack("<2d", 7, 9))], None))
+        aggregator.close()
+
+        self.assertEqual(1, len(windows))
+        aggregates = dict((uri, i) for i, uri in enumerate(windows[0].uris))
+        self.assertEqual(set([URI.format(x) for x in "abc"]), set(aggregates))
+        a = aggregates[URI.format("a")]
+        self.assertEqual(3, windows[0].count[a])
+        self.assertEqual(3.0, windows[0].mean[a])
+        self.assertEqual(1.0, windows[0].min[a])
+        self.assertEqual(5.0, windows[0].max[a])
+        b = aggregates[URI.format("b")]
+        self.assertEqual((1, -2.0, -2.0, -2.0), (windows[0].count[b], windows[0].mean[b],
+                                                 windows[0].min[b], windows[0].max[b]))
+        self.assertEqual(8.0, windows[0].mean[aggregates[URI.format("c")]])
+
+    def testSpilledBodies(self):
+        windows = []
+        aggregator = WindowAggregator(windows.append, 3600)
+        frame = Frame("rslt", 1)
+        frame.addKVPair("uri", URI.format("a"))
+        frame.addPayloadObject(PayloadObject(ponames.PODFDouble, None,
+                                             struct.pack("<200d", *range(200))))
+        frame.addPayloadObject(double(1000.0))
+        aggregator.addFrame(FrameParser(spill_threshold=100).feed(frame.serialize())[0])
+        aggregator.close()
+        self.assertEqual([201], list(windows[0].count))
+        self.assertEqual(1000.0, windows[0].max[0])
+
+    def testCompressedBodies(self):
+        windows = []
+        aggregator = WindowAggregator(windows.append, 3600)
+        po = PayloadObject(ponames.PODFDouble, None, struct.pack("<200d", *([1.0] * 200)))
+        pos = CompressionPolicy(threshold=0).compress(URI.format("a"), [po])
+        self.assertTrue(pos[0].wireContent().startswith(COMPRESSED_MAGIC))
+        aggregator.addFrame(makeFrame(URI.format("a"), pos))
+        aggregator.close()
+        self.assertEqual([200], list(windows[0].count))
+        self.assertEqual([1.0], list(windows[0].mean))
+
+    def testWindowsClose(self):
+        windows = []
+        aggregator = WindowAggregator(windows.append, 0.05)
+        aggregator.addFrame(makeFrame(URI.format("a"), [double(1.0)]))
+        time.sleep(0.12)
+        aggregator.addFrame(makeFrame(URI.format("a"), [double(2.0)]))
+        aggregator.close(flush=False)
+        self.assertEqual(1, len(windows))
+        self.assertEqual([1.0], list(windows[0].mean))
+        self.assertAlmostEqual(0.05, windows[0].end - windows[0].start)
+
+    def testHandlerFailure(self):
+        windows = []
+        def handler(aggregates):
+            windows.append(aggregates)
+            if len(windows) == 1:
+                raise ValueError("handler failed")
+        aggregator = WindowAggregator(handler, 0.05)
+        aggregator.addFrame(makeFrame(URI.format("a"), [double(1.0)]))
+        time.sleep(0.12)
+        aggregator.addFrame(makeFrame(URI.format("a"), [double(2.0)]))
+        time.sleep(0.12)
+        aggregator.close(flush=False)
+        self.assertEqual([[1.0], [2.0]], [list(window.mean) for window in windows])
+
+    def testEmptyWindowSkipped(self):
+        windows = []
+        aggregator = WindowAggregator(windows.append, 3600)
+        aggregator.close()
+        self.assertEqual([], windows)
+
+class TestAggregatedSubscription(unittest.TestCase):
+    def setUp(self):
+        self.agent = MockAgent()
+        self.client = self.agent.connect()
+
+    def tearDown(self):
+        self.client.close()
+        self.agent.close()
+
+    def testSubscribeAggregated(self):
+        windows = []
+        aggregator = WindowAggregator(windows.append, 3600)
+        self.client.subscribeAggregated(URI.format("+"), aggregator)
+        seq_num = [f for f in self.agent.received if f.command == "subs"][0].seq_num
+        for i in range(100):
+            self.agent.sendResult(seq_num, URI.format("a"), [double(i)])
+        self.agent.sendResult(seq_num, URI.format("b"), [PayloadObject(ponames.PODFText, None, "x")])
+        # A round trip ensures every result has been handled
+        self.client.publish(URI.format("a"))
+        aggregator.close()
+
+        self.assertEqual([URI.format("a")], windows[0].uris)
+        self.assertEqual([100], list(windows[0].count))
+        self.assertEqual([49.5], list(windows[0].mean))
+        self.assertEqual([99.0], list(windows[0].max))
+
+    def testSubscribeFailure(self):
+        self.agent.handlers["subs"] = lambda agent, frame: agent.respond(frame, "error", "denied")
+        aggregator = WindowAggregator(lambda aggregates: None, 3600)
+        with self.assertRaises(RuntimeError):
+            self.client.subscribeAggregated(URI.format("+"), aggregator)
+        aggregator.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+import time
+import unittest
+
+from bw2python import ponames
+from bw2python.bridge import Bridge
+from bw2python.bwtypes import Frame, FrameParser, PayloadObject, RoutingObject, UNACKED_SEQ_NUM
+from mockAgent import MockAgent
+
+SOURCE_URI = "site.ns/sensors/{0}"
+DEST_URI = "cloud.ns/site/sensors/{0}"
+
+class TestRawFrames(unittest.TestCase):
+    def testPayloadOffset(self):
+        frame = Frame("rslt", 7)
+        frame.addKVPair("uri", SOURCE_URI.format("a"))
+        frame.addRoutingObject(RoutingObject(ponames.PONumROAccessDChain, "chain"))
+        frame.addPayloadObject(PayloadObject(ponames.PODFText, None, "hello"))
+        data = frame.serialize()
+
+        parser = FrameParser()
+        parser.raw_seq_nums.add(7)
+        # Split the frame across many feeds
+        parsed = []
+        for i in range(0, len(data), 5):
+            parsed += parser.feed(data[i:i+5])
+        self.assertEqual(data, parsed[0].raw)
+        self.assertEqual("po ", parsed[0].raw[parsed[0].raw_po_offset:][:3])
+        self.assertTrue(data.endswith("\nend\n"))
+
+        # Other requests' frames are not retained
+        parsed = FrameParser().feed(data)
+        self.assertEqual(None, parsed[0].raw)
+
+class TestBridge(unittest.TestCase):
+    def setUp(self):
+        self.source_agent = MockAgent()
+        self.dest_agent = MockAgent()
+        self.source = self.source_agent.connect()
+        self.dest = self.dest_agent.connect()
+
+    def tearDown(self):
+        self.source.close()
+        self.dest.close()
+        self.source_agent.close()
+        self.dest_agent.close()
+
+    def waitForRelayed(self, bridge, count):
+        # The relayed count is updated just after the frame is sent
+        deadline = time.time() + 5
+        while bridge.relayed < count and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(count, bridge.relayed)
+
+    def waitForPublications(self, count):
+        deadline = time.time() + 5
+        while time.time() < deadline:
+            published = [f for f in self.dest_agent.received if f.command in ("publ", "pers")]
+            if len(published) >= count:
+                return published
+            time.sleep(0.01)
+        self.fail("Publications not relayed")
+
+    def testRelay(self):
+        self.source_agent.handlers["subs"] = \
+                lambda agent, frame: agent.respond(frame, kv_pairs=[("handle", "h")])
+        bridge = Bridge(self.source, self.dest, SOURCE_URI.format("*"),
+                        source_prefix="site.ns/", dest_prefix="cloud.ns/site/",
+                        dest_access_chain="chain")
+        seq_num = [f for f in self.source_agent.received if f.command == "subs"][0].seq_num
+        large = "x" * 100000
+        self.source_agent.sendResult(seq_num, SOURCE_URI.format("a"),
+                                     [PayloadObject(ponames.PODFText, None, "hello"),
+                                      PayloadObject(ponames.PODFDouble, None, "\0" * 8)])
+        self.source_agent.sendResult(seq_num, SOURCE_URI.format("b"),
+                                     [PayloadObject(ponames.PODFText, None, large)])
+
+        first, second = self.waitForPublications(2)
+        self.assertEqual(UNACKED_SEQ_NUM, first.seq_num)
+        self.assertEqual([("uri", DEST_URI.format("a")), ("primary_access_chain", "chain")],
+                         first.kv_pairs)
+        self.assertEqual([], first.routing_objects)
+        self.assertEqual(["hello", "\0" * 8], [po.content for po in first.payload_objects])
+        self.assertEqual(ponames.PODFDouble, first.payload_objects[1].type_dotted)
+        self.assertEqual(DEST_URI.format("b"), second.getFirstValue("uri"))
+        self.assertEqual(large, second.payload_objects[0].content)
+        self.waitForRelayed(bridge, 2)
+
+        bridge.close()
+        unsubscribe = [f for f in self.source_agent.received if f.command == "usub"][0]
+        self.assertEqual("h", unsubscribe.getFirstValue("handle"))
+
+    def testRelayPersisted(self):
+        bridge = Bridge(self.source, self.dest, "other.ns/*", persist=True, auto_chain=True)
+        seq_num = [f for f in self.source_agent.received if f.command == "subs"][0].seq_num
+        self.source_agent.sendResult(seq_num, "other.ns/a",
+                                     [PayloadObject(ponames.PODFText, None, "hello")])
+        self.source_agent.sendFinished(seq_num)
+        published = self.waitForPublications(1)
+        self.assertEqual("pers", published[0].command)
+        self.assertEqual([("uri", "other.ns/a"), ("autochain", "true")], published[0].kv_pairs)
+        self.waitForRelayed(bridge, 1)
+
+    def testDestinationLost(self):
+        bridge = Bridge(self.source, self.dest, "other.ns/*")
+        seq_num = [f for f in self.source_agent.received if f.command == "subs"][0].seq_num
+        self.dest_agent.disconnect()
+        deadline = time.time() + 5
+        while self.dest.connected and time.time() < deadline:
+            time.sleep(0.01)
+
+        self.source_agent.sendResult(seq_num, "other.ns/a",
+                                     [PayloadObject(ponames.PODFText, None, "hello")])
+        deadline = time.time() + 5
+        while bridge.dropped < 1 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(1, bridge.dropped)
+        self.assertEqual(0, bridge.relayed)
+        self.assertTrue(self.source.connected)
+        self.source.publish("other.ns/a")
+
+    def testSubscribeFailure(self):
+        self.source_agent.handlers["subs"] = lambda agent, frame: agent.respond(frame, "error", "denied")
+        with self.assertRaises(RuntimeError):
+            Bridge(self.source, self.dest, SOURCE_URI.format("*"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from bw2python import ponames
+from bw2python.bwtypes import Frame, FrameParser, PayloadObject
+from bw2python.capture import CaptureReader, FrameCapture, INBOUND, OUTBOUND, \
+                              replayCapture, replayCaptureToSocket
+from bw2python.client import Client
+from bw2python.transport import LoopbackTransport
+
+URI = "scratch.ns/unittests/python"
+
+class TestCapture(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.capture_path = os.path.join(self.tmp_dir, "frames.cap")
+        self.transport = LoopbackTransport()
+        self.bw_client = Client(transport=self.transport)
+        self.agent_thread = threading.Thread(target=self.runAgent)
+        self.agent_thread.daemon = True
+        self.agent_thread.start()
+
+    def tearDown(self):
+        self.bw_client.close()
+        self.transport.agent_socket.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def runAgent(self):
+        parser = FrameParser()
+        while True:
+            data = self.transport.agent_socket.recv(4096)
+            if len(data) == 0:
+                return
+            for frame in parser.feed(data):
+                response = Frame("resp", frame.seq_num)
+                response.addKVPair("status", "okay")
+                response.writeToSocket(self.transport.agent_socket)
+
+    def publishMessages(self, count):
+        self.bw_client.startCapture(self.capture_path)
+        for i in range(count):
+            po = PayloadObject(ponames.PODFText, None, "message {}".format(i))
+            self.bw_client.publish(URI, payload_objects=(po,))
+        self.bw_client.stopCapture()
+
+    def testRecord(self):
+        self.publishMessages(3)
+        reader = CaptureReader(self.capture_path)
+        records = list(reader.records())
+        reader.close()
+
+        self.assertEqual(6, len(records))
+        self.assertEqual(3, len([r for r in records if r[1] == OUTBOUND]))
+        self.assertEqual(3, len([r for r in records if r[1] == INBOUND]))
+        timestamps = [r[0] for r in records]
+        self.assertEqual(sorted(timestamps), timestamps)
+
+        frames = FrameParser().feed("".join([r[2] for r in records if r[1] == OUTBOUND]))
+        self.assertEqual(["message 0", "message 1", "message 2"],
+                         [f.payload_objects[0].content for f in frames])
+
+    def testReplay(self):
+        self.publishMessages(5)
+        frames = []
+        count = replayCapture(self.capture_path, frames.append, speed=None)
+        self.assertEqual(5, count)
+        self.assertTrue(all([f.command == "resp" for f in frames]))
+
+        count = replayCapture(self.capture_path, frames.append, speed=None,
+                              direction=OUTBOUND)
+        self.assertEqual(5, count)
+
+    def testReplayToSocket(self):
+        self.publishMessages(2)
+        received = []
+        semaphore = threading.Semaphore(0)
+        def onMessage(message):
+            received.append(message.payload_objects[0].content)
+            semaphore.release()
+
+        # Outbound publish frames become rslt frames for a fake subscription
+        reader = CaptureReader(self.capture_path)
+        rslt_path = os.path.join(self.tmp_dir, "rslt.cap")
+        rslt_capture = FrameCapture(rslt_path)
+        parser = FrameParser()
+        for timestamp, _, data in reader.records(OUTBOUND):
+            for frame in parser.feed(data):
+                frame.command = "rslt"
+                frame.seq_num = 42
+                rslt_capture.record(INBOUND, frame.serialize(), timestamp)
+        rslt_capture.close()
+        reader.close()
+
+        self.bw_client.result_handlers[42] = onMessage
+        replayCaptureToSocket(rslt_path, self.transport.agent_socket, speed=1000.0)
+        semaphore.acquire()
+        semaphore.acquire()
+        self.assertEqual(["message 0", "message 1"], received)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+
+from bw2python import ponames
+from bw2python.bwtypes import PayloadObject
+from mockAgent import MockAgent
+
+BASE_URI = "scratch.ns/unittests/python"
+
+PERSISTED_DATA = [
+    ("Mercury", "Messenger"),
+    ("Venus", "Venera"),
+    ("Mars", "Pathfinder"),
+]
+
+def onQuery(agent, frame):
+    agent.respond(frame)
+    for planet, probe in PERSISTED_DATA:
+        pos = [PayloadObject(ponames.PODFText, None, probe),
+               PayloadObject(None, ponames.PONumDouble, "\x00" * 8)]
+        agent.sendResult(frame.seq_num, BASE_URI + "/persisted/" + planet, pos,
+                         kv_pairs=(("planet", planet),))
+    agent.sendFinished(frame.seq_num)
+
+class TestColumnarQuery(unittest.TestCase):
+    def setUp(self):
+        self.agent = MockAgent()
+        self.agent.handlers["quer"] = onQuery
+        self.bw_client = self.agent.connect()
+
+    def tearDown(self):
+        self.bw_client.close()
+        self.agent.close()
+
+    def testColumnarQuery(self):
+        results = self.bw_client.query(BASE_URI + "/persisted/+", columnar=True,
+                                       kv_columns=["planet", "missing"])
+        self.assertEqual(len(PERSISTED_DATA), len(results))
+        self.assertEqual([BASE_URI + "/persisted/" + planet for planet, _ in PERSISTED_DATA],
+                         results.uris)
+        self.assertEqual(["mockagent="] * len(PERSISTED_DATA), results.froms)
+        self.assertEqual([planet for planet, _ in PERSISTED_DATA], results.kv_columns["planet"])
+        self.assertEqual([None] * len(PERSISTED_DATA), results.kv_columns["missing"])
+
+        self.assertEqual([0, 0, 1, 1, 2, 2], list(results.po_messages))
+        self.assertEqual([ponames.PONumText, ponames.PONumDouble] * 3, list(results.po_types))
+        probes = [results.getPayload(i) for i in range(0, len(results.po_types), 2)]
+        self.assertEqual([probe for _, probe in PERSISTED_DATA], probes)
+        self.assertEqual(sum(results.po_lengths), len(results.payload))
+
+    def testRowQueryUnchanged(self):
+        results = self.bw_client.query(BASE_URI + "/persisted/+")
+        self.assertEqual(len(PERSISTED_DATA), len(results))
+        self.assertEqual("Messenger", results[0].payload_objects[0].content)
+        self.assertEqual(ponames.PONumDouble, results[0].payload_objects[1].type_num)
+
+if __name__ == "__main__":
+    unittest.main()
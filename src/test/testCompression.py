@@ -0,0 +1,113 @@
+import threading
+import unittest
+
+from bw2python import ponames
+from bw2python.bwtypes import COMPRESSED_MAGIC, ColumnarResult, CompressedPayloadObject, \
+                              FilePayloadObject, Frame, FrameParser, PayloadObject
+from bw2python.compression import CompressionPolicy
+from mockAgent import MockAgent
+
+URI = "scratch.ns/unittests/python"
+TEXT = "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 100
+
+class TestCompressionPolicy(unittest.TestCase):
+    def testThreshold(self):
+        policy = CompressionPolicy(threshold=len(TEXT))
+        po = PayloadObject(ponames.PODFText, None, TEXT)
+        self.assertIs(po, policy.compress(URI, [po])[0])
+
+        policy = CompressionPolicy(threshold=100)
+        compressed = policy.compress(URI, [po])[0]
+        self.assertTrue(isinstance(compressed, CompressedPayloadObject))
+        self.assertTrue(compressed.wireContent().startswith(COMPRESSED_MAGIC))
+        self.assertTrue(len(compressed.wireContent()) < len(TEXT))
+        self.assertEqual(TEXT, compressed.content)
+
+    def testLevels(self):
+        policy = CompressionPolicy(threshold=0, uri_levels={"raw/*": 0},
+                                   type_levels={ponames.PODFBlob: 0})
+        text = PayloadObject(ponames.PODFText, None, TEXT)
+        blob = PayloadObject(None, ponames.PONumBlob, TEXT)
+        self.assertIs(text, policy.compress("raw/a", [text])[0])
+        self.assertIs(blob, policy.compress(URI, [blob])[0])
+        self.assertTrue(isinstance(policy.compress(URI, [text])[0], CompressedPayloadObject))
+
+    def testIncompressible(self):
+        policy = CompressionPolicy(threshold=0)
+        po = PayloadObject(ponames.PODFBlob, None, "".join([chr(i) for i in range(256)]))
+        self.assertIs(po, policy.compress(URI, [po])[0])
+
+class TestCompressedParsing(unittest.TestCase):
+    def compressedFrame(self):
+        frame = Frame("rslt", 1)
+        frame.addKVPair("uri", URI)
+        pos = [PayloadObject(ponames.PODFText, None, TEXT),
+               PayloadObject(ponames.PODFText, None, "short")]
+        frame.addPayloadObjects(CompressionPolicy(threshold=100).compress(URI, pos))
+        return frame.serialize()
+
+    def testSpilled(self):
+        data = self.compressedFrame()
+        parser = FrameParser(spill_threshold=50)
+        # Split the compressed body across many feeds
+        frames = []
+        for i in range(0, len(data), 3):
+            frames += parser.feed(data[i:i+3])
+        spilled = frames[0].payload_objects[0]
+        self.assertTrue(isinstance(spilled, FilePayloadObject))
+        self.assertEqual(len(TEXT), spilled.length)
+        self.assertEqual(TEXT, spilled.content)
+        self.assertEqual("short", frames[0].payload_objects[1].content)
+
+    def testColumnar(self):
+        results = ColumnarResult()
+        results.appendFrame(FrameParser().feed(self.compressedFrame())[0])
+        # Also from payload objects that were already constructed
+        materialized = FrameParser().feed(self.compressedFrame())[0]
+        materialized.payload_objects
+        results.appendFrame(materialized)
+        self.assertEqual([TEXT, "short"] * 2, [results.getPayload(i) for i in range(4)])
+
+class TestCompressedPublish(unittest.TestCase):
+    def testRoundTrip(self):
+        agent = MockAgent()
+        bw_client = agent.connect()
+        bw_client.setCompression(CompressionPolicy(threshold=100))
+        received = []
+        semaphore = threading.Semaphore(0)
+
+        def onSubscribe(agent, frame):
+            agent.respond(frame, kv_pairs=(("handle", "abc"),))
+            self.subscription = frame.seq_num
+        def onPublish(agent, frame):
+            agent.respond(frame)
+            agent.sendResult(self.subscription, URI, frame.payload_objects)
+        agent.handlers["subs"] = onSubscribe
+        agent.handlers["publ"] = onPublish
+
+        def onMessage(message):
+            received.append(message.payload_objects)
+            semaphore.release()
+
+        try:
+            bw_client.subscribe(URI, onMessage)
+            pos = (PayloadObject(ponames.PODFText, None, TEXT),
+                   PayloadObject(ponames.PODFText, None, "short"))
+            bw_client.publish(URI, payload_objects=pos)
+            semaphore.acquire()
+
+            published = [f for f in agent.received if f.command == "publ"][0]
+            wire = [body for _, body in FrameParser().feed(published.serialize())[0].raw_payload_objects]
+            self.assertTrue(wire[0].startswith(COMPRESSED_MAGIC))
+            self.assertEqual("short", wire[1])
+
+            self.assertTrue(isinstance(received[0][0], CompressedPayloadObject))
+            self.assertIsNone(received[0][0]._content)
+            self.assertEqual(TEXT, received[0][0].content)
+            self.assertEqual("short", received[0][1].content)
+        finally:
+            bw_client.close()
+            agent.close()
+
+if __name__ == "__main__":
+    unittest.main()
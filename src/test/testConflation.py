@@ -0,0 +1,142 @@
+import threading
+import time
+import unittest
+
+from bw2python import ponames
+from bw2python.bwtypes import PayloadObject
+from mockAgent import MockAgent
+
+URI = "scratch.ns/unittests/python/{0}"
+
+class TestConflation(unittest.TestCase):
+    def setUp(self):
+        self.agent = MockAgent()
+        self.client = self.agent.connect()
+
+    def tearDown(self):
+        self.client.close()
+        self.agent.close()
+
+    def published(self):
+        published = []
+        for f in list(self.agent.received):
+            if f.command == "publ":
+                content = f.payload_objects[0].content if len(f.payload_objects) > 0 else None
+                published.append((f.getFirstValue("uri"), content))
+        return published
+
+    def waitFor(self, condition):
+        deadline = time.time() + 5
+        while not condition() and time.time() < deadline:
+            time.sleep(0.01)
+
+    def testConflation(self):
+        self.client.enableConflation()
+        responses = []
+        lock = threading.Lock()
+        def onResponse(response):
+            with lock:
+                responses.append(response.status)
+
+        # Holding the socket lock stalls the writer, as a congested socket would
+        with self.client.socket_lock:
+            for i in range(100):
+                for uri in (URI.format("a"), URI.format("b")):
+                    po = PayloadObject(ponames.PODFText, None, str(i))
+                    self.client.asyncPublish(uri, onResponse, payload_objects=[po])
+            self.assertTrue(len(self.client.conflation) <= 2)
+
+        self.waitFor(lambda: len(responses) == 200)
+        self.assertEqual(["okay"] * 200, responses)
+        published = self.published()
+        self.assertTrue(len(published) <= 4)
+        self.assertEqual((URI.format("a"), "99"), [p for p in published if p[0] == URI.format("a")][-1])
+        self.assertEqual((URI.format("b"), "99"), [p for p in published if p[0] == URI.format("b")][-1])
+        self.assertEqual(200 - len(published), self.client.conflation.superseded)
+        self.assertTrue(self.client.conflation.superseded_by_uri[URI.format("a")] >= 98)
+        self.assertEqual({}, self.client.response_handlers)
+
+    def testSynchronousPublish(self):
+        self.client.enableConflation()
+        errors = []
+        def publish(i):
+            try:
+                self.client.publish(URI.format("a"),
+                                    payload_objects=[PayloadObject(ponames.PODFText, None, str(i))])
+            except Exception as e:
+                errors.append(e)
+        with self.client.socket_lock:
+            threads = [threading.Thread(target=publish, args=(i,)) for i in range(10)]
+            for thread in threads:
+                thread.start()
+            self.waitFor(lambda: self.client.conflation.superseded >= 8)
+        for thread in threads:
+            thread.join(5)
+            self.assertFalse(thread.isAlive())
+        self.assertEqual([], errors)
+
+    def testUnackedDoesNotReplaceAcked(self):
+        self.client.enableConflation()
+        returned = threading.Event()
+        def publish():
+            self.client.publish(URI.format("a"))
+            returned.set()
+        with self.client.socket_lock:
+            # The writer takes this one and waits for the socket
+            self.client.publishUnacked(URI.format("b"))
+            self.waitFor(lambda: len(self.client.conflation) == 0)
+            thread = threading.Thread(target=publish)
+            thread.start()
+            self.waitFor(lambda: len(self.client.conflation) == 1)
+            self.client.publishUnacked(URI.format("a"))
+            self.assertEqual(2, len(self.client.conflation))
+        self.assertTrue(returned.wait(5))
+        self.waitFor(lambda: len(self.published()) == 3)
+        self.assertEqual(3, len(self.published()))
+        self.assertEqual(0, self.client.conflation.superseded)
+
+    def testReopenedOnReconnect(self):
+        self.client.enableConflation()
+        self.agent.disconnect()
+        self.waitFor(lambda: not self.client.connected)
+        self.client.publishUnacked(URI.format("a"))
+        self.waitFor(lambda: self.client.conflation.closed)
+        self.assertTrue(self.client.conflation.closed)
+
+        self.agent.setAvailable(True)
+        self.client.reconnect()
+        self.assertFalse(self.client.conflation.closed)
+        with self.client.socket_lock:
+            for i in range(10):
+                po = PayloadObject(ponames.PODFText, None, str(i))
+                self.client.publishUnacked(URI.format("b"), payload_objects=[po])
+            self.assertEqual(1, len(self.client.conflation))
+        self.waitFor(lambda: len(self.published()) > 0)
+        self.assertEqual((URI.format("b"), "9"), self.published()[-1])
+
+    def testOtherRequestsNotQueued(self):
+        self.client.enableConflation()
+        self.client.publishUnacked(URI.format("a"))
+        self.client.subscribe(URI.format("b"), lambda result: None)
+        self.waitFor(lambda: len(self.published()) == 1)
+        self.assertEqual(1, len(self.published()))
+
+    def testDisable(self):
+        self.client.enableConflation()
+        with self.client.socket_lock:
+            for i in range(10):
+                po = PayloadObject(ponames.PODFText, None, str(i))
+                self.client.publishUnacked(URI.format("a"), payload_objects=[po])
+            conflation = self.client.conflation
+        self.client.disableConflation()
+        self.assertIs(None, self.client.conflation)
+        self.assertEqual(0, len(conflation))
+
+        # Publications are written directly once conflation is disabled
+        self.client.publish(URI.format("b"))
+        published = self.published()
+        self.assertEqual((URI.format("a"), "9"), published[-2])
+        self.assertEqual((URI.format("b"), None), published[-1])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,132 @@
+import threading
+import time
+import unittest
+
+from bw2python import ponames
+from bw2python.bwtypes import Frame, FrameParser, PayloadObject
+from bw2python.dedup import DedupCache
+from mockAgent import MockAgent
+
+URI = "scratch.ns/unittests/python"
+
+def makeFrame(uri, content, kv_pairs=()):
+    frame = Frame("rslt", 1)
+    frame.addKVPair("uri", uri)
+    for key, value in kv_pairs:
+        frame.addKVPair(key, value)
+    frame.addPayloadObject(PayloadObject(ponames.PODFText, None, content))
+    # Parsing leaves the payload objects in their raw form, as received
+    return FrameParser().feed(frame.serialize())[0]
+
+class TestDedupCache(unittest.TestCase):
+    def testDuplicates(self):
+        cache = DedupCache()
+        self.assertFalse(cache.isDuplicate(makeFrame(URI, "a")))
+        self.assertTrue(cache.isDuplicate(makeFrame(URI, "a")))
+        self.assertFalse(cache.isDuplicate(makeFrame(URI, "b")))
+        self.assertFalse(cache.isDuplicate(makeFrame(URI + "/other", "a")))
+        self.assertEqual(1, cache.hits)
+        self.assertEqual(3, cache.misses)
+
+    def testRawAndMaterialized(self):
+        cache = DedupCache()
+        frame = makeFrame(URI, "a")
+        frame.payload_objects
+        self.assertFalse(cache.isDuplicate(frame))
+        self.assertTrue(cache.isDuplicate(makeFrame(URI, "a")))
+
+    def testSpilledBodies(self):
+        def spilledFrame(body):
+            frame = Frame("rslt", 1)
+            frame.addKVPair("uri", URI)
+            frame.addPayloadObject(PayloadObject(ponames.PODFText, None, body))
+            frame.addPayloadObject(PayloadObject(ponames.PODFText, None, "small"))
+            return FrameParser(spill_threshold=100).feed(frame.serialize())[0]
+        cache = DedupCache()
+        self.assertFalse(cache.isDuplicate(spilledFrame("a" * 1000)))
+        self.assertFalse(cache.isDuplicate(spilledFrame("b" * 1000)))
+        self.assertTrue(cache.isDuplicate(spilledFrame("b" * 1000)))
+
+    def testMessageId(self):
+        cache = DedupCache(id_key="message_id")
+        self.assertFalse(cache.isDuplicate(makeFrame(URI, "a", [("message_id", "1")])))
+        self.assertTrue(cache.isDuplicate(makeFrame(URI, "b", [("message_id", "1")])))
+        self.assertFalse(cache.isDuplicate(makeFrame(URI, "a", [("message_id", "2")])))
+
+    def testCountBound(self):
+        cache = DedupCache(max_entries=2)
+        for content in ("a", "b", "c"):
+            cache.isDuplicate(makeFrame(URI, content))
+        self.assertEqual(2, len(cache))
+        self.assertFalse(cache.isDuplicate(makeFrame(URI, "a")))
+        self.assertTrue(cache.isDuplicate(makeFrame(URI, "c")))
+
+    def testTimeWindow(self):
+        cache = DedupCache(window=0.05)
+        self.assertFalse(cache.isDuplicate(makeFrame(URI, "a")))
+        self.assertTrue(cache.isDuplicate(makeFrame(URI, "a")))
+        time.sleep(0.1)
+        self.assertFalse(cache.isDuplicate(makeFrame(URI, "a")))
+
+class TestDedupSubscription(unittest.TestCase):
+    def setUp(self):
+        self.agent = MockAgent()
+        self.client = self.agent.connect()
+
+    def tearDown(self):
+        self.client.close()
+        self.agent.close()
+
+    def subscribe(self, uri, received, **kwargs):
+        self.client.subscribe(uri, lambda result: received.append(result.payload_objects[0].content),
+                              **kwargs)
+        return [f for f in self.agent.received if f.command == "subs"][-1].seq_num
+
+    def deliver(self, seq_num, contents):
+        for content in contents:
+            self.agent.sendResult(seq_num, URI, [PayloadObject(ponames.PODFText, None, content)])
+        # Marks the end of the deliveries
+        self.agent.sendResult(seq_num, URI, [PayloadObject(ponames.PODFText, None, "end")])
+
+    def waitForEnd(self, received):
+        deadline = time.time() + 5
+        while "end" not in received and time.time() < deadline:
+            time.sleep(0.01)
+
+    def testPerSubscription(self):
+        received = []
+        cache = DedupCache()
+        seq_num = self.subscribe(URI, received, dedup=cache)
+        self.deliver(seq_num, ["a", "a", "b", "a"])
+        self.waitForEnd(received)
+        self.assertEqual(["a", "b", "end"], received)
+        self.assertEqual(2, cache.hits)
+
+        other = []
+        seq_num = self.subscribe(URI, other)
+        self.deliver(seq_num, ["a", "a"])
+        self.waitForEnd(other)
+        self.assertEqual(["a", "a", "end"], other)
+
+    def testClientWide(self):
+        self.client.setDedup(DedupCache())
+        received = []
+        first = self.subscribe(URI, received)
+        second = self.subscribe("scratch.ns/*", received)
+        self.agent.sendResult(first, URI, [PayloadObject(ponames.PODFText, None, "a")])
+        self.deliver(second, ["a"])
+        self.waitForEnd(received)
+        self.assertEqual(["a", "end"], received)
+
+    def testConflationIndependent(self):
+        self.client.setDedup(DedupCache())
+        received = []
+        seq_num = self.subscribe(URI, received)
+        self.client.enableConflation()
+        self.client.disableConflation()
+        self.deliver(seq_num, ["a", "a"])
+        self.waitForEnd(received)
+        self.assertEqual(["a", "end"], received)
+
+if __name__ == "__main__":
+    unittest.main()
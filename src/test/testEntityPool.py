@@ -0,0 +1,105 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from bw2python.pool import EntityPool
+from mockAgent import MockAgent
+
+class TestEntityPool(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.agents = []
+        self.agents_lock = threading.Lock()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def writeEntity(self, name):
+        path = os.path.join(self.directory, name)
+        with open(path, 'wb') as f:
+            f.write(chr(50) + name + "-key")
+        return path
+
+    def connect(self):
+        agent = MockAgent()
+        def setEntity(agent, frame):
+            if frame.payload_objects[0].content == "bad-key":
+                agent.respond(frame, "error", "Invalid entity")
+            else:
+                agent.respond(frame, kv_pairs=(("vk", frame.payload_objects[0].content),))
+        agent.handlers["sete"] = setEntity
+        with self.agents_lock:
+            self.agents.append(agent)
+        return agent.connect()
+
+    def testReuse(self):
+        pool = EntityPool(client_factory=self.connect)
+        alice = self.writeEntity("alice")
+        bob = self.writeEntity("bob")
+        client = pool.getClient(alice)
+        self.assertEqual("alice-key", client.vk)
+        self.assertIs(client, pool.getClient(alice))
+        self.assertEqual("bob-key", pool.getClient(bob).vk)
+        self.assertEqual(2, len(self.agents))
+        pool.close()
+
+    def testReplacesLostConnection(self):
+        pool = EntityPool(client_factory=self.connect)
+        alice = self.writeEntity("alice")
+        client = pool.getClient(alice)
+        self.agents[0].disconnect()
+        while client.connected:
+            time.sleep(0.01)
+        replacement = pool.getClient(alice)
+        self.assertIsNot(client, replacement)
+        self.assertTrue(replacement.connected)
+        self.assertEqual("alice-key", replacement.vk)
+        pool.close()
+
+    def testEviction(self):
+        pool = EntityPool(max_clients=2, client_factory=self.connect)
+        alice = self.writeEntity("alice")
+        bob = self.writeEntity("bob")
+        carol = self.writeEntity("carol")
+        pool.getClient(alice)
+        pool.getClient(bob)
+        pool.getClient(alice)
+        pool.getClient(carol)
+        self.assertEqual(set([alice, carol]), set(pool.entities()))
+
+        # Keys are cached, so evicted entities reconnect without the file
+        os.unlink(bob)
+        self.assertEqual("bob-key", pool.getClient(bob).vk)
+        self.assertEqual(set([bob, carol]), set(pool.entities()))
+        pool.close()
+        self.assertEqual([], pool.entities())
+
+    def testSetEntityFailure(self):
+        pool = EntityPool(client_factory=self.connect)
+        bad = os.path.join(self.directory, "bad")
+        with open(bad, 'wb') as f:
+            f.write(chr(50) + "bad-key")
+        with self.assertRaises(RuntimeError):
+            pool.getClient(bad)
+        self.assertEqual([], pool.entities())
+
+    def testConcurrentOpen(self):
+        pool = EntityPool(client_factory=self.connect)
+        alice = self.writeEntity("alice")
+        clients = []
+        def run():
+            clients.append(pool.getClient(alice))
+        threads = [threading.Thread(target=run) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(1, len(self.agents))
+        self.assertEqual(1, len(set([id(client) for client in clients])))
+        pool.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,183 @@
+import time
+import unittest
+
+from bw2python.failover import FailoverClient
+from mockAgent import MockAgent
+
+URI = "scratch.ns/unittests/python"
+
+def slowResolve(agent, frame):
+    time.sleep(0.02)
+    agent.respond(frame)
+
+class TestPing(unittest.TestCase):
+    def setUp(self):
+        self.agent = MockAgent()
+        self.client = self.agent.connect()
+
+    def tearDown(self):
+        self.client.close()
+        self.agent.close()
+
+    def testPing(self):
+        self.agent.handlers["resa"] = slowResolve
+        rtt = self.client.ping(timeout=5)
+        self.assertTrue(0.02 <= rtt < 5)
+        self.assertEqual("resa", self.agent.received[0].command)
+
+    def testErrorAnswerCounts(self):
+        self.agent.handlers["resa"] = lambda agent, frame: agent.respond(frame, "error", "no alias")
+        self.client.ping(timeout=5)
+
+    def testTimeout(self):
+        self.agent.handlers["resa"] = lambda agent, frame: None
+        with self.assertRaises(RuntimeError):
+            self.client.ping(timeout=0.05)
+        self.assertEqual({}, self.client.response_handlers)
+
+class TestFailoverClient(unittest.TestCase):
+    def setUp(self):
+        self.agents = [MockAgent(), MockAgent()]
+        self.client = None
+
+    def tearDown(self):
+        if self.client is not None:
+            self.client.close()
+        for agent in self.agents:
+            agent.close()
+
+    def connect(self, **kwargs):
+        self.client = FailoverClient([agent.transport for agent in self.agents],
+                                     probe_interval=0.02, probe_timeout=0.5, **kwargs)
+        return self.client
+
+    def currentAgent(self):
+        for agent in self.agents:
+            if agent.transport is self.client.current.transport:
+                return agent
+
+    def waitFor(self, condition):
+        deadline = time.time() + 5
+        while not condition() and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(condition())
+
+    def commands(self, agent, command):
+        return [f for f in agent.received if f.command == command]
+
+    def testPrefersFastest(self):
+        self.agents[0].handlers["resa"] = slowResolve
+        client = self.connect()
+        self.waitFor(lambda: self.currentAgent() is self.agents[1])
+        client.publish(URI)
+        self.assertEqual([], self.commands(self.agents[0], "publ"))
+        self.assertEqual(1, len(self.commands(self.agents[1], "publ")))
+        self.assertTrue(dict(client.latencies())["loopback"] is not None)
+
+    def testFailoverMovesSubscriptions(self):
+        client = self.connect(switch_ratio=0)
+        self.waitFor(lambda: all([agent.isHealthy() for agent in client.agents]))
+        client.subscribe(URI, lambda result: None)
+        first = self.currentAgent()
+        other = [agent for agent in self.agents if agent is not first][0]
+        self.assertEqual(1, len(self.commands(first, "subs")))
+
+        first.disconnect()
+        self.waitFor(lambda: self.currentAgent() is other)
+        self.waitFor(lambda: len(self.commands(other, "subs")) == 1)
+        self.assertEqual(URI, self.commands(other, "subs")[0].getFirstValue("uri"))
+        client.publish(URI)
+        self.assertEqual(1, len(self.commands(other, "publ")))
+        self.assertEqual(1, client.failovers)
+
+    def testLatencySwitchKeepsSubscription(self):
+        first, other = self.agents
+        for agent in self.agents:
+            agent.handlers["subs"] = lambda agent, frame: \
+                    agent.respond(frame, kv_pairs=[("handle", "h")])
+        other.handlers["resa"] = slowResolve
+        client = self.connect()
+        self.waitFor(lambda: all([agent.isHealthy() for agent in client.agents]))
+        self.waitFor(lambda: self.currentAgent() is first)
+        client.subscribe(URI, lambda result: None)
+        self.assertEqual(1, len(self.commands(first, "subs")))
+
+        other.handlers["subs"] = lambda agent, frame: agent.respond(frame, "error", "denied")
+        del other.handlers["resa"]
+        first.handlers["resa"] = slowResolve
+        self.waitFor(lambda: self.currentAgent() is other)
+        self.waitFor(lambda: len(self.commands(other, "subs")) >= 2)
+        # Still subscribed on the healthy agent it is leaving
+        self.assertEqual([], self.commands(first, "usub"))
+
+        del other.handlers["subs"]
+        self.waitFor(lambda: len(self.commands(first, "usub")) == 1)
+        self.assertEqual(0, client.failovers)
+
+    def testStalledAgent(self):
+        client = self.connect()
+        first = self.currentAgent()
+        first.handlers["resa"] = lambda agent, frame: None
+        self.waitFor(lambda: self.currentAgent() is not first)
+
+    def testRedundantPublish(self):
+        client = self.connect(redundancy=2)
+        self.waitFor(lambda: all([agent.isHealthy() for agent in client.agents]))
+        self.agents[0].handlers["publ"] = lambda agent, frame: agent.respond(frame, "error", "denied")
+        client.publish(URI)
+        for agent in self.agents:
+            self.assertEqual(1, len(self.commands(agent, "publ")))
+
+        self.agents[1].handlers["publ"] = self.agents[0].handlers["publ"]
+        with self.assertRaises(RuntimeError):
+            client.publish(URI)
+
+    def testStalledSubscribeDoesNotBlockRouting(self):
+        client = self.connect()
+        self.waitFor(lambda: all([agent.isHealthy() for agent in client.agents]))
+        client.subscribe(URI, lambda result: None)
+        first = self.currentAgent()
+        other = [agent for agent in self.agents if agent is not first][0]
+        other.handlers["subs"] = lambda agent, frame: None
+
+        first.disconnect()
+        self.waitFor(lambda: len(self.commands(other, "subs")) == 1)
+        # Publications go through while the subscription is stuck moving
+        client.publish(URI)
+        self.assertEqual(1, len(self.commands(other, "publ")))
+        self.assertEqual(other, self.currentAgent())
+        other.disconnect()
+
+    def testEntityOnEveryAgent(self):
+        client = self.connect()
+        client.setEntity("key")
+        for agent in self.agents:
+            self.waitFor(lambda: len(self.commands(agent, "sete")) > 0)
+            self.assertEqual("key", self.commands(agent, "sete")[0].payload_objects[0].content)
+
+        # A reconnected agent gets the entity again
+        first = self.currentAgent()
+        first.disconnect()
+        first.setAvailable(True)
+        self.waitFor(lambda: len(self.commands(first, "sete")) == 2)
+
+    def testRedundantPublishTimeout(self):
+        client = self.connect(redundancy=2)
+        self.waitFor(lambda: all([agent.isHealthy() for agent in client.agents]))
+        self.agents[1].handlers["publ"] = lambda agent, frame: None
+        client.publish(URI)
+
+        self.agents[0].handlers["publ"] = self.agents[1].handlers["publ"]
+        with self.assertRaises(RuntimeError) as context:
+            client.publish(URI)
+        self.assertTrue("timed out" in str(context.exception))
+
+    def testNoAgentReachable(self):
+        for agent in self.agents:
+            agent.setAvailable(False)
+        with self.assertRaises(RuntimeError):
+            self.connect()
+        self.agents = []
+
+if __name__ == "__main__":
+    unittest.main()
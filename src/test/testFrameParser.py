@@ -0,0 +1,103 @@
+import threading
+import unittest
+
+from bw2python import ponames
+from bw2python.bwtypes import Frame, FrameParser, PayloadObject, RoutingObject
+from bw2python.client import Client
+from bw2python.transport import LoopbackTransport
+
+def makeFrame():
+    frame = Frame("rslt", 1234)
+    frame.addKVPair("uri", "scratch.ns/unittests/python")
+    frame.addKVPair("from", "abcdefg=")
+    frame.addRoutingObject(RoutingObject(32, "\x00\x01\n\x02"))
+    frame.addPayloadObject(PayloadObject(ponames.PODFText, None, "Hello,\nworld!"))
+    frame.addPayloadObject(PayloadObject(None, ponames.PONumDouble, "\x00" * 8))
+    frame.addPayloadObject(PayloadObject((64, 0, 0, 0), 1073741824, ""))
+    return frame
+
+class TestFrameParser(unittest.TestCase):
+    def assertFramesEqual(self, expected, actual):
+        self.assertEqual(expected.command, actual.command)
+        self.assertEqual(expected.seq_num, actual.seq_num)
+        self.assertEqual(expected.kv_pairs, actual.kv_pairs)
+        self.assertEqual([(ro.number, ro.content) for ro in expected.routing_objects],
+                         [(ro.number, ro.content) for ro in actual.routing_objects])
+        self.assertEqual([(po.type_dotted, po.type_num, po.content)
+                          for po in expected.payload_objects],
+                         [(po.type_dotted, po.type_num, po.content)
+                          for po in actual.payload_objects])
+
+    def testRoundTrip(self):
+        frame = makeFrame()
+        frames = FrameParser().feed(frame.serialize())
+        self.assertEqual(1, len(frames))
+        self.assertFramesEqual(frame, frames[0])
+
+    def testByteAtATime(self):
+        frame = makeFrame()
+        data = frame.serialize()
+        parser = FrameParser()
+        frames = []
+        for i in range(len(data)):
+            frames += parser.feed(data[i])
+            if i < len(data) - 1:
+                self.assertEqual([], frames)
+        self.assertEqual(1, len(frames))
+        self.assertFramesEqual(frame, frames[0])
+
+    def testMultipleFramesPerChunk(self):
+        frame = makeFrame()
+        data = frame.serialize() * 3
+        parser = FrameParser()
+        frames = parser.feed(data[:50]) + parser.feed(data[50:])
+        self.assertEqual(3, len(frames))
+        for parsed in frames:
+            self.assertFramesEqual(frame, parsed)
+
+    def testInvalidItemHeader(self):
+        with self.assertRaises(ValueError):
+            FrameParser().feed("rslt 0000000010 0000000001\nxx a 1\na\nend\n")
+
+    def testInvalidFrameHeader(self):
+        with self.assertRaises(ValueError):
+            FrameParser().feed("rslt 00000000100000000001\nend\n")
+
+class TestLoopbackClient(unittest.TestCase):
+    def setUp(self):
+        self.transport = LoopbackTransport()
+        self.bw_client = Client(transport=self.transport)
+        self.agent_thread = threading.Thread(target=self.runAgent)
+        self.agent_thread.daemon = True
+        self.agent_thread.start()
+
+    def tearDown(self):
+        self.bw_client.close()
+        self.transport.agent_socket.close()
+
+    def runAgent(self):
+        parser = FrameParser()
+        while True:
+            data = self.transport.agent_socket.recv(4096)
+            if len(data) == 0:
+                return
+            for frame in parser.feed(data):
+                response = Frame("resp", frame.seq_num)
+                if frame.getFirstValue("uri") == "forbidden":
+                    response.addKVPair("status", "error")
+                    response.addKVPair("reason", "no permission")
+                else:
+                    response.addKVPair("status", "okay")
+                response.writeToSocket(self.transport.agent_socket)
+
+    def testPublish(self):
+        po = PayloadObject(ponames.PODFText, None, "Hello, world!")
+        self.bw_client.publish("scratch.ns/unittests/python", payload_objects=(po,))
+
+    def testPublishFailure(self):
+        po = PayloadObject(ponames.PODFText, None, "Hello, world!")
+        with self.assertRaises(RuntimeError):
+            self.bw_client.publish("forbidden", payload_objects=(po,))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import multiprocessing
+import os
+import unittest
+
+from bw2python import ponames
+from bw2python.bwtypes import BosswaveResult, PayloadObject, RoutingObject
+from bw2python.procpool import HandlerPool
+
+# Created before the pool so that worker processes inherit it
+handled = multiprocessing.Queue()
+
+def recordMessage(message):
+    handled.put((os.getpid(), message.uri, [po.content for po in message.payload_objects],
+                 [ro.content for ro in message.routing_objects]))
+
+def recordUnpacked(message):
+    handled.put((os.getpid(), message.uri, message.payload_objects, message.routing_objects))
+
+def failOnMessage(message):
+    raise ValueError("handler failure")
+
+def makeResult(uri, content):
+    return BosswaveResult("from", uri, [("uri", uri)], [RoutingObject(32, "dot")],
+                          [PayloadObject(ponames.PODFBlob, None, content)])
+
+class TestHandlerPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = HandlerPool(processes=2, shm_threshold=16, ring_size=4096)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def testOrderedDelivery(self):
+        handler = self.pool.wrap(recordMessage)
+        contents = ["small", "x" * 1000, "y" * 3000, "z" * 5000, "tiny", "w" * 1500]
+        for i, content in enumerate(contents):
+            handler(makeResult("uri/{}".format(i), content))
+
+        received = [handled.get(timeout=10) for _ in contents]
+        self.assertEqual(["uri/{}".format(i) for i in range(len(contents))],
+                         [r[1] for r in received])
+        self.assertEqual([[c] for c in contents], [r[2] for r in received])
+        self.assertEqual([["dot"]] * len(contents), [r[3] for r in received])
+        self.assertEqual(1, len(set([r[0] for r in received])))
+        self.assertNotEqual(os.getpid(), received[0][0])
+
+    def testHandlersSpreadAcrossWorkers(self):
+        handlers = [self.pool.wrap(recordMessage) for _ in range(2)]
+        for handler in handlers:
+            handler(makeResult("uri", "content"))
+        pids = set([handled.get(timeout=10)[0] for _ in handlers])
+        self.assertEqual(2, len(pids))
+
+    def testFailingHandler(self):
+        pool = HandlerPool(processes=1)
+        try:
+            failing = pool.wrap(failOnMessage)
+            handler = pool.wrap(recordMessage)
+            failing(makeResult("uri", "content"))
+            handler(makeResult("uri", "content"))
+            self.assertEqual("uri", handled.get(timeout=10)[1])
+        finally:
+            pool.close()
+
+    def testUnpackedResult(self):
+        pool = HandlerPool(processes=1)
+        try:
+            handler = pool.wrap(recordUnpacked)
+            handler(BosswaveResult("from", "uri", [("uri", "uri")], None, None))
+            self.assertEqual((None, None), handled.get(timeout=10)[2:])
+            # The worker is still alive
+            handler(makeResult("uri/2", "content"))
+            self.assertEqual("uri/2", handled.get(timeout=10)[1])
+        finally:
+            pool.close()
+
+if __name__ == "__main__":
+    unittest.main()
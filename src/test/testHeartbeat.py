@@ -0,0 +1,90 @@
+import time
+import unittest
+
+from bw2python.client import CONNECTION_LOST
+from bw2python.reactor import Reactor
+from mockAgent import MockAgent
+
+URI = "scratch.ns/unittests/python"
+
+class TestHeartbeat(unittest.TestCase):
+    def setUp(self):
+        self.agent = MockAgent()
+        self.reactor = None
+
+    def tearDown(self):
+        self.client.close()
+        self.agent.close()
+        if self.reactor is not None:
+            self.reactor.close()
+
+    def waitFor(self, condition):
+        deadline = time.time() + 5
+        while not condition() and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(condition())
+
+    def testRoundTripTimes(self):
+        self.client = self.agent.connect()
+        self.client.startHeartbeat(interval=0.01, timeout=1)
+        self.waitFor(lambda: self.client.heartbeat_stats.probes >= 3)
+        stats = self.client.heartbeat_stats
+        self.assertEqual(0, stats.stalls)
+        self.assertTrue(stats.last_rtt is not None and stats.smoothed_rtt is not None)
+        self.assertTrue(len(stats.recent_rtts) >= 3)
+
+        self.client.stopHeartbeat()
+        time.sleep(0.05)
+        probes = len([f for f in self.agent.received if f.command == "resa"])
+        time.sleep(0.05)
+        self.assertEqual(probes, len([f for f in self.agent.received if f.command == "resa"]))
+
+    def stall(self):
+        # The agent stops answering without closing the connection
+        self.agent.handlers["resa"] = lambda agent, frame: None
+        self.agent.handlers["publ"] = lambda agent, frame: None
+
+    def testStallFailsWaitingRequests(self):
+        self.client = self.agent.connect()
+        self.stall()
+        self.client.startHeartbeat(interval=0.02, timeout=0.1)
+        with self.assertRaises(RuntimeError) as context:
+            self.client.publish(URI)
+        self.assertTrue(CONNECTION_LOST in str(context.exception))
+        self.assertFalse(self.client.connected)
+        self.assertEqual(1, self.client.heartbeat_stats.stalls)
+
+    def testStallFailsAnsweredQuery(self):
+        # The query is acknowledged, then the agent stops answering
+        self.client = self.agent.connect()
+        self.agent.handlers["quer"] = lambda agent, frame: agent.respond(frame)
+        self.agent.handlers["resa"] = lambda agent, frame: None
+        self.client.startHeartbeat(interval=0.02, timeout=0.1)
+        with self.assertRaises(RuntimeError) as context:
+            self.client.query(URI)
+        self.assertTrue(CONNECTION_LOST in str(context.exception))
+        self.assertEqual(1, self.client.heartbeat_stats.stalls)
+
+    def testReconnectAfterStall(self):
+        self.client = self.agent.connect()
+        self.stall()
+        self.client.startHeartbeat(interval=0.02, timeout=0.1)
+        self.waitFor(lambda: not self.client.connected)
+        del self.agent.handlers["resa"]
+        del self.agent.handlers["publ"]
+        self.client.reconnect()
+        self.client.publish(URI)
+        probes = self.client.heartbeat_stats.probes
+        self.waitFor(lambda: self.client.heartbeat_stats.probes > probes)
+
+    def testReactorStall(self):
+        self.reactor = Reactor(workers=1)
+        self.client = self.agent.connect(reactor=self.reactor)
+        self.stall()
+        self.client.startHeartbeat(interval=0.02, timeout=0.1)
+        with self.assertRaises(RuntimeError):
+            self.client.publish(URI)
+        self.waitFor(lambda: len(self.reactor) == 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+import threading
+import unittest
+
+from bw2python import ponames
+from bw2python.bwtypes import PayloadObject
+from bw2python.multiplexer import SubscriptionMultiplexer, URITrie, uriCovers
+from mockAgent import MockAgent
+
+class TestURITrie(unittest.TestCase):
+    def testMatch(self):
+        trie = URITrie()
+        trie.add("building/floor1/room1/temp", "exact")
+        trie.add("building/+/room1/temp", "plus")
+        trie.add("building/*", "star")
+        trie.add("building/*/temp", "inner star")
+        trie.add("campus/*", "other")
+
+        self.assertEqual(set(["exact", "plus", "star", "inner star"]),
+                         set(trie.match("building/floor1/room1/temp")))
+        self.assertEqual(set(["star", "inner star"]), set(trie.match("building/temp")))
+        self.assertEqual(set(["star"]), set(trie.match("building/floor1/room1/humidity")))
+        self.assertEqual([], trie.match("garage/temp"))
+
+    def testRemove(self):
+        trie = URITrie()
+        trie.add("a/+", "first")
+        trie.add("a/+", "second")
+        self.assertEqual(["first", "second"], trie.match("a/b"))
+        self.assertTrue(trie.remove("a/+", "first"))
+        self.assertFalse(trie.remove("a/+", "first"))
+        self.assertEqual(["second"], trie.match("a/b"))
+        self.assertEqual(1, len(trie))
+
+    def testCovers(self):
+        self.assertTrue(uriCovers("building/*", "building/+/temp"))
+        self.assertTrue(uriCovers("building/*", "building/floor1/*"))
+        self.assertTrue(uriCovers("building/+/temp", "building/floor1/temp"))
+        self.assertTrue(uriCovers("a/b", "a/b"))
+        self.assertFalse(uriCovers("building/+/temp", "building/*"))
+        self.assertFalse(uriCovers("building/floor1/*", "building/*"))
+        self.assertFalse(uriCovers("a/+/c", "a/b/+"))
+
+class TestSubscriptionMultiplexer(unittest.TestCase):
+    def setUp(self):
+        self.agent = MockAgent()
+        self.agent.handlers["subs"] = self.onSubscribe
+        self.subscriptions = {}
+        self.bw_client = self.agent.connect()
+        self.mux = SubscriptionMultiplexer(self.bw_client)
+        self.semaphore = threading.Semaphore(0)
+
+    def tearDown(self):
+        self.bw_client.close()
+        self.agent.close()
+
+    def onSubscribe(self, agent, frame):
+        uri = frame.getFirstValue("uri")
+        self.subscriptions[uri] = frame.seq_num
+        agent.respond(frame, kv_pairs=(("handle", uri),))
+
+    def publish(self, upstream_uri, uri):
+        po = PayloadObject(ponames.PODFText, None, uri)
+        self.agent.sendResult(self.subscriptions[upstream_uri], uri, [po])
+
+    def unsubscribedHandles(self):
+        return [f.getFirstValue("handle") for f in self.agent.received if f.command == "usub"]
+
+    def testFanOut(self):
+        received = []
+        def handler(name):
+            def onMessage(message):
+                received.append((name, message.uri))
+                self.semaphore.release()
+            return onMessage
+
+        narrow = self.mux.subscribe("building/+/temp", handler("narrow"))
+        self.mux.subscribe("building/*", handler("wide"))
+        self.mux.subscribe("building/floor1/*", handler("floor1"))
+        self.assertEqual(["building/*"], self.mux.upstreamURIs())
+        self.assertEqual(["building/+/temp"], self.unsubscribedHandles())
+
+        self.publish("building/*", "building/floor1/temp")
+        for _ in range(3):
+            self.semaphore.acquire()
+        self.assertEqual(set([("narrow", "building/floor1/temp"),
+                              ("wide", "building/floor1/temp"),
+                              ("floor1", "building/floor1/temp")]), set(received))
+
+        self.mux.unsubscribe(narrow)
+        del received[:]
+        self.publish("building/*", "building/floor2/temp")
+        self.semaphore.acquire()
+        self.assertEqual([("wide", "building/floor2/temp")], received)
+
+    def testRefCounting(self):
+        first = self.mux.subscribe("campus/a", lambda message: None)
+        second = self.mux.subscribe("campus/a", lambda message: None)
+        self.assertEqual(1, len([f for f in self.agent.received if f.command == "subs"]))
+        self.mux.unsubscribe(first)
+        self.assertEqual([], self.unsubscribedHandles())
+        self.mux.unsubscribe(second)
+        self.assertEqual(["campus/a"], self.unsubscribedHandles())
+        self.assertEqual([], self.mux.upstreamURIs())
+
+    def testPrefixes(self):
+        mux = SubscriptionMultiplexer(self.bw_client, prefixes=["site/*"])
+        mux.subscribe("site/a/+", lambda message: None)
+        mux.subscribe("site/b", lambda message: None)
+        self.assertEqual(["site/*"], mux.upstreamURIs())
+
+if __name__ == "__main__":
+    unittest.main()
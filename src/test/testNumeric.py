@@ -0,0 +1,50 @@
+import math
+import struct
+import unittest
+
+from bw2python import ponames
+from bw2python.bwtypes import BosswaveResult, PayloadObject
+from bw2python.numeric import decodeDoubles, decodeNumeric
+
+def makeResult(uri, pos, timestamp=None):
+    return BosswaveResult("from", uri, [], [], pos, timestamp)
+
+class TestNumeric(unittest.TestCase):
+    def testDecodeDoubles(self):
+        results = [
+            makeResult("a", [PayloadObject(ponames.PODFDouble, None, struct.pack("<d", 1.5))], 10.0),
+            makeResult("b", [PayloadObject(ponames.PODFText, None, "not a number"),
+                             PayloadObject(None, ponames.PONumDouble, struct.pack("<d", -2.0))], 11.0),
+            makeResult("c", [PayloadObject(ponames.PODFText, None, "skip me")], 12.0),
+            makeResult("d", None),
+        ]
+        values, uris, timestamps = decodeDoubles(results)
+        self.assertEqual([1.5, -2.0], list(values))
+        self.assertEqual(["a", "b"], list(uris))
+        self.assertEqual([10.0, 11.0], list(timestamps))
+
+    def testMultipleValuesPerPayload(self):
+        results = [
+            makeResult("a", [PayloadObject(ponames.PODFDouble, None, struct.pack("<3d", 1, 2, 3))]),
+            makeResult("b", [PayloadObject(ponames.PODFDouble, None, struct.pack("<d", 4))], 5.0),
+        ]
+        values, uris, timestamps = decodeDoubles(results)
+        self.assertEqual([1, 2, 3, 4], list(values))
+        self.assertEqual(["a", "a", "a", "b"], list(uris))
+        self.assertTrue(all([math.isnan(t) for t in timestamps[:3]]))
+        self.assertEqual(5.0, timestamps[3])
+
+    def testOtherDtype(self):
+        po_type = (64, 0, 0, 0)
+        results = [makeResult("a", [PayloadObject(po_type, None, struct.pack("<2i", 7, -7))])]
+        values, _, _ = decodeNumeric(results, po_type, "<i4")
+        self.assertEqual([7, -7], list(values))
+
+    def testEmpty(self):
+        values, uris, timestamps = decodeDoubles([])
+        self.assertEqual(0, len(values))
+        self.assertEqual(0, len(uris))
+        self.assertEqual(0, len(timestamps))
+
+if __name__ == "__main__":
+    unittest.main()
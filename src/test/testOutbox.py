@@ -0,0 +1,134 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from bw2python import ponames
+from bw2python.bwtypes import PayloadObject
+from bw2python.outbox import Outbox
+from mockAgent import MockAgent
+
+URI = "scratch.ns/unittests/python"
+
+class TestOutbox(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.agent = MockAgent()
+        self.published = []
+        self.lock = threading.Lock()
+        def onPublish(agent, frame):
+            with self.lock:
+                self.published.append(frame.payload_objects[0].content)
+            agent.respond(frame)
+        self.agent.handlers["publ"] = onPublish
+        self.client = self.agent.connect()
+
+    def tearDown(self):
+        self.client.close()
+        self.agent.close()
+        shutil.rmtree(self.directory)
+
+    def publish(self, outbox, value):
+        outbox.publish(URI, payload_objects=[PayloadObject(ponames.PODFText, None, value)])
+
+    def waitFor(self, condition, timeout=5):
+        deadline = time.time() + timeout
+        while not condition() and time.time() < deadline:
+            time.sleep(0.01)
+
+    def testDirect(self):
+        outbox = Outbox(self.client, self.directory)
+        for i in range(10):
+            self.publish(outbox, str(i))
+        self.waitFor(lambda: len(self.published) == 10)
+        self.assertEqual([str(i) for i in range(10)], self.published)
+        # Logged until acknowledged, even when sent straight away
+        self.waitFor(lambda: outbox.pending() == 0)
+        self.assertEqual(0, outbox.pending())
+        outbox.close()
+
+    def testOutage(self):
+        outbox = Outbox(self.client, self.directory, segment_size=512, retry_interval=0.05)
+        self.publish(outbox, "before")
+        self.waitFor(lambda: len(self.published) == 1)
+
+        self.agent.disconnect()
+        self.waitFor(lambda: not self.client.connected)
+        for i in range(50):
+            self.publish(outbox, "during-{0}".format(i))
+        self.assertEqual(50, outbox.pending())
+        self.assertTrue(len(os.listdir(self.directory)) > 1)
+
+        self.agent.setAvailable(True)
+        self.waitFor(lambda: len(self.published) == 51)
+        self.assertEqual(["before"] + ["during-{0}".format(i) for i in range(50)],
+                         self.published)
+        self.waitFor(lambda: outbox.pending() == 0)
+        self.assertEqual(0, outbox.pending())
+        # Acknowledged segments are compacted away
+        self.assertEqual(1, len(os.listdir(self.directory)))
+        outbox.close()
+
+    def testResume(self):
+        self.agent.disconnect()
+        self.waitFor(lambda: not self.client.connected)
+        outbox = Outbox(self.client, self.directory, retry_interval=60)
+        for i in range(5):
+            self.publish(outbox, str(i))
+        outbox.close()
+
+        self.agent.setAvailable(True)
+        self.client.reconnect()
+        outbox = Outbox(self.client, self.directory)
+        self.assertEqual(5, outbox.pending())
+        self.waitFor(lambda: len(self.published) == 5)
+        self.assertEqual([str(i) for i in range(5)], self.published)
+        self.waitFor(lambda: outbox.pending() == 0)
+        outbox.close()
+
+    def testTooLarge(self):
+        outbox = Outbox(self.client, self.directory, segment_size=512)
+        with self.assertRaises(ValueError):
+            self.publish(outbox, "x" * 1024)
+        self.assertEqual(0, outbox.pending())
+        outbox.close()
+
+    def testOrderAfterLoss(self):
+        # The agent drops the connection on the first publication
+        on_publish = self.agent.handlers["publ"]
+        dropped = []
+        def dropFirst(agent, frame):
+            if len(dropped) == 0:
+                dropped.append(frame)
+                agent.disconnect()
+            else:
+                on_publish(agent, frame)
+        self.agent.handlers["publ"] = dropFirst
+        outbox = Outbox(self.client, self.directory, window=1, retry_interval=0.05)
+        self.publish(outbox, "a")
+        self.publish(outbox, "b")
+        self.waitFor(lambda: not self.client.connected)
+        self.agent.setAvailable(True)
+        self.waitFor(lambda: len(self.published) == 2)
+        self.assertEqual(["a", "b"], self.published)
+        self.waitFor(lambda: outbox.pending() == 0)
+        self.assertEqual(0, outbox.pending())
+        outbox.close()
+
+    def testRate(self):
+        self.agent.disconnect()
+        self.waitFor(lambda: not self.client.connected)
+        outbox = Outbox(self.client, self.directory, rate=50, retry_interval=0.05)
+        for i in range(10):
+            self.publish(outbox, str(i))
+        start = time.time()
+        self.agent.setAvailable(True)
+        self.waitFor(lambda: len(self.published) == 10)
+        self.assertEqual(10, len(self.published))
+        self.assertTrue(time.time() - start >= 0.15)
+        outbox.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import threading
+import unittest
+
+import msgpack
+
+from bw2python import ponames
+from bw2python.bwtypes import CompressedPayloadObject, PayloadObject
+from bw2python.compression import CompressionPolicy
+from bw2python.pocodecs import CodecRegistry, registerCodec
+
+URI = "scratch.ns/unittests/python"
+
+class TestPayloadCodecs(unittest.TestCase):
+    def testDefaultCodecs(self):
+        po = PayloadObject(ponames.PODFMsgPack, None, msgpack.packb({"a": [1, 2]}))
+        self.assertEqual({"a": [1, 2]}, po.value)
+        po = PayloadObject(None, ponames.PONumDouble, "\x00\x00\x00\x00\x00\x00\xf8\x3f")
+        self.assertEqual(1.5, po.value)
+        po = PayloadObject(ponames.PODFString, None, "caf\xc3\xa9")
+        self.assertEqual(u"caf\xe9", po.value)
+        po = PayloadObject(ponames.PODFJSON, None, '{"b": true}')
+        self.assertEqual({"b": True}, po.value)
+
+    def testEncode(self):
+        po = PayloadObject.encode(ponames.PODFMsgPack, [1, "two"])
+        self.assertEqual(ponames.PODFMsgPack, po.type_dotted)
+        self.assertEqual([1, "two"], msgpack.unpackb(po.content))
+        po = PayloadObject.encode(ponames.PONumDouble, 2.25)
+        self.assertEqual(2.25, po.value)
+        po = PayloadObject.encode(ponames.PODFText, u"caf\xe9")
+        self.assertEqual("caf\xc3\xa9", po.content)
+
+    def testValueCached(self):
+        calls = []
+        def decode(data):
+            calls.append(data)
+            return len(data)
+        registerCodec((64, 0, 9, 9), decode)
+
+        po = PayloadObject((64, 0, 9, 9), None, "abc")
+        self.assertEqual(3, po.value)
+        self.assertEqual(3, po.value)
+        self.assertEqual(1, len(calls))
+        po.content = "abcd"
+        self.assertEqual(4, po.value)
+        self.assertEqual(2, len(calls))
+
+    def testMostSpecificMaskWins(self):
+        registry = CodecRegistry()
+        registry.register("2.0.0.0/8", lambda data: "general")
+        registry.register("2.0.3.0/24", lambda data: "specific")
+        self.assertEqual("specific", registry.lookup(ponames.PONumTSTaggedMP).decode(""))
+        self.assertEqual("general", registry.lookup(ponames.PONumMsgPack).decode(""))
+        self.assertIs(None, registry.lookup(ponames.PONumBlob))
+
+    def testUnknownType(self):
+        po = PayloadObject(ponames.PODFBlob, None, "abc")
+        with self.assertRaises(ValueError):
+            po.value
+        with self.assertRaises(ValueError):
+            PayloadObject.encode(ponames.PODFBlob, "abc")
+
+    def testMalformedMsgPack(self):
+        po = PayloadObject(ponames.PODFMsgPack, None, msgpack.packb([1, 2, 3])[:-1])
+        with self.assertRaises(Exception):
+            po.value
+        # The failure must not leave partial data behind for the next decode
+        po = PayloadObject(ponames.PODFMsgPack, None, msgpack.packb("ok") + msgpack.packb(1))
+        self.assertEqual("ok", po.value)
+        po = PayloadObject(ponames.PODFMsgPack, None, msgpack.packb(7))
+        self.assertEqual(7, po.value)
+
+    def testCompressedPayload(self):
+        policy = CompressionPolicy(threshold=0)
+        value = {"readings": range(1000)}
+        po = policy.compress(URI, [PayloadObject.encode(ponames.PODFMsgPack, value)])[0]
+        self.assertTrue(isinstance(po, CompressedPayloadObject))
+        received = CompressedPayloadObject(ponames.PODFMsgPack, None, po.wireContent())
+        self.assertEqual(value, received.value)
+
+    def testThreads(self):
+        errors = []
+        def run(n):
+            try:
+                for i in range(500):
+                    po = PayloadObject.encode(ponames.PODFMsgPack, [n, i])
+                    if po.value != [n, i]:
+                        errors.append((n, i))
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=run, args=(n,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([], errors)
+
+if __name__ == "__main__":
+    unittest.main()
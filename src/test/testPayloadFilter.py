@@ -0,0 +1,92 @@
+import threading
+import unittest
+
+from bw2python import ponames
+from bw2python.bwtypes import Frame, FrameParser, PayloadObject, PayloadTypeFilter
+from mockAgent import MockAgent
+
+URI = "scratch.ns/unittests/python"
+
+def makeResult(seq_num, pos, finished=False):
+    frame = Frame("rslt", seq_num)
+    frame.addKVPair("uri", URI)
+    if finished:
+        frame.addKVPair("finished", "true")
+    frame.addPayloadObjects(pos)
+    return frame
+
+class TestPayloadTypeFilter(unittest.TestCase):
+    def testExactTypes(self):
+        po_filter = PayloadTypeFilter([ponames.PODFDouble, ponames.PONumText])
+        self.assertTrue(po_filter.matchesTypeNum(ponames.PONumDouble))
+        self.assertTrue(po_filter.matchesTypeNum(ponames.PONumText))
+        self.assertFalse(po_filter.matchesTypeNum(ponames.PONumString))
+
+    def testMask(self):
+        po_filter = PayloadTypeFilter("2.0.0.0/8")
+        self.assertTrue(po_filter.matchesTypeNum(ponames.PONumSpawnpointHeartbeat))
+        self.assertFalse(po_filter.matchesTypeNum(ponames.PONumDouble))
+        self.assertTrue(po_filter.matches("2.0.2.1:"))
+        self.assertTrue(po_filter.matches(":33554945"))
+        self.assertFalse(po_filter.matches("1.0.2.0:16777728"))
+
+    def testInvalidSpec(self):
+        with self.assertRaises(ValueError):
+            PayloadTypeFilter("1.0.2.0")
+        with self.assertRaises(ValueError):
+            PayloadTypeFilter("1.0.2.0/33")
+        with self.assertRaises(ValueError):
+            PayloadTypeFilter((1, 0, 2))
+
+    def testParserSkipsPayloads(self):
+        parser = FrameParser()
+        parser.po_filters[7] = PayloadTypeFilter(ponames.PODFDouble)
+        data = makeResult(7, [PayloadObject(ponames.PODFText, None, "metadata" * 100),
+                              PayloadObject(ponames.PODFDouble, None, "\x00" * 8)]).serialize()
+        data += makeResult(7, [PayloadObject(ponames.PODFText, None, "metadata")]).serialize()
+        data += makeResult(7, [], finished=True).serialize()
+        data += makeResult(8, [PayloadObject(ponames.PODFText, None, "other")]).serialize()
+
+        frames = []
+        for i in range(0, len(data), 5):
+            frames += parser.feed(data[i:i+5])
+        self.assertEqual(3, len(frames))
+        self.assertEqual([ponames.PODFDouble],
+                         [po.type_dotted for po in frames[0].payload_objects])
+        self.assertEqual("true", frames[1].getFirstValue("finished"))
+        self.assertEqual(8, frames[2].seq_num)
+        self.assertEqual("other", frames[2].payload_objects[0].content)
+
+class TestFilteredSubscribe(unittest.TestCase):
+    def setUp(self):
+        self.agent = MockAgent()
+        self.agent.handlers["subs"] = self.onSubscribe
+        self.bw_client = self.agent.connect()
+        self.messages = []
+        self.semaphore = threading.Semaphore(0)
+
+    def tearDown(self):
+        self.bw_client.close()
+        self.agent.close()
+
+    def onSubscribe(self, agent, frame):
+        agent.respond(frame, kv_pairs=(("handle", "abc"),))
+        agent.sendResult(frame.seq_num, URI, [PayloadObject(ponames.PODFText, None, "skip")])
+        agent.sendResult(frame.seq_num, URI, [PayloadObject(ponames.PODFText, None, "skip"),
+                                              PayloadObject(ponames.PODFDouble, None, "1" * 8)])
+        agent.sendResult(frame.seq_num, URI, [PayloadObject(ponames.PODFDouble, None, "2" * 8)])
+
+    def onMessage(self, message):
+        self.messages.append(message)
+        self.semaphore.release()
+
+    def testSubscribeWithFilter(self):
+        self.bw_client.subscribe(URI, self.onMessage, po_filter=ponames.PODFMaskDouble)
+        self.semaphore.acquire()
+        self.semaphore.acquire()
+        self.assertEqual(2, len(self.messages))
+        self.assertEqual(["1" * 8], [po.content for po in self.messages[0].payload_objects])
+        self.assertEqual(["2" * 8], [po.content for po in self.messages[1].payload_objects])
+
+if __name__ == "__main__":
+    unittest.main()
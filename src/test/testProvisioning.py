@@ -0,0 +1,120 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from bw2python import ponames
+from bw2python.bwtypes import Frame, PayloadObject
+from bw2python.client import writeDotFile, writeEntityFile
+from mockAgent import MockAgent
+
+class TestProvisioning(unittest.TestCase):
+    def setUp(self):
+        self.agent = MockAgent()
+        self.outstanding = 0
+        self.max_outstanding = 0
+        self.lock = threading.Lock()
+        self.agent.handlers["make"] = self.delayed(self.makeEntity)
+        self.agent.handlers["makd"] = self.delayed(self.makeDot)
+        self.client = self.agent.connect()
+
+    def tearDown(self):
+        self.client.close()
+        self.agent.close()
+
+    def delayed(self, respond):
+        def handler(agent, frame):
+            with self.lock:
+                self.outstanding += 1
+                self.max_outstanding = max(self.max_outstanding, self.outstanding)
+            def run():
+                time.sleep(0.005)
+                with self.lock:
+                    self.outstanding -= 1
+                respond(agent, frame)
+            threading.Thread(target=run).start()
+        return handler
+
+    def makeEntity(self, agent, frame):
+        contact = frame.getFirstValue("contact")
+        response = self.response(frame, "vk", contact + "-vk", contact + "-entity")
+        agent.send(response)
+
+    def makeDot(self, agent, frame):
+        to = frame.getFirstValue("to")
+        if to == "nobody":
+            agent.respond(frame, "error", "Unknown entity")
+            return
+        body = to + ":" + frame.getFirstValue("uri")
+        agent.send(self.response(frame, "hash", body + "-hash", body))
+
+    @staticmethod
+    def response(frame, key, value, content):
+        response = Frame("resp", frame.seq_num)
+        response.addKVPair("status", "okay")
+        response.addKVPair(key, value)
+        response.addPayloadObject(PayloadObject(ponames.PODFROEntityWKey, None, content))
+        return response
+
+    def testMakeEntities(self):
+        specs = [{"contact": "e{0}".format(i)} for i in range(40)]
+        results = list(self.client.makeEntities(specs, window=8))
+        self.assertEqual(40, len(results))
+        for spec, vk, raw_entity in results:
+            self.assertEqual(spec["contact"] + "-vk", vk)
+            self.assertEqual(spec["contact"] + "-entity", raw_entity)
+        self.assertTrue(1 < self.max_outstanding <= 8)
+
+    def testMakeDots(self):
+        specs = [{"to": "e{0}".format(i), "uri": "building/*", "ttl": 2} for i in range(20)]
+        results = dict((spec["to"], (hash_, raw_dot)) for spec, hash_, raw_dot in
+                       self.client.makeDots(iter(specs), window=4))
+        self.assertEqual(20, len(results))
+        self.assertEqual(("e3:building/*-hash", "e3:building/*"), results["e3"])
+        self.assertTrue(self.max_outstanding <= 4)
+
+        frames = [f for f in self.agent.received if f.command == "makd"]
+        self.assertEqual("2", frames[0].getFirstValue("ttl"))
+
+    def testFailures(self):
+        specs = [{"to": "a", "uri": "x"}, {"to": "nobody", "uri": "x"}, {"to": "b", "uri": "x"}]
+        errors = []
+        results = list(self.client.makeDots(specs, window=1,
+                                            on_error=lambda spec, reason: errors.append(reason)))
+        self.assertEqual(["a", "b"], [spec["to"] for spec, _, _ in results])
+        self.assertEqual(["Unknown entity"], errors)
+
+        with self.assertRaises(RuntimeError):
+            list(self.client.makeDots(specs, window=1))
+
+    def testAsyncMakeDot(self):
+        responses = []
+        done = threading.Event()
+        def onResponse(response):
+            responses.append(response)
+            done.set()
+        self.client.asyncMakeDot(onResponse, "alice", "building/floor1/*", ttl=3)
+        done.wait(5)
+        self.assertEqual("okay", responses[0].status)
+        frame = [f for f in self.agent.received if f.command == "makd"][0]
+        self.assertEqual("alice", frame.getFirstValue("to"))
+        self.assertEqual("building/floor1/*", frame.getFirstValue("uri"))
+        self.assertEqual("3", frame.getFirstValue("ttl"))
+
+    def testKeyFiles(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "e.ent")
+            writeEntityFile(path, "entity")
+            with open(path, 'rb') as f:
+                self.assertEqual(chr(50) + "entity", f.read())
+            writeDotFile(path, "dot", is_permission=True)
+            with open(path, 'rb') as f:
+                self.assertEqual(chr(33) + "dot", f.read())
+        finally:
+            shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    unittest.main()
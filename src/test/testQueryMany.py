@@ -0,0 +1,94 @@
+import threading
+import time
+import unittest
+
+from bw2python import ponames
+from bw2python.bwtypes import PayloadObject
+from mockAgent import MockAgent
+
+STORE = {
+    "a/1/temp": "10",
+    "a/2/temp": "20",
+    "b/1/temp": "30",
+}
+
+class TestQueryMany(unittest.TestCase):
+    def setUp(self):
+        self.agent = MockAgent()
+        self.outstanding = 0
+        self.max_outstanding = 0
+        self.lock = threading.Lock()
+        self.agent.handlers["quer"] = self.onQuery
+        self.client = self.agent.connect()
+
+    def tearDown(self):
+        self.client.close()
+        self.agent.close()
+
+    def onQuery(self, agent, frame):
+        pattern = frame.getFirstValue("uri")
+        if pattern == "denied/*":
+            agent.respond(frame, "error", "Permission denied")
+            return
+        agent.respond(frame)
+        if pattern == "slow/*":
+            return
+        with self.lock:
+            self.outstanding += 1
+            self.max_outstanding = max(self.max_outstanding, self.outstanding)
+
+        def run():
+            time.sleep(0.01)
+            prefix = pattern.rstrip("*")
+            for uri in sorted(STORE):
+                if uri.startswith(prefix) or pattern == "*/1/temp" and uri.endswith("/1/temp"):
+                    po = PayloadObject(ponames.PODFText, None, STORE[uri])
+                    agent.sendResult(frame.seq_num, uri, [po])
+            with self.lock:
+                self.outstanding -= 1
+            agent.sendFinished(frame.seq_num)
+        threading.Thread(target=run).start()
+
+    def testQueryMany(self):
+        results, errors = self.client.queryMany(["a/*", "*/1/temp", "b/*", "denied/*", "a/*"])
+        # Messages matched by several patterns appear once
+        self.assertEqual(sorted(STORE), sorted(results))
+        for uri, uri_results in results.items():
+            self.assertEqual([STORE[uri]], [r.payload_objects[0].content for r in uri_results])
+        self.assertEqual({"denied/*": "Permission denied"}, errors)
+        self.assertTrue(self.max_outstanding > 1)
+        self.assertEqual(4, len([f for f in self.agent.received if f.command == "quer"]))
+
+    def testGroupByQuery(self):
+        results, errors = self.client.queryMany(["a/*", "*/1/temp", "b/*", "denied/*"],
+                                                group_by_query=True)
+        self.assertEqual(["*/1/temp", "a/*", "b/*"], sorted(results))
+        self.assertEqual(["a/1/temp", "a/2/temp"], [r.uri for r in results["a/*"]])
+        self.assertEqual(["a/1/temp", "b/1/temp"], [r.uri for r in results["*/1/temp"]])
+        for result in results["a/*"] + results["b/*"]:
+            self.assertEqual(STORE[result.uri], result.payload_objects[0].content)
+        self.assertEqual({"denied/*": "Permission denied"}, errors)
+
+    def testConcurrency(self):
+        patterns = ["a/{0}/*".format(i) for i in range(12)]
+        results, errors = self.client.queryMany(patterns, concurrency=3)
+        self.assertEqual({}, errors)
+        self.assertTrue(self.max_outstanding <= 3)
+
+    def testTimeout(self):
+        start = time.time()
+        results, errors = self.client.queryMany(["slow/*", "a/*"], timeout=0.2)
+        self.assertTrue(time.time() - start < 2)
+        self.assertEqual({"slow/*": "Query timed out"}, errors)
+        self.assertEqual(["a/1/temp", "a/2/temp"], sorted(results))
+
+        # Late results of the abandoned query are ignored
+        seq_num = [f.seq_num for f in self.agent.received
+                   if f.command == "quer" and f.getFirstValue("uri") == "slow/*"][0]
+        self.assertFalse(seq_num in self.client.result_handlers)
+
+    def testEmpty(self):
+        self.assertEqual(({}, {}), self.client.queryMany([]))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+import threading
+import time
+import unittest
+
+from bw2python import ponames
+from bw2python.bwtypes import PayloadObject
+from bw2python.client import CONNECTION_LOST
+from bw2python.reactor import Reactor
+from mockAgent import MockAgent
+
+URI = "scratch.ns/unittests/python"
+
+class TestReactor(unittest.TestCase):
+    def setUp(self):
+        self.reactor = Reactor(workers=2)
+        self.agents = []
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close()
+        for agent in self.agents:
+            agent.close()
+        self.reactor.close()
+
+    def connect(self):
+        agent = MockAgent()
+        self.agents.append(agent)
+        client = agent.connect(reactor=self.reactor)
+        self.clients.append(client)
+        return agent, client
+
+    def testManyClientsOneThread(self):
+        # Each mock agent serves its connection from a thread of its own
+        before = threading.active_count()
+        for _ in range(20):
+            self.connect()
+        self.assertEqual(before + 20, threading.active_count())
+
+        for client in self.clients:
+            client.publish(URI, payload_objects=[PayloadObject(ponames.PODFText, None, "a")])
+        for agent in self.agents:
+            self.assertEqual(["publ"], [f.command for f in agent.received])
+
+    def testResultsInOrder(self):
+        agent, client = self.connect()
+        received = []
+        done = threading.Event()
+        def resultHandler(result):
+            content = result.payload_objects[0].content
+            received.append(content)
+            if content == "99":
+                done.set()
+            # Callbacks may make blocking requests of their own
+            if content == "0":
+                client.publish(URI)
+
+        client.subscribe(URI, resultHandler)
+        seq_num = [f for f in agent.received if f.command == "subs"][0].seq_num
+        for i in range(100):
+            agent.sendResult(seq_num, URI, [PayloadObject(ponames.PODFText, None, str(i))])
+        self.assertTrue(done.wait(5))
+        self.assertEqual([str(i) for i in range(100)], received)
+
+    def testConnectionLost(self):
+        agent, client = self.connect()
+        agent.handlers["publ"] = lambda agent, frame: agent.disconnect()
+        with self.assertRaises(RuntimeError) as context:
+            client.publish(URI)
+        self.assertTrue(CONNECTION_LOST in str(context.exception))
+        deadline = time.time() + 5
+        while len(self.reactor) > 0 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(0, len(self.reactor))
+
+    def testFailingFrameHandler(self):
+        failing_agent, failing_client = self.connect()
+        agent, client = self.connect()
+        def frameHandler(frame):
+            raise KeyError("handler failed")
+        failing_client.subscribeRaw(URI, frameHandler)
+        seq_num = [f for f in failing_agent.received if f.command == "subs"][0].seq_num
+        failing_agent.sendResult(seq_num, URI, [PayloadObject(ponames.PODFText, None, "a")])
+
+        deadline = time.time() + 5
+        while failing_client.connected and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertFalse(failing_client.connected)
+        self.assertTrue(self.reactor.thread.is_alive())
+        client.subscribe(URI, lambda result: None)
+        self.assertEqual(1, len(self.reactor))
+
+    def testReconnect(self):
+        agent, client = self.connect()
+        agent.disconnect()
+        deadline = time.time() + 5
+        while client.connected and time.time() < deadline:
+            time.sleep(0.01)
+        agent.setAvailable(True)
+        client.reconnect()
+        client.publish(URI)
+        self.assertEqual(1, len(self.reactor))
+
+    def testClose(self):
+        agent, client = self.connect()
+        client.close()
+        deadline = time.time() + 5
+        while len(self.reactor) > 0 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(0, len(self.reactor))
+
+if __name__ == "__main__":
+    unittest.main()
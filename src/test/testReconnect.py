@@ -0,0 +1,91 @@
+import socket
+import threading
+import time
+import unittest
+
+from bw2python.client import CONNECTION_LOST
+from mockAgent import MockAgent
+
+URI = "scratch.ns/unittests/python"
+
+class TestReconnect(unittest.TestCase):
+    def setUp(self):
+        self.agent = MockAgent()
+        self.entities = []
+        def setEntity(agent, frame):
+            self.entities.append(frame.payload_objects[0].content)
+            agent.respond(frame, kv_pairs=(("vk", "vk="),))
+        self.agent.handlers["sete"] = setEntity
+        self.client = self.agent.connect()
+
+    def tearDown(self):
+        self.client.close()
+        self.agent.close()
+
+    def waitFor(self, condition):
+        deadline = time.time() + 5
+        while not condition() and time.time() < deadline:
+            time.sleep(0.01)
+
+    def testPendingRequestsFail(self):
+        # The agent never answers, then drops the connection
+        self.agent.handlers["publ"] = lambda agent, frame: agent.disconnect()
+        with self.assertRaises(RuntimeError) as cm:
+            self.client.publish(URI)
+        self.assertTrue(CONNECTION_LOST in str(cm.exception))
+        self.waitFor(lambda: not self.client.connected)
+        self.assertFalse(self.client.connected)
+        self.assertEqual({}, self.client.response_handlers)
+
+    def ackThenDisconnect(self, agent, frame):
+        agent.respond(frame)
+        agent.disconnect()
+
+    def testPendingResultsFail(self):
+        for command in ("quer", "list"):
+            self.agent.handlers[command] = self.ackThenDisconnect
+        operations = [lambda: self.client.query(URI),
+                      lambda: self.client.query(URI, columnar=True),
+                      lambda: self.client.list(URI)]
+        for operation in operations:
+            with self.assertRaises(RuntimeError) as cm:
+                operation()
+            self.assertTrue(CONNECTION_LOST in str(cm.exception))
+            self.agent.setAvailable(True)
+            self.client.reconnect()
+
+    def testSubscriptionErrorHandler(self):
+        results = []
+        reasons = []
+        done = threading.Event()
+        def errorHandler(reason):
+            reasons.append(reason)
+            done.set()
+        self.client.subscribe(URI, results.append, error_handler=errorHandler)
+        self.client.subscribe(URI, results.append)
+        self.agent.disconnect()
+        self.assertTrue(done.wait(5))
+        self.assertEqual([CONNECTION_LOST], reasons)
+        self.assertEqual([], results)
+        self.assertEqual({}, self.client.result_handlers)
+        self.assertEqual({}, self.client.error_handlers)
+
+    def testReconnect(self):
+        self.client.setEntity("key")
+        self.agent.disconnect()
+        self.waitFor(lambda: not self.client.connected)
+        with self.assertRaises(socket.error):
+            self.client.reconnect()
+
+        self.agent.setAvailable(True)
+        self.client.reconnect()
+        self.assertTrue(self.client.connected)
+        self.assertEqual(["key", "key"], self.entities)
+        self.client.publish(URI)
+
+    def testReconnectWhileConnected(self):
+        self.client.reconnect()
+        self.client.publish(URI)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,145 @@
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+from bw2python import ponames
+from bw2python.bwtypes import Frame, PayloadObject
+from bw2python.client import Client
+from bw2python.relay import Relay
+from bw2python.transport import UnixTransport
+from mockAgent import MockAgent
+
+URI = "scratch.ns/unittests/python"
+
+class TestRelay(unittest.TestCase):
+    def setUp(self):
+        self.agent = MockAgent()
+        self.agent.handlers["subs"] = self.onSubscribe
+        self.agent.handlers["quer"] = self.onQuery
+        self.subscriptions = {}
+        self.upstream_client = self.agent.connect()
+
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "relay.sock")
+        self.relay = Relay(self.upstream_client, self.path)
+        self.relay.start()
+        self.local_clients = [Client(transport=UnixTransport(self.path)) for _ in range(2)]
+        self.semaphore = threading.Semaphore(0)
+
+    def tearDown(self):
+        for local_client in self.local_clients:
+            local_client.close()
+        self.relay.close()
+        self.upstream_client.close()
+        self.agent.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def onSubscribe(self, agent, frame):
+        self.subscriptions[frame.getFirstValue("uri")] = frame.seq_num
+        agent.respond(frame, kv_pairs=(("handle", str(frame.seq_num)),))
+
+    def onQuery(self, agent, frame):
+        agent.respond(frame)
+        po = PayloadObject(ponames.PODFText, None, "persisted")
+        agent.sendResult(frame.seq_num, URI, [po])
+        agent.sendFinished(frame.seq_num)
+
+    def commands(self, command):
+        return [f for f in self.agent.received if f.command == command]
+
+    def testSharedSubscription(self):
+        received = []
+        def onMessage(message):
+            received.append(message.payload_objects[0].content)
+            self.semaphore.release()
+
+        handles = [c.subscribe(URI, onMessage) for c in self.local_clients]
+        self.assertEqual(1, len(self.commands("subs")))
+
+        po = PayloadObject(ponames.PODFText, None, "Hello, world!")
+        self.agent.sendResult(self.subscriptions[URI], URI, [po])
+        self.semaphore.acquire()
+        self.semaphore.acquire()
+        self.assertEqual(["Hello, world!", "Hello, world!"], received)
+
+        for local_client, handle in zip(self.local_clients, handles):
+            local_client.unsubscribe(handle)
+        self.assertEqual(1, len(self.commands("usub")))
+
+    def testSubscriptionOptions(self):
+        first = self.local_clients[0].subscribe(URI, lambda message: None,
+                                                primary_access_chain="pac=")
+        self.local_clients[1].subscribe(URI, lambda message: None)
+        self.local_clients[1].subscribe(URI, lambda message: None, primary_access_chain="pac=")
+        subscribed = self.commands("subs")
+        self.assertEqual(2, len(subscribed))
+        self.assertEqual(["pac=", None],
+                         [f.getFirstValue("primary_access_chain") for f in subscribed])
+        self.assertEqual(2, len(self.relay.multiplexers))
+
+        self.local_clients[0].unsubscribe(first)
+        self.assertEqual([], self.commands("usub"))
+
+    def testUnsupportedOption(self):
+        frame = Frame("subs", Frame.generateSequenceNumber())
+        frame.addKVPair("uri", URI)
+        frame.addKVPair("bogus", "true")
+        responses = []
+        def onResponse(response):
+            responses.append(response)
+            self.semaphore.release()
+        self.local_clients[0].asyncRequest(frame, onResponse)
+        self.semaphore.acquire()
+        self.assertEqual("error", responses[0].status)
+        self.assertEqual([], self.commands("subs"))
+
+    def testSlowLocalProcess(self):
+        # Subscribes, then never reads
+        stalled = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stalled.connect(self.path)
+        frame = Frame("subs", Frame.generateSequenceNumber())
+        frame.addKVPair("uri", URI)
+        stalled.sendall(frame.serialize())
+        deadline = time.time() + 5
+        while len(self.relay.multiplexer.local_subscriptions) == 0 and time.time() < deadline:
+            time.sleep(0.01)
+
+        count = 100
+        received = []
+        done = threading.Event()
+        def onMessage(message):
+            received.append(message)
+            if len(received) == count:
+                done.set()
+        self.local_clients[0].subscribe(URI, onMessage)
+        self.assertEqual(1, len(self.commands("subs")))
+
+        po = PayloadObject(ponames.PODFText, None, "x" * 65536)
+        for _ in range(count):
+            self.agent.sendResult(self.subscriptions[URI], URI, [po])
+        done.wait(5)
+        stalled.close()
+        self.assertEqual(count, len(received))
+
+    def testForwardPublishAndQuery(self):
+        po = PayloadObject(ponames.PODFText, None, "Hello, world!")
+        self.local_clients[0].publish(URI, payload_objects=(po,))
+        published = self.commands("publ")
+        self.assertEqual(1, len(published))
+        self.assertEqual(URI, published[0].getFirstValue("uri"))
+        self.assertEqual("Hello, world!", published[0].payload_objects[0].content)
+
+        results = self.local_clients[1].query(URI)
+        self.assertEqual(["persisted"], [r.payload_objects[0].content for r in results])
+
+    def testSetEntityIsLocal(self):
+        self.upstream_client.vk = "relayvk="
+        self.assertEqual("relayvk=", self.local_clients[0].setEntity("key"))
+        self.assertEqual([], self.commands("sete"))
+
+if __name__ == "__main__":
+    unittest.main()
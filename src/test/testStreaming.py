@@ -0,0 +1,121 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from bw2python import ponames
+from bw2python.bwtypes import ColumnarResult, FilePayloadObject, Frame, FrameParser, PayloadObject
+from mockAgent import MockAgent
+
+URI = "scratch.ns/unittests/python"
+BODY = "".join([chr(i % 256) for i in range(300000)])
+
+class TestStreaming(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "firmware.bin")
+        with open(self.path, "wb") as f:
+            f.write("header" + BODY + "trailer")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def testFilePayloadObject(self):
+        po = FilePayloadObject(ponames.PODFBlob, None, self.path, 6, len(BODY))
+        self.assertEqual(len(BODY), po.length)
+        self.assertEqual(BODY, "".join(po.chunks(chunk_size=4096)))
+        self.assertEqual(BODY, po.content)
+        po.close()
+
+        whole = FilePayloadObject(ponames.PODFBlob, None, self.path)
+        self.assertEqual(len(BODY) + 13, whole.length)
+        whole.close()
+
+    def testStreamedFrameMatchesSerialized(self):
+        frame = Frame("publ", 1)
+        frame.addKVPair("uri", URI)
+        po = FilePayloadObject(ponames.PODFBlob, None, self.path, 6, len(BODY))
+        frame.addPayloadObject(po)
+        frame.addPayloadObject(PayloadObject(ponames.PODFText, None, "caption"))
+        self.assertTrue(frame.isStreamed())
+
+        class Collector(object):
+            def __init__(self):
+                self.chunks = []
+            def sendall(self, data):
+                self.chunks.append(data)
+
+        collector = Collector()
+        frame.writeToSocket(collector)
+        self.assertEqual(frame.serialize(), "".join(collector.chunks))
+        po.close()
+
+    def testParserSpills(self):
+        frame = Frame("rslt", 1)
+        frame.addKVPair("uri", URI)
+        frame.addPayloadObject(PayloadObject(ponames.PODFText, None, "small"))
+        frame.addPayloadObject(PayloadObject(ponames.PODFBlob, None, BODY))
+        frame.addPayloadObject(PayloadObject(ponames.PODFText, None, "after"))
+        data = frame.serialize() + frame.serialize()
+
+        parser = FrameParser(spill_threshold=1024)
+        frames = []
+        for i in range(0, len(data), 7000):
+            frames += parser.feed(data[i:i+7000])
+        self.assertEqual(2, len(frames))
+        for parsed in frames:
+            pos = parsed.payload_objects
+            self.assertEqual(["small", BODY, "after"], [po.content for po in pos])
+            self.assertFalse(isinstance(pos[0], FilePayloadObject))
+            self.assertTrue(isinstance(pos[1], FilePayloadObject))
+
+    def testSpilledAndSmallObjectsStayInOrder(self):
+        frame = Frame("rslt", 1)
+        frame.addKVPair("uri", URI)
+        for content in ("small", "x" * 2000, "after", "y" * 2000, "last"):
+            frame.addPayloadObject(PayloadObject(ponames.PODFText, None, content))
+        parsed = FrameParser(spill_threshold=1024).feed(frame.serialize())[0]
+
+        # Nothing is left behind in the raw list once a body has spilled
+        self.assertEqual([], parsed.raw_payload_objects)
+        self.assertEqual(["small", "x" * 2000, "after", "y" * 2000, "last"],
+                         [po.content for po in parsed.payload_objects])
+        columns = ColumnarResult()
+        columns.appendFrame(parsed)
+        self.assertEqual(5, len(columns.po_lengths))
+        self.assertEqual("y" * 2000, columns.getPayload(3))
+
+    def testPublishAndReceiveThroughClient(self):
+        agent = MockAgent()
+        bw_client = agent.connect(spill_threshold=1024)
+        received = []
+        semaphore = threading.Semaphore(0)
+
+        def onSubscribe(agent, frame):
+            agent.respond(frame, kv_pairs=(("handle", "abc"),))
+            self.subscription = frame.seq_num
+        def onPublish(agent, frame):
+            agent.respond(frame)
+            agent.sendResult(self.subscription, URI, frame.payload_objects)
+        agent.handlers["subs"] = onSubscribe
+        agent.handlers["publ"] = onPublish
+
+        def onMessage(message):
+            received.append(message.payload_objects[0])
+            semaphore.release()
+
+        try:
+            bw_client.subscribe(URI, onMessage)
+            po = FilePayloadObject(ponames.PODFBlob, None, self.path, 6, len(BODY))
+            bw_client.publish(URI, payload_objects=(po,))
+            semaphore.acquire()
+            self.assertTrue(isinstance(received[0], FilePayloadObject))
+            self.assertEqual(BODY, received[0].content)
+            po.close()
+        finally:
+            bw_client.close()
+            agent.close()
+
+if __name__ == "__main__":
+    unittest.main()
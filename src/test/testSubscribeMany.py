@@ -0,0 +1,85 @@
+import threading
+import unittest
+
+from bw2python import ponames
+from bw2python.bwtypes import PayloadObject
+from mockAgent import MockAgent
+
+URI = "scratch.ns/unittests/python/{0}"
+
+class TestSubscribeMany(unittest.TestCase):
+    def setUp(self):
+        self.agent = MockAgent()
+        self.subscriptions = {}
+        self.pending = []
+        self.lock = threading.Lock()
+        self.agent.handlers["subs"] = self.onSubscribe
+        self.agent.handlers["usub"] = self.onUnsubscribe
+        self.client = self.agent.connect()
+
+    def tearDown(self):
+        self.client.close()
+        self.agent.close()
+
+    def onSubscribe(self, agent, frame):
+        with self.lock:
+            # Responses are held back until every request has arrived, so a
+            # client that waits for each response in turn would deadlock
+            self.pending.append(frame)
+            if len(self.pending) < self.expected:
+                return
+            pending, self.pending = self.pending, []
+        for f in pending:
+            uri = f.getFirstValue("uri")
+            if uri.endswith("denied"):
+                agent.respond(f, "error", "Permission denied")
+            else:
+                self.subscriptions[uri] = f.seq_num
+                agent.respond(f, kv_pairs=(("handle", "h-" + uri),))
+
+    def onUnsubscribe(self, agent, frame):
+        handle = frame.getFirstValue("handle")
+        if handle.startswith("h-"):
+            agent.respond(frame)
+        else:
+            agent.respond(frame, "error", "Unknown handle")
+
+    def testSubscribeMany(self):
+        received = []
+        done = threading.Event()
+        def onMessage(result):
+            received.append(result.uri)
+            done.set()
+
+        uris = [URI.format(i) for i in range(50)] + [URI.format("denied")]
+        self.expected = len(uris)
+        handles, errors = self.client.subscribeMany(
+                [{"uri": uri, "result_handler": onMessage} for uri in uris])
+        self.assertEqual(51, len(handles))
+        self.assertEqual("h-" + URI.format(7), handles[7])
+        self.assertEqual(None, handles[50])
+        self.assertEqual({50: "Permission denied"}, errors)
+
+        po = PayloadObject(ponames.PODFText, None, "hello")
+        self.agent.sendResult(self.subscriptions[URI.format(3)], URI.format(3), [po])
+        done.wait(5)
+        self.assertEqual([URI.format(3)], received)
+
+        errors = self.client.unsubscribeMany(handles[:50] + ["bogus"])
+        self.assertEqual({"bogus": "Unknown handle"}, errors)
+
+    def testDuplicateURIs(self):
+        uris = [URI.format("same"), URI.format("same"), URI.format("denied")]
+        self.expected = len(uris)
+        handles, errors = self.client.subscribeMany(
+                [{"uri": uri, "result_handler": lambda result: None} for uri in uris])
+        self.assertEqual(3, len(handles))
+        self.assertEqual(["h-" + URI.format("same")] * 2, handles[:2])
+        self.assertEqual({2: "Permission denied"}, errors)
+
+    def testEmpty(self):
+        self.assertEqual(([], {}), self.client.subscribeMany([]))
+        self.assertEqual({}, self.client.unsubscribeMany([]))
+
+if __name__ == "__main__":
+    unittest.main()
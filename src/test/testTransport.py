@@ -0,0 +1,88 @@
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+from bw2python.bwtypes import Frame
+from bw2python.client import Client
+from bw2python.transport import LoopbackTransport, TCPTransport, UnixTransport, \
+                                transportFromAddress
+
+class TestTransport(unittest.TestCase):
+    def testParseTCPAddress(self):
+        transport = transportFromAddress("agent.local:4000")
+        self.assertIsInstance(transport, TCPTransport)
+        self.assertEqual("agent.local", transport.host_name)
+        self.assertEqual(4000, transport.port)
+
+    def testParseUnixAddress(self):
+        transport = transportFromAddress("unix:///var/run/bw2.sock")
+        self.assertIsInstance(transport, UnixTransport)
+        self.assertEqual("/var/run/bw2.sock", transport.path)
+
+    def testParseInvalidAddress(self):
+        with self.assertRaises(ValueError):
+            transportFromAddress("localhost")
+        with self.assertRaises(ValueError):
+            transportFromAddress("localhost:port")
+        with self.assertRaises(ValueError):
+            transportFromAddress("unix://")
+
+    def testLoopbackHandshake(self):
+        transport = LoopbackTransport()
+        bw_client = Client(transport=transport)
+        self.assertIsNotNone(transport.agent_socket)
+        self.assertIsNone(bw_client.host_name)
+        self.assertIsNone(bw_client.port)
+        bw_client.close()
+
+    def testTCPAddressAttributes(self):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(1)
+        port = listener.getsockname()[1]
+
+        def agent():
+            conn, _ = listener.accept()
+            Frame("helo", 0).writeToSocket(conn)
+            self.agent_conn = conn
+
+        agent_thread = threading.Thread(target=agent)
+        agent_thread.start()
+        try:
+            bw_client = Client("127.0.0.1", port)
+            agent_thread.join()
+            self.assertEqual("127.0.0.1", bw_client.host_name)
+            self.assertEqual(port, bw_client.port)
+            bw_client.close()
+            self.agent_conn.close()
+        finally:
+            listener.close()
+
+    def testUnixHandshake(self):
+        tmp_dir = tempfile.mkdtemp()
+        path = os.path.join(tmp_dir, "agent.sock")
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(path)
+        listener.listen(1)
+
+        def agent():
+            conn, _ = listener.accept()
+            Frame("helo", 0).writeToSocket(conn)
+            self.agent_conn = conn
+
+        agent_thread = threading.Thread(target=agent)
+        agent_thread.start()
+        try:
+            bw_client = Client(transport=transportFromAddress("unix://" + path))
+            agent_thread.join()
+            bw_client.close()
+            self.agent_conn.close()
+        finally:
+            listener.close()
+            shutil.rmtree(tmp_dir)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+import time
+import unittest
+
+from bw2python import ponames
+from bw2python.bwtypes import Frame, PayloadObject, UNACKED_SEQ_NUM
+from mockAgent import MockAgent
+
+URI = "scratch.ns/unittests/python"
+
+class TestUnackedPublish(unittest.TestCase):
+    def setUp(self):
+        self.agent = MockAgent()
+        def onPublish(agent, frame):
+            if frame.getFirstValue("uri").endswith("denied"):
+                agent.respond(frame, "error", "Permission denied")
+            else:
+                agent.respond(frame)
+        self.agent.handlers["publ"] = onPublish
+        self.client = self.agent.connect()
+
+    def tearDown(self):
+        self.client.close()
+        self.agent.close()
+
+    def waitForResponses(self, count):
+        stats = self.client.unacked_stats
+        deadline = time.time() + 5
+        while stats.acknowledged + stats.failed < count and time.time() < deadline:
+            time.sleep(0.01)
+
+    def testPublishUnacked(self):
+        po = PayloadObject(ponames.PODFText, None, "hello")
+        for i in range(100):
+            self.client.publishUnacked(URI, payload_objects=[po])
+        for i in range(3):
+            self.client.publishUnacked(URI + "/denied", payload_objects=[po])
+        self.waitForResponses(103)
+
+        stats = self.client.unacked_stats
+        self.assertEqual(103, stats.sent)
+        self.assertEqual(100, stats.acknowledged)
+        self.assertEqual(3, stats.failed)
+        self.assertEqual(["Permission denied"] * 3, list(stats.recent_errors))
+        self.assertEqual({}, self.client.response_handlers)
+
+        frames = [f for f in self.agent.received if f.command == "publ"]
+        self.assertEqual(103, len(frames))
+        self.assertTrue(all(f.seq_num == UNACKED_SEQ_NUM for f in frames))
+        self.assertEqual("hello", frames[0].payload_objects[0].content)
+
+    def testSequenceNumbers(self):
+        for _ in range(1000):
+            self.assertNotEqual(UNACKED_SEQ_NUM, Frame.generateSequenceNumber())
+
+    def testAckedPublishUnaffected(self):
+        self.client.publishUnacked(URI + "/denied")
+        self.client.publish(URI)
+        with self.assertRaises(RuntimeError):
+            self.client.publish(URI + "/denied")
+        self.waitForResponses(1)
+        self.assertEqual(1, self.client.unacked_stats.failed)
+
+if __name__ == "__main__":
+    unittest.main()
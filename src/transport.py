@@ -0,0 +1,68 @@
+import socket
+
+from bwtypes import Frame
+
+DEFAULT_HOST = "localhost"
+DEFAULT_PORT = 28589
+UNIX_SCHEME = "unix://"
+
+# A transport knows how to open a connection to a Bosswave agent. Its
+# connect() method returns a connected, socket-like object.
+
+class TCPTransport(object):
+    def __init__(self, host_name=DEFAULT_HOST, port=DEFAULT_PORT):
+        self.host_name = host_name
+        self.port = port
+
+    def connect(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.connect((self.host_name, self.port))
+        return sock
+
+    def __str__(self):
+        return "{0}:{1}".format(self.host_name, self.port)
+
+class UnixTransport(object):
+    def __init__(self, path):
+        self.path = path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.path)
+        return sock
+
+    def __str__(self):
+        return UNIX_SCHEME + self.path
+
+class LoopbackTransport(object):
+    # In-process transport for tests and benchmarks. The agent's end of the
+    # connection is exposed as agent_socket; a "helo" frame is already queued
+    # on it so that a Client can complete its handshake immediately.
+    def __init__(self, send_helo=True):
+        self.send_helo = send_helo
+        self.agent_socket = None
+
+    def connect(self):
+        client_sock, self.agent_socket = socket.socketpair()
+        if self.send_helo:
+            Frame("helo", 0).writeToSocket(self.agent_socket)
+        return client_sock
+
+    def __str__(self):
+        return "loopback"
+
+def transportFromAddress(address):
+    if address.startswith(UNIX_SCHEME):
+        path = address[len(UNIX_SCHEME):]
+        if len(path) == 0:
+            raise ValueError("Unix socket address contains no path: " + address)
+        return UnixTransport(path)
+
+    tokens = address.split(':')
+    if len(tokens) != 2:
+        raise ValueError("Invalid agent address: " + address)
+    try:
+        port = int(tokens[1])
+    except ValueError:
+        raise ValueError("Agent address " + address + " contains invalid port")
+    return TCPTransport(tokens[0], port)